@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Adaptive densifier
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+from typing import (
+    Dict,
+    List,
+    Tuple,
+    Union
+)
+
+from qgis.core import (
+    QgsCurvePolygon,
+    QgsGeometry,
+    QgsLineString,
+    QgsPoint,
+    QgsVertexId
+)
+
+from vector_correction.core.geometry_transformer import (
+    ExtentGeometryTransformer,
+    ReprojectingGeometryTransformer
+)
+
+
+class AdaptiveDensifier:
+    """
+    Inserts extra vertices along straight segments where a non-linear transform would bend the segment.
+
+    Moving only the existing vertices of a geometry leaves long segments straight, even though
+    non-linear transforms (e.g. polynomial or thin plate spline methods) bend space. For every segment
+    with both ends inside the correction extent, the transformed segment midpoint is compared with
+    the midpoint of the transformed ends. If they differ by more than the tolerance the midpoint
+    is inserted as a new vertex and both halves are tested again.
+
+    Segments are refined breadth-first, one level at a time for all segments of a geometry, so
+    straight (or linearly transformed) segments are never subdivided. Curved segments are left unchanged.
+    """
+
+    DEFAULT_MAXIMUM_DEPTH = 8
+
+    def __init__(self, transformer: Union[ExtentGeometryTransformer, ReprojectingGeometryTransformer],
+                 tolerance: float,
+                 maximum_depth: int = DEFAULT_MAXIMUM_DEPTH):
+        """
+        Constructor for AdaptiveDensifier.
+
+        :param transformer: transformer which will be used to transform the densified geometry. Transformed
+            vertices are shared with the transformer via its vertex cache.
+        :param tolerance: maximum allowed deviation of a transformed segment from the true transformed curve,
+            in geometry CRS units
+        :param maximum_depth: maximum number of times to subdivide each original segment
+        """
+        self.transformer = transformer
+        self.tolerance = tolerance
+        self.maximum_depth = maximum_depth
+        self.inserted_vertex_count = 0
+
+    def densify(self, geometry: QgsGeometry) -> bool:
+        """
+        Densifies a geometry in place. Returns False if any vertex could not be transformed.
+        """
+        # inserted vertices, keyed by (part, ring) and then by the index of the vertex they are inserted before
+        inserts: Dict[Tuple[int, int], Dict[int, List[QgsPoint]]] = {}
+
+        for part_index, part in enumerate(geometry.constParts()):
+            if isinstance(part, QgsCurvePolygon):
+                rings = [part.exteriorRing()] + [part.interiorRing(i) for i in range(part.numInteriorRings())]
+            else:
+                rings = [part]
+
+            for ring_index, ring in enumerate(rings):
+                if not isinstance(ring, QgsLineString):
+                    continue
+
+                ring_inserts = self._densify_line(ring)
+                if ring_inserts is None:
+                    return False
+                if ring_inserts:
+                    inserts[(part_index, ring_index)] = ring_inserts
+
+        if not inserts:
+            return True
+
+        abstract_geometry = geometry.get()
+        for (part_index, ring_index), ring_inserts in inserts.items():
+            # insert from the end of the ring backwards, so that earlier vertex indices remain valid
+            for vertex_index in sorted(ring_inserts.keys(), reverse=True):
+                for point in reversed(ring_inserts[vertex_index]):
+                    abstract_geometry.insertVertex(QgsVertexId(part_index, ring_index, vertex_index), point)
+                    self.inserted_vertex_count += 1
+
+        return True
+
+    def _densify_line(self, line: QgsLineString):  # pylint: disable=too-many-locals
+        """
+        Calculates the vertices to insert into a line, returning a dictionary of the vertex index to insert before to
+        the list of points to insert, or None if a vertex could not be transformed
+        """
+        segments = self._initial_segments(line.xVector(), line.yVector())
+        if segments is None:
+            return None
+
+        # inserted vertices for each segment, as (t, x, y) tuples
+        inserted: Dict[int, List[Tuple[float, float, float]]] = {}
+        depth = 0
+        while segments and depth < self.maximum_depth:
+            depth += 1
+            next_segments = []
+            for i, t0, t1, start, end in segments:
+                mid_x = (start[0] + end[0]) * 0.5
+                mid_y = (start[1] + end[1]) * 0.5
+                ok, transformed_x, transformed_y = self.transformer.cached_transform_vertex(mid_x, mid_y)
+                if not ok:
+                    return None
+                if transformed_x is None:
+                    continue
+
+                deviation = math.sqrt((transformed_x - (start[2] + end[2]) * 0.5) ** 2 +
+                                      (transformed_y - (start[3] + end[3]) * 0.5) ** 2)
+                if deviation <= self.tolerance:
+                    continue
+
+                t = (t0 + t1) * 0.5
+                inserted.setdefault(i, []).append((t, mid_x, mid_y))
+                mid = (mid_x, mid_y, transformed_x, transformed_y)
+                next_segments.append((i, t0, t, start, mid))
+                next_segments.append((i, t, t1, mid, end))
+
+            segments = next_segments
+
+        return AdaptiveDensifier._inserted_points(line, inserted)
+
+    def _initial_segments(self, xs, ys):
+        """
+        Returns the segments to densify as (segment index, t0, t1, start, end) tuples, where start and end are
+        (x, y, transformed x, transformed y) tuples, or None if a vertex could not be transformed
+        """
+        transformed = []
+        for x, y in zip(xs, ys):
+            ok, transformed_x, transformed_y = self.transformer.cached_transform_vertex(x, y)
+            if not ok:
+                return None
+            transformed.append((transformed_x, transformed_y))
+
+        segments = []
+        for i in range(len(xs) - 1):
+            if transformed[i][0] is None or transformed[i + 1][0] is None:
+                # segment is not completely inside the extent
+                continue
+            segments.append((i, 0.0, 1.0,
+                             (xs[i], ys[i], transformed[i][0], transformed[i][1]),
+                             (xs[i + 1], ys[i + 1], transformed[i + 1][0], transformed[i + 1][1])))
+        return segments
+
+    @staticmethod
+    def _inserted_points(line: QgsLineString, inserted: Dict[int, List[Tuple[float, float, float]]]):
+        """
+        Converts the inserted (t, x, y) tuples for each segment of a line to a dictionary of the vertex index
+        to insert before to the list of points to insert, interpolating z and m values from the segment ends
+        """
+        zs = line.zVector() if line.is3D() else None
+        ms = line.mVector() if line.isMeasure() else None
+
+        res = {}
+        for i, segment_inserts in inserted.items():
+            points = []
+            for t, x, y in sorted(segment_inserts):
+                point = QgsPoint(x, y)
+                if zs is not None:
+                    point.addZValue(zs[i] + (zs[i + 1] - zs[i]) * t)
+                if ms is not None:
+                    point.addMValue(ms[i] + (ms[i + 1] - ms[i]) * t)
+                points.append(point)
+            # insert before the segment end vertex
+            res[i + 1] = points
+        return res
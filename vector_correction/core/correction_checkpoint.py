@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""Correction checkpoint
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import hashlib
+import os
+import struct
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set
+)
+
+from qgis.core import (
+    QgsApplication,
+    QgsGeometry,
+    QgsVectorLayer
+)
+
+from vector_correction.core.gcp_collection import Gcp
+
+
+class CorrectionCheckpoint:
+    """
+    A small sidecar file recording the progress of a long running correction, so that an
+    interrupted correction can be resumed without repeating the work which was already saved.
+
+    The file starts with a key identifying the correction run (which includes the GCP fingerprint),
+    followed by the GCPs used for the run in the format written by GcpCollection.save_to_file(). A
+    checkpoint is only resumed if both its key and its GCPs match the current run.
+    Before each batch is written, a pending line listing a hash of every corrected geometry in the batch
+    is appended, and once the batch has been saved a line recording it (and optionally its tile) as
+    completed is appended. Lines are only ever appended, so a checkpoint remains usable if QGIS crashes
+    mid-run (an incomplete final line is discarded).
+
+    If a run was interrupted between writing a batch and recording it, its features may or may not
+    have been saved. These pending features are resolved on resume by comparing their current geometries
+    to the recorded hashes, so that saved features are never corrected twice. Coordinates are rounded to
+    a precision (recorded in the file) before hashing, so that providers which round coordinates when
+    saving do not make saved features look unsaved.
+    """
+
+    # default precision for comparing coordinates of layers in projected CRSs
+    DEFAULT_PRECISION = 1e-3
+    # default precision for comparing coordinates of layers in geographic CRSs (around a millimeter)
+    GEOGRAPHIC_PRECISION = 1e-8
+
+    def __init__(self, path: str):
+        """
+        Constructor for CorrectionCheckpoint.
+
+        :param path: path to checkpoint file
+        """
+        self.path = path
+        self.key: Optional[str] = None
+        self.precision = CorrectionCheckpoint.DEFAULT_PRECISION
+        self.gcps: List[Gcp] = []
+        self.completed_tiles: Set[int] = set()
+        self.completed_ids: Set[int] = set()
+        # maps feature ID to geometry hash, for features which may have been saved by an interrupted run
+        self.pending: Dict[int, str] = {}
+        self.resumed = False
+        self.resumed_feature_count = 0
+
+    @staticmethod
+    def path_for_layer(layer: QgsVectorLayer) -> str:
+        """
+        Returns the default checkpoint file path for a layer, inside the QGIS profile folder
+        """
+        name = hashlib.sha1(layer.source().encode()).hexdigest()
+        return os.path.join(QgsApplication.qgisSettingsDirPath(), 'vector_correction', 'checkpoints',
+                            f'{name}.txt')
+
+    @staticmethod
+    def precision_for_layer(layer: QgsVectorLayer) -> float:
+        """
+        Returns the precision for comparing coordinates of a layer's saved geometries, i.e. the layer's
+        geometry precision if set, or otherwise a precision much finer than any meaningful correction
+        """
+        precision = layer.geometryOptions().geometryPrecision()
+        if precision > 0:
+            return precision
+        return CorrectionCheckpoint.GEOGRAPHIC_PRECISION if layer.crs().isGeographic() \
+            else CorrectionCheckpoint.DEFAULT_PRECISION
+
+    @staticmethod
+    def encode_ids(ids: Iterable[int]) -> str:
+        """
+        Encodes a set of feature IDs to a compact string of ranges, e.g. '1:5,8'
+        """
+        ranges = []
+        for _id in sorted(ids):
+            if ranges and ranges[-1][1] == _id - 1:
+                ranges[-1][1] = _id
+            else:
+                ranges.append([_id, _id])
+
+        return ','.join(str(start) if start == end else f'{start}:{end}' for start, end in ranges)
+
+    @staticmethod
+    def decode_ids(string: str) -> Set[int]:
+        """
+        Decodes a string of ranges created by encode_ids()
+        """
+        res = set()
+        for part in string.split(','):
+            if not part:
+                continue
+            start, _, end = part.partition(':')
+            res.update(range(int(start), int(end or start) + 1))
+        return res
+
+    @staticmethod
+    def geometry_hash(geometry: QgsGeometry, precision: float = DEFAULT_PRECISION) -> str:
+        """
+        Returns a hash of the vertex coordinates of a geometry, rounded to the specified precision.
+
+        Only the x and y coordinates are hashed, so the hash is unaffected by a data provider converting
+        the geometry type (e.g. from single to multi part) when the geometry is saved.
+        """
+        res = hashlib.blake2b(digest_size=12)
+        if not geometry.isNull():
+            for vertex in geometry.vertices():
+                res.update(struct.pack('<qq', round(vertex.x() / precision), round(vertex.y() / precision)))
+        return res.hexdigest()
+
+    def exists(self) -> bool:
+        """
+        Returns True if the checkpoint file exists
+        """
+        return os.path.exists(self.path)
+
+    def begin(self, key: str, gcps: List[Gcp], precision: float = DEFAULT_PRECISION) -> bool:
+        """
+        Starts checkpointing a correction run.
+
+        If the file contains a checkpoint for a run with a matching key, then its progress is loaded and
+        True is returned. Otherwise any existing checkpoint is discarded and a new checkpoint is started.
+
+        :param key: key identifying the correction run
+        :param gcps: GCPs used for the run
+        :param precision: precision for comparing coordinates of saved geometries, see precision_for_layer().
+            When resuming, the precision recorded in the checkpoint is used instead.
+        """
+        self.key = key
+        self.precision = precision
+        self.gcps = list(gcps)
+        self.completed_tiles.clear()
+        self.completed_ids.clear()
+        self.pending.clear()
+
+        self.resumed = self._read(key, gcps)
+        if not self.resumed:
+            self.completed_tiles.clear()
+            self.completed_ids.clear()
+            self.pending.clear()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'wt', encoding='utf8') as f:
+                f.write(f'key {key}\n')
+                f.write(f'precision {precision!r}\n')
+                for gcp in gcps:
+                    f.write(f'gcp {gcp.to_string()}\n')
+
+        self.resumed_feature_count = len(self.completed_ids)
+        return self.resumed
+
+    def _read(self, key: str, gcps: List[Gcp]) -> bool:
+        """
+        Reads the progress from an existing checkpoint file, returning False if the file does not exist
+        or is not a checkpoint for the run with the specified key and GCPs
+        """
+        if not self.exists():
+            return False
+
+        with open(self.path, 'rb') as f:
+            content = f.read()
+
+        # anything after the final newline is an incomplete line from an interrupted write
+        complete_length = content.rfind(b'\n') + 1
+        lines = content[:complete_length].decode('utf8').splitlines()
+        if not lines or lines[0] != f'key {key}':
+            return False
+
+        checkpoint_gcps = []
+        try:
+            for line in lines[1:]:
+                kind, _, value = line.partition(' ')
+                if kind == 'gcp':
+                    checkpoint_gcps.append(value)
+                else:
+                    self._read_progress(kind, value)
+        except ValueError:
+            return False
+
+        # the key includes a fingerprint of the GCPs, but only an exact match of the GCPs guarantees
+        # that the saved corrections were made with the same GCPs
+        if checkpoint_gcps != [gcp.to_string() for gcp in gcps]:
+            return False
+        if complete_length < len(content):
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete_length)
+
+        return True
+
+    def _read_progress(self, kind: str, value: str):
+        """
+        Reads a progress line from a checkpoint file
+
+        :raises ValueError: if the line is malformed
+        """
+        if kind == 'precision':
+            self.precision = float(value)
+        elif kind == 'pending':
+            for part in value.split(','):
+                _id, _, geometry_hash = part.partition('=')
+                self.pending[int(_id)] = geometry_hash
+        elif kind == 'ids':
+            ids = CorrectionCheckpoint.decode_ids(value)
+            self.completed_ids.update(ids)
+            for _id in ids:
+                self.pending.pop(_id, None)
+        elif kind == 'tile':
+            self.completed_tiles.add(int(value))
+
+    def record_pending(self, geometries: Dict[int, QgsGeometry]):
+        """
+        Records that a batch of corrected geometries is about to be written. The batch must be
+        recorded as completed via record() once it has been saved.
+        """
+        if not geometries:
+            return
+
+        with open(self.path, 'at', encoding='utf8') as f:
+            f.write('pending ' + ','.join(f'{_id}={CorrectionCheckpoint.geometry_hash(geometry, self.precision)}'
+                                          for _id, geometry in geometries.items()) + '\n')
+
+    def resolve_pending(self, geometries: Dict[int, QgsGeometry]) -> int:
+        """
+        Resolves the pending features from an interrupted run, given their current geometries.
+
+        Features whose geometry matches the corrected geometry recorded before the interrupted write
+        were saved, and are recorded as completed. All other pending features are discarded, so that
+        they are corrected again. Returns the number of features which were saved.
+        """
+        saved_ids = {_id for _id, geometry in geometries.items()
+                     if _id in self.pending and
+                     CorrectionCheckpoint.geometry_hash(geometry, self.precision) == self.pending[_id]}
+        self.pending.clear()
+        if saved_ids:
+            self.record(saved_ids)
+        self.resumed_feature_count += len(saved_ids)
+        return len(saved_ids)
+
+    def record(self, ids: Iterable[int], tile: Optional[int] = None):
+        """
+        Records that the corrections for a batch of features (and optionally a whole tile) have been saved
+        """
+        ids = set(ids)
+        with open(self.path, 'at', encoding='utf8') as f:
+            if ids:
+                f.write(f'ids {CorrectionCheckpoint.encode_ids(ids)}\n')
+            if tile is not None:
+                f.write(f'tile {tile}\n')
+
+        self.completed_ids.update(ids)
+        if tile is not None:
+            self.completed_tiles.add(tile)
+
+    def remove(self):
+        """
+        Removes the checkpoint file, e.g. after a correction run has completed
+        """
+        if self.exists():
+            os.remove(self.path)
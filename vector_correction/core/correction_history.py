@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Correction history
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+from contextlib import contextmanager
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Set
+)
+
+from qgis.PyQt.QtCore import QObject
+from qgis.core import (
+    QgsFeature,
+    QgsGeometry,
+    QgsRectangle,
+    QgsSpatialIndex,
+    QgsVectorLayer
+)
+
+
+class CorrectionHistory(QObject):
+    """
+    Remembers the last correction applied to a layer: the original geometries of the features which
+    were changed, and the fitted transformer which was used.
+
+    This allows a correction made with a local transform method to be updated after the GCPs are changed,
+    by recomputing only the features within the region affected by the changed GCPs (see LayerCorrector).
+
+    Any other change to the geometries of the layer (including undoing the correction) or any new
+    features clear the history, since the remembered geometries no longer describe the layer.
+    """
+
+    def __init__(self, layer: QgsVectorLayer):
+        """
+        Constructor for CorrectionHistory.
+
+        :param layer: corrected layer
+        """
+        super().__init__()
+        self.layer = layer
+        self.key: Optional[str] = None
+        self.transformer = None
+        self.original_geometries: Dict[int, QgsGeometry] = {}
+        self._index = QgsSpatialIndex()
+        self._indexed_ids: Set[int] = set()
+        self._writing = False
+
+        layer.geometryChanged.connect(self._geometry_changed)
+        layer.featureAdded.connect(self._feature_added)
+
+    def is_valid(self) -> bool:
+        """
+        Returns True if the history describes a correction which can be updated
+        """
+        return self.transformer is not None
+
+    def can_update(self, key: str) -> bool:
+        """
+        Returns True if the history can be used to update a correction with the specified key,
+        i.e. a correction of the same extent using the same method and settings
+        """
+        return self.is_valid() and key == self.key
+
+    def clear(self):
+        """
+        Clears the history
+        """
+        self.key = None
+        self.transformer = None
+        self.original_geometries = {}
+        self._index = QgsSpatialIndex()
+        self._indexed_ids = set()
+
+    def reset(self, key: str, transformer, original_geometries: Dict[int, QgsGeometry]):
+        """
+        Replaces the history with a new correction.
+
+        :param key: key identifying the correction's extent, method and settings
+        :param transformer: fitted transformer used for the correction
+        :param original_geometries: original geometries of the changed features
+        """
+        self.clear()
+        self.key = key
+        self.update(transformer, original_geometries, [])
+
+    def update(self, transformer, original_geometries: Dict[int, QgsGeometry], restored_ids: List[int]):
+        """
+        Updates the history after a correction was updated.
+
+        :param transformer: fitted transformer used for the updated correction
+        :param original_geometries: original geometries of features which were changed by the updated correction
+        :param restored_ids: IDs of features which were restored to their original geometries
+        """
+        self.transformer = transformer
+        for _id in restored_ids:
+            self.original_geometries.pop(_id, None)
+
+        for _id, geometry in original_geometries.items():
+            self.original_geometries[_id] = geometry
+            if _id not in self._indexed_ids:
+                # the original geometry of a feature never changes, so index entries are never removed
+                f = QgsFeature(_id)
+                f.setGeometry(geometry)
+                self._index.addFeature(f)
+                self._indexed_ids.add(_id)
+
+    def ids_in_rect(self, rect: QgsRectangle) -> List[int]:
+        """
+        Returns the IDs of changed features with original geometries intersecting a rectangle
+        """
+        return [_id for _id in self._index.intersects(rect) if _id in self.original_geometries]
+
+    @contextmanager
+    def writing(self):
+        """
+        Context manager which must wrap writes of corrected geometries, so that they do not clear the history
+        """
+        self._writing = True
+        try:
+            yield
+        finally:
+            self._writing = False
+
+    def _geometry_changed(self, *args):  # pylint: disable=unused-argument
+        """
+        Triggered when a geometry in the layer is changed
+        """
+        if not self._writing:
+            self.clear()
+
+    def _feature_added(self, *args):  # pylint: disable=unused-argument
+        """
+        Triggered when a feature is added to the layer
+        """
+        self.clear()
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""Displacement grid
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+from array import array
+from typing import (
+    List,
+    Optional,
+    Tuple
+)
+
+from osgeo import gdal
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsRectangle
+)
+
+
+class DisplacementGrid:
+    """
+    A fitted transform sampled onto a regular grid of displacements.
+
+    Evaluating a grid costs a few multiplications per vertex regardless of the transform method
+    or the number of GCPs, so grids are ideal for applying the same dense correction many times.
+    Grids expose the same transform() method as a fitted GCP transformer, so can be used
+    anywhere a fitted transformer is expected (inverse transforms are not supported).
+
+    Grid nodes are stored row by row, starting from the bottom left (minimum x, minimum y) node.
+    """
+
+    BILINEAR = 0
+    BICUBIC = 1
+
+    MAXIMUM_ERROR_SAMPLES = 10000
+    MAXIMUM_CELLS = 4000000
+
+    # value of the TYPE metadata item identifying GeoTIFFs written by write_geotiff()
+    GEOTIFF_TYPE = 'DISPLACEMENT_GRID'
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 x_minimum: float, y_minimum: float,
+                 cell_width: float, cell_height: float,
+                 columns: int, rows: int,
+                 x_displacements: List[float],
+                 y_displacements: List[float],
+                 interpolation: int = BILINEAR,
+                 crs: Optional[QgsCoordinateReferenceSystem] = None):
+        """
+        Constructor for DisplacementGrid.
+
+        :param x_minimum: x coordinate of the bottom left node
+        :param y_minimum: y coordinate of the bottom left node
+        :param cell_width: horizontal spacing of nodes
+        :param cell_height: vertical spacing of nodes
+        :param columns: number of grid cells in the x direction, i.e. one less than the number of node columns
+        :param rows: number of grid cells in the y direction, i.e. one less than the number of node rows
+        :param x_displacements: x displacement for each node
+        :param y_displacements: y displacement for each node
+        :param interpolation: interpolation method, either BILINEAR or BICUBIC
+        :param crs: optional CRS of the grid
+        """
+        self.x_minimum = x_minimum
+        self.y_minimum = y_minimum
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.columns = columns
+        self.rows = rows
+        self.x_displacements = x_displacements
+        self.y_displacements = y_displacements
+        self.interpolation = interpolation
+        self.crs = crs if crs is not None else QgsCoordinateReferenceSystem()
+        self.max_error: Optional[float] = None
+
+    def extent(self) -> QgsRectangle:
+        """
+        Returns the extent covered by the grid nodes
+        """
+        return QgsRectangle(self.x_minimum, self.y_minimum,
+                            self.x_minimum + self.columns * self.cell_width,
+                            self.y_minimum + self.rows * self.cell_height)
+
+    @staticmethod
+    def sample(transformer,  # pylint: disable=too-many-locals
+               extent: QgsRectangle,
+               columns: int,
+               rows: int,
+               interpolation: int = BILINEAR) -> Optional['DisplacementGrid']:
+        """
+        Samples a fitted transformer onto a grid covering the specified extent.
+
+        Returns None if the transformer failed for any of the grid nodes.
+        """
+        columns = max(columns, 1)
+        rows = max(rows, 1)
+        # guard against degenerate extents
+        cell_width = extent.width() / columns or 1.0
+        cell_height = extent.height() / rows or 1.0
+
+        x_displacements = array('d')
+        y_displacements = array('d')
+        for j in range(rows + 1):
+            y = extent.yMinimum() + j * cell_height
+            for i in range(columns + 1):
+                x = extent.xMinimum() + i * cell_width
+                ok, transformed_x, transformed_y = transformer.transform(x, y)
+                if not ok:
+                    return None
+                x_displacements.append(transformed_x - x)
+                y_displacements.append(transformed_y - y)
+
+        return DisplacementGrid(extent.xMinimum(), extent.yMinimum(), cell_width, cell_height,
+                                columns, rows, x_displacements, y_displacements, interpolation)
+
+    @staticmethod
+    def from_transformer(transformer,  # pylint: disable=too-many-arguments
+                         extent: QgsRectangle,
+                         columns: int,
+                         rows: int,
+                         tolerance: Optional[float] = None,
+                         interpolation: int = BILINEAR,
+                         maximum_refinements: int = 3) -> Optional['DisplacementGrid']:
+        """
+        Creates a displacement grid from a fitted transformer.
+
+        If a tolerance is specified, the grid resolution will be doubled (up to maximum_refinements
+        times) until the maximum interpolation error, estimated at the cell centers, is within the tolerance.
+
+        Returns None if the transformer failed for any of the grid nodes.
+        """
+        if columns * rows > DisplacementGrid.MAXIMUM_CELLS:
+            scale = math.sqrt(DisplacementGrid.MAXIMUM_CELLS / (columns * rows))
+            columns = max(1, int(columns * scale))
+            rows = max(1, int(rows * scale))
+
+        refinement = 0
+        while True:
+            grid = DisplacementGrid.sample(transformer, extent, columns, rows, interpolation)
+            if grid is None or tolerance is None:
+                return grid
+
+            grid.max_error = grid.estimate_error(transformer)
+            if grid.max_error <= tolerance or refinement >= maximum_refinements \
+                    or columns * rows * 4 > DisplacementGrid.MAXIMUM_CELLS:
+                return grid
+
+            refinement += 1
+            columns *= 2
+            rows *= 2
+
+    def estimate_error(self, transformer) -> float:
+        """
+        Estimates the maximum interpolation error of the grid compared with a fitted transformer, by
+        comparing both at the grid cell centers
+        """
+        cell_count = self.columns * self.rows
+        step = max(1, math.ceil(math.sqrt(cell_count / DisplacementGrid.MAXIMUM_ERROR_SAMPLES)))
+
+        max_error = 0
+        for j in range(0, self.rows, step):
+            y = self.y_minimum + (j + 0.5) * self.cell_height
+            for i in range(0, self.columns, step):
+                x = self.x_minimum + (i + 0.5) * self.cell_width
+                ok, expected_x, expected_y = transformer.transform(x, y)
+                if not ok:
+                    continue
+                _, grid_x, grid_y = self.transform(x, y)
+                max_error = max(max_error, math.sqrt((grid_x - expected_x) ** 2 + (grid_y - expected_y) ** 2))
+
+        return max_error
+
+    def _node(self, i: int, j: int) -> Tuple[float, float]:
+        """
+        Returns the displacement for a node, clamping to the grid bounds
+        """
+        i = min(max(i, 0), self.columns)
+        j = min(max(j, 0), self.rows)
+        index = j * (self.columns + 1) + i
+        return self.x_displacements[index], self.y_displacements[index]
+
+    @staticmethod
+    def _cubic_weights(t: float) -> Tuple[float, float, float, float]:
+        """
+        Returns the Catmull-Rom interpolation weights for the four nodes around a fractional position
+        """
+        t2 = t * t
+        t3 = t2 * t
+        return ((-t3 + 2 * t2 - t) * 0.5,
+                (3 * t3 - 5 * t2 + 2) * 0.5,
+                (-3 * t3 + 4 * t2 + t) * 0.5,
+                (t3 - t2) * 0.5)
+
+    def displacement(self, x: float, y: float) -> Tuple[float, float]:  # pylint: disable=too-many-locals
+        """
+        Returns the interpolated displacement at a point. Points outside the grid use
+        the displacement from the nearest edge of the grid.
+        """
+        u = min(max((x - self.x_minimum) / self.cell_width, 0), self.columns)
+        v = min(max((y - self.y_minimum) / self.cell_height, 0), self.rows)
+        i = min(int(u), self.columns - 1)
+        j = min(int(v), self.rows - 1)
+        u -= i
+        v -= j
+
+        if self.interpolation == DisplacementGrid.BICUBIC:
+            weights_u = self._cubic_weights(u)
+            weights_v = self._cubic_weights(v)
+            dx = 0
+            dy = 0
+            for row_offset, weight_v in zip(range(-1, 3), weights_v):
+                for column_offset, weight_u in zip(range(-1, 3), weights_u):
+                    node_dx, node_dy = self._node(i + column_offset, j + row_offset)
+                    weight = weight_u * weight_v
+                    dx += weight * node_dx
+                    dy += weight * node_dy
+            return dx, dy
+
+        dx00, dy00 = self._node(i, j)
+        dx10, dy10 = self._node(i + 1, j)
+        dx01, dy01 = self._node(i, j + 1)
+        dx11, dy11 = self._node(i + 1, j + 1)
+        return ((1 - v) * ((1 - u) * dx00 + u * dx10) + v * ((1 - u) * dx01 + u * dx11),
+                (1 - v) * ((1 - u) * dy00 + u * dy10) + v * ((1 - u) * dy01 + u * dy11))
+
+    def transform(self, x: float, y: float, inverse: bool = False) -> Tuple[bool, float, float]:
+        """
+        Transforms a point using the grid, mirroring QgsGcpTransformerInterface.transform()
+        """
+        if inverse:
+            return False, x, y
+
+        dx, dy = self.displacement(x, y)
+        return True, x + dx, y + dy
+
+    def write_geotiff(self, path: str) -> bool:
+        """
+        Writes the grid to a GeoTIFF file, with one band for the x displacements and one for the
+        y displacements. Grid nodes are written as pixel centers.
+        """
+        driver = gdal.GetDriverByName('GTiff')
+        dataset = driver.Create(path, self.columns + 1, self.rows + 1, 2, gdal.GDT_Float64,
+                                options=['COMPRESS=DEFLATE', 'PREDICTOR=3'])
+        if dataset is None:
+            return False
+
+        dataset.SetGeoTransform([self.x_minimum - self.cell_width / 2, self.cell_width, 0,
+                                 self.y_minimum + (self.rows + 0.5) * self.cell_height, 0, -self.cell_height])
+        if self.crs.isValid():
+            dataset.SetProjection(self.crs.toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL))
+        dataset.SetMetadataItem('TYPE', DisplacementGrid.GEOTIFF_TYPE)
+
+        width = self.columns + 1
+        for band_number, (values, description) in enumerate(((self.x_displacements, 'x_offset'),
+                                                             (self.y_displacements, 'y_offset'))):
+            # raster rows run from top to bottom
+            flipped = array('d')
+            for j in range(self.rows, -1, -1):
+                flipped.extend(values[j * width:(j + 1) * width])
+
+            band = dataset.GetRasterBand(band_number + 1)
+            band.SetDescription(description)
+            band.WriteRaster(0, 0, width, self.rows + 1, flipped.tobytes(), buf_type=gdal.GDT_Float64)
+
+        dataset.FlushCache()
+        del dataset
+        return True
+
+    @staticmethod
+    def from_geotiff(path: str, interpolation: int = BILINEAR) -> Optional['DisplacementGrid']:  # pylint: disable=too-many-locals
+        """
+        Reads a grid previously written by write_geotiff().
+
+        Returns None if the file could not be read or is not a displacement grid, e.g. any other raster
+        with two or more bands.
+        """
+        dataset = gdal.Open(path)
+        if dataset is None or dataset.RasterCount < 2:
+            return None
+        if dataset.GetMetadataItem('TYPE') != DisplacementGrid.GEOTIFF_TYPE:
+            return None
+
+        origin_x, cell_width, _, origin_y, _, pixel_height = dataset.GetGeoTransform()
+        width = dataset.RasterXSize
+        height = dataset.RasterYSize
+        cell_height = -pixel_height
+
+        bands = []
+        for band_number in (1, 2):
+            data = array('d')
+            data.frombytes(dataset.GetRasterBand(band_number).ReadRaster(0, 0, width, height,
+                                                                         buf_type=gdal.GDT_Float64))
+            values = array('d')
+            for j in range(height - 1, -1, -1):
+                values.extend(data[j * width:(j + 1) * width])
+            bands.append(values)
+
+        crs = QgsCoordinateReferenceSystem()
+        if dataset.GetProjection():
+            crs = QgsCoordinateReferenceSystem.fromWkt(dataset.GetProjection())
+
+        return DisplacementGrid(origin_x + cell_width / 2,
+                                origin_y - (height - 0.5) * cell_height,
+                                cell_width, cell_height,
+                                width - 1, height - 1,
+                                bands[0], bands[1], interpolation, crs)
@@ -0,0 +1,685 @@
+# -*- coding: utf-8 -*-
+"""GCP collection
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2018 by Nyall Dawson'
+__date__ = '20/04/2018'
+__copyright__ = 'Copyright 2018, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import hashlib
+import math
+import os
+from dataclasses import dataclass
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+
+from qgis.PyQt.QtCore import (
+    QCoreApplication,
+    QFileInfo,
+    QVariant
+)
+from qgis.core import (
+    NULL,
+    QgsPoint,
+    QgsPointXY,
+    QgsGeometry,
+    QgsLineString,
+    QgsRectangle,
+    QgsWkbTypes,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsProject,
+    QgsField,
+    QgsFields,
+    QgsFeature,
+    QgsVectorFileWriter
+)
+
+from vector_correction.core.adaptive_densifier import AdaptiveDensifier
+from vector_correction.core.displacement_grid import DisplacementGrid
+from vector_correction.core.geometry_transformer import (
+    ExtentGeometryTransformer,
+    ReprojectingGeometryTransformer
+)
+from vector_correction.core.profiler import (
+    NULL_PROFILER,
+    Profiler
+)
+from vector_correction.core.robust_fitter import RobustFitter
+from vector_correction.core.settings_registry import SettingsRegistry
+from vector_correction.core.transform_methods import TransformMethods
+from vector_correction.core.transformer_cache import FittedTransformerCache
+from vector_correction.core.vertex_cache import VertexCache
+
+
+@dataclass
+class Gcp:
+    """
+    Encapsulates a GCP
+    """
+    origin: QgsPointXY
+    destination: QgsPointXY
+    crs: QgsCoordinateReferenceSystem
+    residual: float = None
+    outlier: bool = False
+
+    def to_string(self):
+        """
+        Converts the GCP to a string
+        """
+        return f'{self.origin.x()},{self.origin.y()},{self.destination.x()},{self.destination.y()},{self.crs.authid()}'
+
+    @staticmethod
+    def from_string(string):
+        """
+        Creates a GCP from a string
+        """
+        parts = string.split(',')
+        if len(parts) != 5:
+            return None
+
+        return Gcp(QgsPointXY(float(parts[0]), float(parts[1])),
+                   QgsPointXY(float(parts[2]), float(parts[3])),
+                   QgsCoordinateReferenceSystem(parts[4]))
+
+
+@dataclass
+class TransformStatistics:
+    """
+    Counts of the features and vertices changed by a transform
+    """
+    feature_count: int = 0
+    changed_feature_count: int = 0
+    changed_vertex_count: int = 0
+    inserted_vertex_count: int = 0
+    # features whose corrected geometries could not be written to the layer
+    failed_feature_count: int = 0
+
+
+class NotEnoughGcpsException(Exception):
+    """
+    Raised when not enough GCPs are defined for the selected transform method
+    """
+
+
+class TransformCreationException(Exception):
+    """
+    Raised when transform could not be created (eg due to colinear points)
+    """
+
+
+# the collection is the single entry point for fitting, applying and persisting GCPs (and grids sampled from them)
+class GcpCollection:  # pylint: disable=too-many-public-methods
+    """
+    Stores a collection of GCPs and performs the fitting and transformation math for them.
+
+    Unlike GcpManager this class has no dependency on a map canvas or on the Qt model/view
+    framework, so it can be used from scripts, background tasks and worker processes.
+    """
+
+    gcps: List[Gcp]
+
+    EXPORT_BATCH_SIZE = 10000
+
+    def __init__(self, transform_context: Optional[QgsCoordinateTransformContext] = None):
+        """
+        Constructor for GcpCollection.
+
+        :param transform_context: coordinate transform context to use when reprojecting GCPs. If not
+            set the current project's transform context will be used.
+        """
+        self.gcps = []
+        self.transform_context = transform_context
+        self.transformer_cache = FittedTransformerCache()
+        self._fingerprint = None
+        # a displacement grid loaded from file, which is applied instead of the GCPs when set
+        self.loaded_grid: Optional[DisplacementGrid] = None
+        self.loaded_grid_path: Optional[str] = None
+
+    @staticmethod
+    def tr(message: str) -> str:
+        """
+        Get the translation for a string using Qt translation API
+        """
+        # noinspection PyTypeChecker,PyArgumentList,PyCallByClass
+        return QCoreApplication.translate('GcpCollection', message)
+
+    def __len__(self) -> int:
+        return len(self.gcps)
+
+    def coordinate_transform_context(self) -> QgsCoordinateTransformContext:
+        """
+        Returns the coordinate transform context to use for reprojecting GCPs
+        """
+        if self.transform_context is not None:
+            return self.transform_context
+
+        return QgsProject.instance().transformContext()
+
+    def _coordinate_transform(self, transforms: Dict[str, QgsCoordinateTransform],
+                              source_crs: QgsCoordinateReferenceSystem,
+                              destination_crs: QgsCoordinateReferenceSystem) -> QgsCoordinateTransform:
+        """
+        Returns a transform from source_crs to destination_crs, reusing a previously created
+        transform from the transforms dictionary where possible.
+        """
+        key = FittedTransformerCache.crs_key(source_crs)
+        ct = transforms.get(key)
+        if ct is None:
+            ct = QgsCoordinateTransform(source_crs, destination_crs, self.coordinate_transform_context())
+            transforms[key] = ct
+        return ct
+
+    def fingerprint(self) -> str:
+        """
+        Returns a hash uniquely identifying the current set of GCPs.
+
+        The fingerprint is cached, so any code which modifies the GCPs directly (i.e. not through
+        the methods of this class) must call gcps_changed().
+        """
+        if self._fingerprint is None:
+            hasher = hashlib.sha1()
+            for gcp in self.gcps:
+                hasher.update('{},{},{},{},{}\n'.format(gcp.origin.x(), gcp.origin.y(),
+                                                        gcp.destination.x(), gcp.destination.y(),
+                                                        FittedTransformerCache.crs_key(gcp.crs)).encode())
+            self._fingerprint = hasher.hexdigest()
+
+        return self._fingerprint
+
+    def gcps_changed(self):
+        """
+        Must be called whenever the GCPs are modified, in order to invalidate cached values
+        """
+        self._fingerprint = None
+
+    def clear(self):
+        """
+        Removes all GCPs from the collection
+        """
+        self.gcps = []
+        self.gcps_changed()
+
+    def add_gcp(self, origin: QgsPointXY, destination: QgsPointXY, crs: QgsCoordinateReferenceSystem) -> Gcp:
+        """
+        Adds a GCP to the collection, and returns the new GCP
+        """
+        gcp = Gcp(origin=origin, destination=destination, crs=crs)
+        self.gcps.append(gcp)
+        self.gcps_changed()
+        return gcp
+
+    def add_gcps(self, gcps: List[Gcp]):
+        """
+        Adds a list of GCPs to the collection
+        """
+        if not gcps:
+            return
+
+        self.gcps.extend(gcps)
+        self.gcps_changed()
+
+    def remove_rows(self, rows: List[int]):
+        """
+        Removes a list of rows from the collection
+        """
+        for r in sorted(set(rows), reverse=True):
+            del self.gcps[r]
+        self.gcps_changed()
+
+    def to_gcp_transformer(self, destination_crs: QgsCoordinateReferenceSystem,
+                           profiler: Profiler = NULL_PROFILER):
+        """
+        Creates a GCP transformer using the points added to this collection.
+
+        Fitted transformers are cached, so repeated calls for an unchanged set of GCPs, destination
+        CRS and transform method will return the same transformer without refitting. The returned
+        transformer must not be modified.
+
+        :param destination_crs: CRS for the transformer
+        :param profiler: optional profiler for recording fit timings
+        """
+        return self._fitted_gcp_transformer(destination_crs, profiler)[0]
+
+    def _fitted_gcp_transformer(self, destination_crs: QgsCoordinateReferenceSystem,
+                                profiler: Profiler = NULL_PROFILER) -> Tuple[object, Optional[List[bool]]]:
+        """
+        Returns the (possibly cached) fitted GCP transformer, along with the inlier flags for the GCPs it was
+        fitted to if robust fitting is enabled (or None otherwise).
+
+        See to_gcp_transformer().
+        """
+        cache_key = self.transformer_key(destination_crs)
+        fitted = self.transformer_cache.get(cache_key)
+        if fitted is not None:
+            profiler.count('fit_cache_hits')
+            return fitted
+
+        with profiler.stage('fit'):
+            fitted = self._fit_gcp_transformer(SettingsRegistry.transform_method(), destination_crs)
+
+        profiler.count('fits')
+        self.transformer_cache.insert(cache_key, fitted)
+        return fitted
+
+    def working_crs(self, default_crs: QgsCoordinateReferenceSystem) -> QgsCoordinateReferenceSystem:
+        """
+        Returns the CRS which corrections are calculated in, i.e. the CRS of the first GCP (as used when
+        calculating residuals), or the CRS of the loaded displacement grid. If there are no GCPs then
+        default_crs is returned.
+
+        Fitting and applying the transform in a single CRS gives consistent corrections for layers
+        in different CRSs, and the transform is only fitted once for all layers.
+        """
+        if self.loaded_grid is not None and self.loaded_grid.crs.isValid():
+            return self.loaded_grid.crs
+        return self.gcps[0].crs if self.gcps else default_crs
+
+    def transformer_key(self, destination_crs: QgsCoordinateReferenceSystem) -> tuple:
+        """
+        Returns a key identifying the transformer which to_gcp_transformer() would return for the current GCPs,
+        destination CRS, transform method and fitting settings
+        """
+        return (self.fingerprint(), FittedTransformerCache.crs_key(destination_crs),
+                int(SettingsRegistry.transform_method()), GcpCollection._robust_fitting_key())
+
+    @staticmethod
+    def _robust_fitting_key():
+        """
+        Returns a value identifying the current robust fitting settings, for use in cache keys
+        """
+        return SettingsRegistry.outlier_threshold() if SettingsRegistry.robust_fitting() else None
+
+    def _fit_gcp_transformer(self, method, destination_crs: QgsCoordinateReferenceSystem):
+        """
+        Fits a new GCP transformer for the specified method and destination CRS.
+
+        If robust fitting is enabled then outlying GCPs are excluded from the fit. Returns a tuple of the
+        transformer and the inlier flags for the GCPs it was fitted to, or None for the flags if robust
+        fitting is disabled.
+        """
+        gcp_transformer = TransformMethods.create(method)
+        if len(self.gcps) < gcp_transformer.minimumGcpCount():
+            raise NotEnoughGcpsException(
+                self.tr('{} transformation requires at least {} points').format(
+                    TransformMethods.method_to_string(method),
+                    gcp_transformer.minimumGcpCount()))
+
+        origin_points = []
+        destination_points = []
+
+        transforms = {}
+        for gcp in self.gcps:
+            ct = self._coordinate_transform(transforms, gcp.crs, destination_crs)
+            origin_points.append(ct.transform(gcp.origin))
+            destination_points.append(ct.transform(gcp.destination))
+
+        if SettingsRegistry.robust_fitting():
+            gcp_transformer, inliers = RobustFitter.fit(method, origin_points, destination_points,
+                                                        SettingsRegistry.outlier_threshold())
+            if gcp_transformer is None:
+                raise TransformCreationException(self.tr('Could not create transform from the defined GCPs'))
+            return gcp_transformer, inliers
+
+        if not gcp_transformer.updateParametersFromGcps(origin_points,
+                                                        destination_points):
+            raise TransformCreationException(self.tr('Could not create transform from the defined GCPs'))
+
+        return gcp_transformer, None
+
+    def to_displacement_grid(self,  # pylint: disable=too-many-locals
+                             destination_crs: QgsCoordinateReferenceSystem,
+                             extent: QgsRectangle,
+                             extent_crs: QgsCoordinateReferenceSystem,
+                             resolution: float,
+                             tolerance: Optional[float] = None,
+                             interpolation: int = DisplacementGrid.BILINEAR,
+                             profiler: Profiler = NULL_PROFILER) -> DisplacementGrid:
+        """
+        Samples the fitted GCP transform onto a displacement grid covering an extent.
+
+        Grids are cached alongside the fitted transformers, so repeated corrections of the same
+        extent reuse the same grid.
+
+        :param destination_crs: CRS for the grid, i.e. the CRS the transform is applied in
+        :param extent: extent to cover
+        :param extent_crs: CRS of extent
+        :param resolution: grid resolution, in extent_crs units
+        :param tolerance: optional maximum interpolation error, in extent_crs units. If specified the grid
+            resolution will be refined until the grid is within the tolerance.
+        :param interpolation: grid interpolation method
+        :param profiler: optional profiler for recording fit timings
+        """
+        transformer = self.to_gcp_transformer(destination_crs, profiler)
+
+        cache_key = (self.fingerprint(), FittedTransformerCache.crs_key(destination_crs),
+                     int(SettingsRegistry.transform_method()), GcpCollection._robust_fitting_key(), 'grid', extent.toString(17),
+                     FittedTransformerCache.crs_key(extent_crs), resolution, tolerance, interpolation)
+        grid = self.transformer_cache.get(cache_key)
+        if grid is not None:
+            profiler.count('grid_cache_hits')
+            return grid
+
+        extent_to_destination = QgsCoordinateTransform(extent_crs, destination_crs,
+                                                       self.coordinate_transform_context())
+        grid_extent = extent_to_destination.transformBoundingBox(extent)
+
+        columns = max(1, math.ceil(extent.width() / resolution))
+        rows = max(1, math.ceil(extent.height() / resolution))
+        scale = grid_extent.width() / extent.width() if extent.width() else 1
+        with profiler.stage('fit/grid'):
+            grid = DisplacementGrid.from_transformer(transformer, grid_extent, columns, rows,
+                                                     tolerance=tolerance * scale if tolerance else None,
+                                                     interpolation=interpolation)
+        if grid is None:
+            raise TransformCreationException(self.tr('Could not create displacement grid from the defined GCPs'))
+
+        grid.crs = destination_crs
+        self.transformer_cache.insert(cache_key, grid)
+        return grid
+
+    def export_displacement_grid(self, path: str, extent: QgsRectangle,
+                                 extent_crs: QgsCoordinateReferenceSystem) -> bool:
+        """
+        Samples the fitted GCP transform onto a displacement grid covering an extent, using the grid
+        resolution, tolerance and interpolation from the plugin settings, and writes it to a GeoTIFF file.
+
+        Returns False if the file could not be written. Raises NotEnoughGcpsException or
+        TransformCreationException if the transform could not be fitted.
+        """
+        grid = self.to_displacement_grid(self.working_crs(extent_crs), extent, extent_crs,
+                                         resolution=SettingsRegistry.displacement_grid_resolution(),
+                                         tolerance=SettingsRegistry.displacement_grid_tolerance(),
+                                         interpolation=SettingsRegistry.displacement_grid_interpolation())
+        return grid.write_geotiff(path)
+
+    def load_displacement_grid(self, path: str) -> bool:
+        """
+        Loads a displacement grid written by export_displacement_grid(). While a grid is loaded, corrections
+        apply the grid instead of the transform fitted to the GCPs.
+
+        Returns False if the file is not a valid displacement grid.
+        """
+        grid = DisplacementGrid.from_geotiff(path, SettingsRegistry.displacement_grid_interpolation())
+        if grid is None:
+            return False
+
+        self.loaded_grid = grid
+        self.loaded_grid_path = path
+        return True
+
+    def clear_displacement_grid(self):
+        """
+        Clears the loaded displacement grid, so that corrections use the GCPs again
+        """
+        self.loaded_grid = None
+        self.loaded_grid_path = None
+
+    def update_residuals(self):
+        """
+        Calculates the residuals for all GCPs in the collection.
+
+        If robust fitting is enabled then GCPs which were excluded from the fit are flagged as outliers.
+        """
+        if not self.gcps:
+            return
+
+        destination_crs = self.gcps[0].crs
+        try:
+            transformer, inliers = self._fitted_gcp_transformer(destination_crs)
+        except NotEnoughGcpsException:
+            transformer = None
+        except TransformCreationException:
+            transformer = None
+
+        if not transformer:
+            for gcp in self.gcps:
+                gcp.residual = None
+                gcp.outlier = False
+            return
+
+        transforms = {}
+        for gcp in self.gcps:
+            ct = self._coordinate_transform(transforms, gcp.crs, destination_crs)
+            src = ct.transform(gcp.origin)
+            ok, x, y = transformer.transform(src.x(), src.y())
+            if ok:
+                dst = ct.transform(gcp.destination)
+                gcp.residual = dst.distance(x, y)
+            else:
+                gcp.residual = None
+
+        if inliers is not None:
+            # flag the GCPs which the fit actually excluded, rather than reclassifying the final residuals
+            for gcp, inlier in zip(self.gcps, inliers):
+                gcp.outlier = not inlier
+        else:
+            for gcp in self.gcps:
+                gcp.outlier = False
+
+    def transform_features(self,  # pylint: disable=too-many-arguments,too-many-locals
+                           features: Dict[int, QgsGeometry],
+                           feature_crs: QgsCoordinateReferenceSystem,
+                           extent: QgsRectangle,
+                           extent_crs: QgsCoordinateReferenceSystem,
+                           statistics: Optional[TransformStatistics] = None,
+                           vertex_cache: Optional[VertexCache] = None,
+                           profiler: Profiler = NULL_PROFILER,
+                           gcp_transformer=None
+                           ) -> Dict[int, QgsGeometry]:
+        """
+        Transforms the specified set of geometries.
+
+        If a displacement grid has been loaded (see load_displacement_grid()) it is applied instead of the GCPs.
+
+        The transform is fitted and applied in the working CRS (see working_crs()). If the features are in
+        a different CRS, each geometry is reprojected to the working CRS and back in batches, rather than
+        reprojecting vertices individually.
+
+        Only features which were changed by the transform are returned, so features which
+        intersect the extent's bounding box but have no vertices inside the extent are skipped.
+        Features which failed to transform are returned as null geometries.
+
+        :param statistics: optional statistics object, which will be updated with the number of
+            features and vertices changed
+        :param vertex_cache: optional cache of corrected vertices, for sharing results between multiple
+            calls with the same extent. If not set a new cache will be used for this call only.
+        :param profiler: optional profiler for recording stage timings and counters
+        :param gcp_transformer: optional fitted transformer for the working CRS, as returned by to_gcp_transformer(),
+            e.g. one shared between multiple calls. If not set the transformer is fitted (or retrieved from the cache).
+            Ignored when a displacement grid is used.
+        """
+        working_crs = self.working_crs(extent_crs)
+        if self.loaded_grid is not None:
+            gcp_transformer = self.loaded_grid
+        elif SettingsRegistry.use_displacement_grid():
+            gcp_transformer = self.to_displacement_grid(working_crs, extent, extent_crs,
+                                                        resolution=SettingsRegistry.displacement_grid_resolution(),
+                                                        tolerance=SettingsRegistry.displacement_grid_tolerance(),
+                                                        interpolation=SettingsRegistry.displacement_grid_interpolation(),
+                                                        profiler=profiler)
+        elif gcp_transformer is None:
+            gcp_transformer = self.to_gcp_transformer(working_crs, profiler)
+
+        working_to_extent_transform = QgsCoordinateTransform(working_crs,
+                                                             extent_crs,
+                                                             self.coordinate_transform_context())
+        feature_to_working_transform = QgsCoordinateTransform(feature_crs,
+                                                              working_crs,
+                                                              self.coordinate_transform_context())
+
+        if statistics is None:
+            statistics = TransformStatistics()
+        if vertex_cache is None:
+            vertex_cache = VertexCache(SettingsRegistry.shared_vertex_tolerance())
+        densify_tolerance = SettingsRegistry.densify_tolerance() if SettingsRegistry.densify() else None
+
+        res = {}
+        with profiler.stage('transform'):
+            for _id, geom in features.items():
+                statistics.feature_count += 1
+                changed_vertex_count = statistics.changed_vertex_count
+                geom = GcpCollection.transform_vertices_in_extent(gcp_transformer, geom, extent,
+                                                                  working_to_extent_transform, statistics,
+                                                                  vertex_cache, densify_tolerance, profiler,
+                                                                  feature_to_working_transform)
+                if geom.isNull() or statistics.changed_vertex_count > changed_vertex_count:
+                    statistics.changed_feature_count += 1
+                    res[_id] = geom
+
+        profiler.count('features', len(features))
+        profiler.count('changed_features', len(res))
+        return res
+
+    @staticmethod
+    def transform_vertices_in_extent(gcp_transformer,  # pylint: disable=too-many-arguments
+                                     geometry: QgsGeometry,
+                                     extent: QgsRectangle,
+                                     geometry_to_extent_transform: QgsCoordinateTransform,
+                                     statistics: Optional[TransformStatistics] = None,
+                                     vertex_cache: Optional[VertexCache] = None,
+                                     densify_tolerance: Optional[float] = None,
+                                     profiler: Profiler = NULL_PROFILER,
+                                     geometry_to_working_transform: Optional[QgsCoordinateTransform] = None
+                                     ) -> QgsGeometry:
+        """
+        Transforms only the vertices within the specified extent.
+
+        All geometry types are supported, including curved geometries. Z and M values are preserved.
+
+        :param gcp_transformer: fitted GCP transformer, as returned by to_gcp_transformer()
+        :param geometry_to_extent_transform: transform from the CRS of the GCP transformer to the extent CRS
+        :param statistics: optional statistics object, which will be updated with the number of
+            vertices changed
+        :param vertex_cache: optional cache of corrected vertices
+        :param densify_tolerance: if set, straight segments will be adaptively densified before transforming
+            so that they follow the transform to within this tolerance (in geometry CRS units)
+        :param profiler: optional profiler for recording vertex timings and counters
+        :param geometry_to_working_transform: optional transform from the geometry CRS to the CRS of the
+            GCP transformer. If not set, the geometry must already be in the GCP transformer's CRS.
+        """
+        if geometry.isNull():
+            return geometry
+
+        transformer = ExtentGeometryTransformer(gcp_transformer, extent, geometry_to_extent_transform, vertex_cache,
+                                                profiler)
+        if geometry_to_working_transform is not None and not geometry_to_working_transform.isShortCircuited():
+            transformer = ReprojectingGeometryTransformer(transformer, geometry_to_working_transform)
+
+        transformer.begin_geometry(geometry)
+
+        if densify_tolerance:
+            densifier = AdaptiveDensifier(transformer, densify_tolerance)
+            with profiler.stage('transform/densify'):
+                if not densifier.densify(geometry):
+                    return QgsGeometry()
+            if statistics is not None:
+                statistics.inserted_vertex_count += densifier.inserted_vertex_count
+
+        if isinstance(transformer, ReprojectingGeometryTransformer):
+            if not transformer.transform(geometry):
+                return QgsGeometry()
+        elif not geometry.get().transform(transformer):
+            return QgsGeometry()
+
+        if statistics is not None:
+            statistics.changed_vertex_count += transformer.changed_vertex_count
+
+        return geometry
+
+    def export_to_layer(self, path: str, batch_size: int = EXPORT_BATCH_SIZE):
+        """
+        Exports the GCPs to a layer at the specified path.
+
+        Features are streamed directly to the output file in batches of batch_size features,
+        so memory use does not grow with the number of GCPs.
+
+        Returns a tuple of the new file name, new layer name and an error message (empty if the
+        export succeeded).
+        """
+        fields = QgsFields()
+        fields.append(QgsField('row', QVariant.Int))
+        fields.append(QgsField('source_x', QVariant.Double))
+        fields.append(QgsField('source_y', QVariant.Double))
+        fields.append(QgsField('dest_x', QVariant.Double))
+        fields.append(QgsField('dest_y', QVariant.Double))
+        fields.append(QgsField('residual', QVariant.Double))
+
+        destination_crs = self.gcps[0].crs
+
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = QgsVectorFileWriter.driverForExtension(os.path.splitext(path)[1])
+        options.layerName = QFileInfo(path).completeBaseName()
+
+        writer = QgsVectorFileWriter.create(path, fields, QgsWkbTypes.LineString, destination_crs,
+                                            self.coordinate_transform_context(), options)
+        try:
+            if writer.hasError():
+                return path, options.layerName, writer.errorMessage()
+
+            transforms = {}
+            features = []
+            for idx, gcp in enumerate(self.gcps):
+                ct = self._coordinate_transform(transforms, gcp.crs, destination_crs)
+                src = ct.transform(gcp.origin)
+                dest = ct.transform(gcp.destination)
+
+                f = QgsFeature(fields)
+                f.setAttributes([idx + 1, gcp.origin.x(), gcp.origin.y(), gcp.destination.x(), gcp.destination.y(),
+                                 gcp.residual if gcp.residual is not None else NULL])
+                f.setGeometry(QgsLineString(QgsPoint(src.x(), src.y()), QgsPoint(dest.x(), dest.y())))
+                features.append(f)
+
+                if len(features) >= batch_size:
+                    if not writer.addFeatures(features):
+                        return path, options.layerName, writer.errorMessage()
+                    features = []
+
+            if features and not writer.addFeatures(features):
+                return path, options.layerName, writer.errorMessage()
+        finally:
+            # flushes and closes the output file
+            del writer
+
+        return path, options.layerName, ''
+
+    def save_to_file(self, path: str):
+        """
+        Saves the GCPs to a file
+        """
+        with open(path, 'wt', encoding='utf8') as f:
+            for gcp in self.gcps:
+                f.write(gcp.to_string() + '\n')
+
+    @staticmethod
+    def read_file(path: str) -> List[Gcp]:
+        """
+        Reads a list of GCPs from a file previously created by save_to_file
+        """
+        res = []
+        with open(path, 'rt', encoding='utf8') as f:
+            for line in f.readlines():
+                gcp = Gcp.from_string(line)
+                if gcp is not None:
+                    res.append(gcp)
+
+        return res
+
+    def load_from_file(self, path: str):
+        """
+        Loads GCPs from a file
+        """
+        self.add_gcps(GcpCollection.read_file(path))
+        self.update_residuals()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""GCP importer
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+from typing import (
+    List,
+    Optional
+)
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCurve,
+    QgsFeatureRequest,
+    QgsPointXY,
+    QgsVectorLayer,
+    QgsWkbTypes
+)
+
+from vector_correction.core.gcp_collection import Gcp
+
+
+class GcpImportException(Exception):
+    """
+    Raised when GCPs could not be imported from a layer
+    """
+
+
+class GcpImporter:
+    """
+    Reads GCPs in bulk from vector layers.
+
+    This is the inverse of GcpCollection.export_to_layer(). GCPs can be read either from a line
+    layer, where the start and end points of each line part are the GCP origin and destination,
+    or from a table of point pairs stored in source_x, source_y, dest_x and dest_y fields.
+    """
+
+    SOURCE_X_FIELD = 'source_x'
+    SOURCE_Y_FIELD = 'source_y'
+    DEST_X_FIELD = 'dest_x'
+    DEST_Y_FIELD = 'dest_y'
+
+    @staticmethod
+    def tr(message: str) -> str:
+        """
+        Get the translation for a string using Qt translation API
+        """
+        # noinspection PyTypeChecker,PyArgumentList,PyCallByClass
+        return QCoreApplication.translate('GcpImporter', message)
+
+    @staticmethod
+    def is_point_pair_table(layer: QgsVectorLayer) -> bool:
+        """
+        Returns True if a layer has the fields required for importing point pairs
+        """
+        fields = layer.fields()
+        return all(fields.lookupField(name) >= 0 for name in (GcpImporter.SOURCE_X_FIELD,
+                                                               GcpImporter.SOURCE_Y_FIELD,
+                                                               GcpImporter.DEST_X_FIELD,
+                                                               GcpImporter.DEST_Y_FIELD))
+
+    @staticmethod
+    def from_layer(layer: QgsVectorLayer, crs: Optional[QgsCoordinateReferenceSystem] = None) -> List[Gcp]:
+        """
+        Reads GCPs from a layer, using the point pair fields if present or otherwise the layer's line geometries.
+
+        :raises GcpImportException: if the layer cannot be imported
+        """
+        if GcpImporter.is_point_pair_table(layer):
+            return GcpImporter.from_point_pair_table(layer, crs)
+
+        return GcpImporter.from_line_layer(layer)
+
+    @staticmethod
+    def from_line_layer(layer: QgsVectorLayer) -> List[Gcp]:
+        """
+        Reads GCPs from a line layer, using the start and end point of each line part
+
+        :raises GcpImportException: if the layer is not a line layer
+        """
+        if layer.geometryType() != QgsWkbTypes.LineGeometry:
+            raise GcpImportException(GcpImporter.tr('Layer {} is not a line layer').format(layer.name()))
+
+        crs = layer.crs()
+        request = QgsFeatureRequest()
+        request.setNoAttributes()
+
+        res = []
+        for f in layer.getFeatures(request):
+            if not f.hasGeometry():
+                continue
+
+            for part in f.geometry().constParts():
+                if not isinstance(part, QgsCurve) or part.isEmpty():
+                    continue
+                start = part.startPoint()
+                end = part.endPoint()
+                res.append(Gcp(QgsPointXY(start.x(), start.y()), QgsPointXY(end.x(), end.y()), crs))
+
+        return res
+
+    @staticmethod
+    def from_point_pair_table(layer: QgsVectorLayer,
+                              crs: Optional[QgsCoordinateReferenceSystem] = None) -> List[Gcp]:
+        """
+        Reads GCPs from a table of point pairs.
+
+        :param layer: layer containing source_x, source_y, dest_x and dest_y fields
+        :param crs: CRS of the point coordinates. If not set the layer's CRS will be used.
+        :raises GcpImportException: if the layer does not contain the required fields, or no CRS is available
+        """
+        if not GcpImporter.is_point_pair_table(layer):
+            raise GcpImportException(
+                GcpImporter.tr('Layer {} must contain {}, {}, {} and {} fields').format(
+                    layer.name(), GcpImporter.SOURCE_X_FIELD, GcpImporter.SOURCE_Y_FIELD,
+                    GcpImporter.DEST_X_FIELD, GcpImporter.DEST_Y_FIELD))
+
+        if crs is None or not crs.isValid():
+            crs = layer.crs()
+        if not crs.isValid():
+            raise GcpImportException(
+                GcpImporter.tr('A CRS must be specified for the points in {}').format(layer.name()))
+
+        fields = layer.fields()
+        indices = [fields.lookupField(name) for name in (GcpImporter.SOURCE_X_FIELD,
+                                                         GcpImporter.SOURCE_Y_FIELD,
+                                                         GcpImporter.DEST_X_FIELD,
+                                                         GcpImporter.DEST_Y_FIELD)]
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(indices)
+
+        res = []
+        for f in layer.getFeatures(request):
+            values = [f.attribute(i) for i in indices]
+            try:
+                source_x, source_y, dest_x, dest_y = (float(v) for v in values)
+            except (TypeError, ValueError):
+                # NULL or non-numeric values
+                continue
+            res.append(Gcp(QgsPointXY(source_x, source_y), QgsPointXY(dest_x, dest_y), crs))
+
+        return res
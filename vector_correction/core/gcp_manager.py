@@ -13,26 +13,24 @@ __copyright__ = 'Copyright 2018, North Road'
 # This will get replaced with a git SHA1 when you do a git archive
 __revision__ = '$Format:%H$'
 
-import os
-from dataclasses import dataclass
-from typing import Dict, List
+from contextlib import contextmanager
+from typing import (
+    Dict,
+    List,
+    Optional
+)
 
 from qgis.PyQt.QtCore import (
     Qt,
     QAbstractTableModel,
     QModelIndex,
-    QObject,
-    QVariant
+    QObject
 )
 from qgis.PyQt.QtGui import (
     QColor
 )
-from qgis.analysis import (
-    QgsGcpTransformerInterface,
-    QgsGcpGeometryTransformer
-)
+from qgis.analysis import QgsGcpGeometryTransformer
 from qgis.core import (
-    NULL,
     QgsPoint,
     QgsPointXY,
     QgsGeometry,
@@ -42,70 +40,40 @@ from qgis.core import (
     QgsWkbTypes,
     QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
-    QgsProject,
     QgsMarkerLineSymbolLayer,
     QgsTemplatedLineSymbolLayerBase,
     QgsMarkerSymbol,
     QgsFontMarkerSymbolLayer,
-    QgsMemoryProviderUtils,
-    QgsField,
-    QgsFields,
-    QgsFeature,
-    QgsVectorFileWriter
+    QgsVectorLayer
 )
 from qgis.gui import (
     QgsMapCanvas,
     QgsRubberBand
 )
 
+from vector_correction.core.gcp_collection import (  # pylint: disable=unused-import
+    Gcp,
+    GcpCollection,
+    NotEnoughGcpsException,
+    TransformCreationException,
+    TransformStatistics
+)
+from vector_correction.core.gcp_importer import GcpImporter
+from vector_correction.core.gcp_spatial_index import GcpSpatialIndex
 from vector_correction.core.settings_registry import SettingsRegistry
+from vector_correction.core.vertex_cache import VertexCache
 
 
-@dataclass
-class Gcp:
-    """
-    Encapsulates a GCP
-    """
-    origin: QgsPointXY
-    destination: QgsPointXY
-    crs: QgsCoordinateReferenceSystem
-    residual: float = None
-
-    def to_string(self):
-        """
-        Converts the GCP to a string
-        """
-        return f'{self.origin.x()},{self.origin.y()},{self.destination.x()},{self.destination.y()},{self.crs.authid()}'
-
-    @staticmethod
-    def from_string(string):
-        """
-        Creates a GCP from a string
-        """
-        parts = string.split(',')
-        if len(parts) != 5:
-            return None
-
-        return Gcp(QgsPointXY(float(parts[0]), float(parts[1])),
-                   QgsPointXY(float(parts[2]), float(parts[3])),
-                   QgsCoordinateReferenceSystem(parts[4]))
-
-
-class NotEnoughGcpsException(Exception):
-    """
-    Raised when not enough GCPs are defined for the selected transform method
-    """
-
-
-class TransformCreationException(Exception):
-    """
-    Raised when transform could not be created (eg due to colinear points)
-    """
-
-
-class GcpManager(QAbstractTableModel):
+# besides the GCP operations, the manager must implement the Qt table model interface and the row based queries
+# used by the map tools, so it exceeds the usual public method count
+class GcpManager(QAbstractTableModel):  # pylint: disable=too-many-public-methods
     """
     Manages a collection of GCPs
+
+    This is a Qt table model and map canvas overlay wrapped around a GcpCollection, which
+    performs the actual storage and math. A spatial index of the GCPs is maintained for picking
+    and neighbourhood queries, so GCPs should be modified via the manager rather than directly
+    through the collection.
     """
 
     COLUMN_ID = 0
@@ -114,16 +82,41 @@ class GcpManager(QAbstractTableModel):
     COLUMN_DESTINATION_X = 3
     COLUMN_DESTINATION_Y = 4
     COLUMN_RESIDUAL = 5
+    COLUMN_STATUS = 6
 
-    gcps: List[Gcp]
+    collection: GcpCollection
     rubber_bands: List[QgsRubberBand]
+    spatial_index: GcpSpatialIndex
 
-    def __init__(self, map_canvas: QgsMapCanvas, parent: QObject = None):
+    def __init__(self, map_canvas: Optional[QgsMapCanvas] = None, parent: QObject = None,
+                 collection: Optional[GcpCollection] = None):
+        """
+        Constructor for GcpManager.
+
+        :param map_canvas: map canvas to show GCP rubber bands in. If not set then no rubber bands
+            will be created.
+        :param parent: parent object
+        :param collection: optional existing GCP collection to wrap
+        """
         super().__init__(parent)
         self.map_canvas = map_canvas
-        self.gcps = []
+        self.collection = collection if collection is not None else GcpCollection()
         self.rubber_bands = []
 
+        self.spatial_index = GcpSpatialIndex(self.collection.transform_context)
+        for gcp in self.gcps:
+            self.spatial_index.insert(gcp)
+        # maps id(gcp) to row, built on demand
+        self._rows: Optional[Dict[int, int]] = None
+        self._batch_depth = 0
+
+    @property
+    def gcps(self) -> List[Gcp]:
+        """
+        Returns the list of GCPs
+        """
+        return self.collection.gcps
+
     def rowCount(self,  # pylint: disable=missing-function-docstring
                  parent: QModelIndex = QModelIndex()) -> int:
         if parent.isValid():
@@ -134,7 +127,7 @@ class GcpManager(QAbstractTableModel):
                     parent: QModelIndex = QModelIndex()) -> int:
         if parent.isValid():
             return 0
-        return 6
+        return 7
 
     def data(self,  # pylint: disable=missing-function-docstring, too-many-return-statements
              index: QModelIndex,
@@ -156,6 +149,14 @@ class GcpManager(QAbstractTableModel):
             if index.column() == GcpManager.COLUMN_RESIDUAL:
                 return "{:.2f}".format(self.gcps[index.row()].residual) if self.gcps[
                                                                                index.row()].residual is not None else None
+            if index.column() == GcpManager.COLUMN_STATUS:
+                if not SettingsRegistry.robust_fitting() or self.gcps[index.row()].residual is None:
+                    return None
+                return self.tr('Outlier') if self.gcps[index.row()].outlier else self.tr('Inlier')
+
+        if role == Qt.ForegroundRole:
+            if self.gcps[index.row()].outlier:
+                return QColor(255, 0, 0)
 
         return None
 
@@ -171,11 +172,71 @@ class GcpManager(QAbstractTableModel):
                     GcpManager.COLUMN_ORIGIN_Y: self.tr('Source Y'),
                     GcpManager.COLUMN_DESTINATION_X: self.tr('Dest X'),
                     GcpManager.COLUMN_DESTINATION_Y: self.tr('Dest Y'),
-                    GcpManager.COLUMN_RESIDUAL: self.tr('Residual')
+                    GcpManager.COLUMN_RESIDUAL: self.tr('Residual'),
+                    GcpManager.COLUMN_STATUS: self.tr('Status')
                 }.get(section, None)
 
         return None
 
+    @contextmanager
+    def batch(self):
+        """
+        Returns a context manager which defers updates while modifying many GCPs, e.g.
+
+            with manager.batch():
+                for origin, destination in pairs:
+                    manager.add_gcp(origin, destination, crs)
+
+        Inside the block no per-row model signals are emitted and residuals, rubber bands and line
+        symbols are not updated. When the outermost block exits the model is reset, residuals are
+        refitted once and all rubber bands are rebuilt in a single pass.
+        """
+        if not self._batch_depth:
+            self.beginResetModel()
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._end_batch()
+
+    def in_batch(self) -> bool:
+        """
+        Returns True if the manager is currently inside a batch() block
+        """
+        return self._batch_depth > 0
+
+    def _end_batch(self):
+        """
+        Applies the updates deferred during a batch
+        """
+        self.collection.update_residuals()
+        self._rebuild_rubber_bands()
+        self.endResetModel()
+
+    def _rebuild_rubber_bands(self):
+        """
+        Recreates the rubber bands for all GCPs
+        """
+        if self.map_canvas is None:
+            return
+
+        for band in self.rubber_bands:
+            self.map_canvas.scene().removeItem(band)
+        self.rubber_bands = []
+        self._add_rubber_bands(self.gcps, 0)
+
+    def _add_rubber_bands(self, gcps: List[Gcp], first_row: int):
+        """
+        Creates rubber bands for a list of GCPs, starting at the specified row
+        """
+        for row, gcp in enumerate(gcps):
+            rubber_band = self._create_rubber_band(first_row + row + 1)
+            rubber_band.setToGeometry(QgsGeometry(QgsLineString(QgsPoint(gcp.origin), QgsPoint(gcp.destination))),
+                                      gcp.crs)
+            self.rubber_bands.append(rubber_band)
+
     def clear(self):
         """
         Clears the GCP manager
@@ -183,25 +244,39 @@ class GcpManager(QAbstractTableModel):
         if not self.gcps:
             return
 
-        self.beginRemoveRows(QModelIndex(), 0, len(self.gcps) - 1)
+        if not self._batch_depth:
+            self.beginRemoveRows(QModelIndex(), 0, len(self.gcps) - 1)
         for band in self.rubber_bands:
             self.map_canvas.scene().removeItem(band)
         self.rubber_bands = []
-        self.gcps = []
-        self.endRemoveRows()
+        self.collection.clear()
+        self.spatial_index.clear()
+        self._rows = None
+        if not self._batch_depth:
+            self.endRemoveRows()
 
     def remove_rows(self, rows: List[int]):
         """
         Removes a list of rows from the manager
         """
         rows.sort(reverse=True)
+        if self._batch_depth:
+            for r in rows:
+                self.spatial_index.remove(self.gcps[r])
+            self.collection.remove_rows(rows)
+            self._rows = None
+            return
+
         for r in rows:
             self.beginRemoveRows(QModelIndex(), r, r)
-            self.map_canvas.scene().removeItem(self.rubber_bands[r])
-            del self.rubber_bands[r]
-            del self.gcps[r]
+            if self.rubber_bands:
+                self.map_canvas.scene().removeItem(self.rubber_bands[r])
+                del self.rubber_bands[r]
+            self.spatial_index.remove(self.gcps[r])
+            self.collection.remove_rows([r])
             self.endRemoveRows()
 
+        self._rows = None
         self.update_residuals()
         self.update_line_symbols()
 
@@ -209,15 +284,79 @@ class GcpManager(QAbstractTableModel):
         """
         Adds a GCP
         """
-        self.beginInsertRows(QModelIndex(), len(self.gcps), len(self.gcps))
-        self.gcps.append(Gcp(origin=origin, destination=destination, crs=crs))
-        self.update_residuals()
+        self.add_gcps([Gcp(origin=origin, destination=destination, crs=crs)])
+
+    def add_gcps(self, gcps: List[Gcp]):
+        """
+        Adds a list of GCPs.
+
+        All GCPs are inserted at once, and the transform is only fitted a single time.
+        """
+        if not gcps:
+            return
+
+        first_row = len(self.gcps)
+        if not self._batch_depth:
+            self.beginInsertRows(QModelIndex(), first_row, first_row + len(gcps) - 1)
+        self.collection.add_gcps(gcps)
+        for row, gcp in enumerate(gcps):
+            self.spatial_index.insert(gcp)
+            if self._rows is not None:
+                self._rows[id(gcp)] = first_row + row
+
+        if self._batch_depth:
+            return
+
+        self.collection.update_residuals()
         self.endInsertRows()
+        self._emit_residuals_changed()
+
+        if self.map_canvas is not None:
+            self._add_rubber_bands(gcps, first_row)
 
-        rubber_band = self._create_rubber_band(len(self.gcps))
-        rubber_band.setToGeometry(QgsGeometry(QgsLineString(QgsPoint(origin), QgsPoint(destination))), crs)
+    def import_from_layer(self, layer: QgsVectorLayer,
+                          crs: Optional[QgsCoordinateReferenceSystem] = None) -> int:
+        """
+        Imports GCPs from a line layer or point pair table, returning the number of GCPs imported.
+
+        :raises GcpImportException: if the layer cannot be imported
+        """
+        gcps = GcpImporter.from_layer(layer, crs)
+        self.add_gcps(gcps)
+        return len(gcps)
+
+    def row_for_gcp(self, gcp: Gcp) -> int:
+        """
+        Returns the row number for a GCP, or -1 if the GCP is not present
+        """
+        if self._rows is None:
+            self._rows = {id(g): row for row, g in enumerate(self.gcps)}
+        return self._rows.get(id(gcp), -1)
+
+    def nearest_gcp_row(self, point: QgsPointXY, crs: QgsCoordinateReferenceSystem,
+                        max_distance: float = 0) -> int:
+        """
+        Returns the row of the GCP with an origin or destination closest to a point, or -1 if no GCP
+        is within max_distance.
+
+        :param point: point to search from
+        :param crs: CRS of point
+        :param max_distance: optional maximum search distance, in the GCP CRS units
+        """
+        gcps = self.spatial_index.nearest(point, crs, 1, max_distance)
+        return self.row_for_gcp(gcps[0]) if gcps else -1
 
-        self.rubber_bands.append(rubber_band)
+    def nearest_gcp_rows(self, point: QgsPointXY, crs: QgsCoordinateReferenceSystem, count: int) -> List[int]:
+        """
+        Returns the rows of the count GCPs closest to a point, closest first
+        """
+        return [self.row_for_gcp(gcp) for gcp in self.spatial_index.nearest(point, crs, count)]
+
+    def gcp_rows_in_rect(self, rect: QgsRectangle, crs: QgsCoordinateReferenceSystem) -> List[int]:
+        """
+        Returns the rows of all GCPs with an origin or destination inside a rectangle
+        """
+        return sorted(self.row_for_gcp(gcp) for gcp in self.spatial_index.intersects(rect, crs))
 
     def _rubber_band_symbol_for_row(self, row_number: int) -> QgsLineSymbol:
         """
@@ -252,6 +391,10 @@ class GcpManager(QAbstractTableModel):
         """
         Updates all existing rubber bands to the current arrow symbol
         """
+        if self._batch_depth:
+            # rubber bands are rebuilt when the batch ends
+            return
+
         for row_number, band in enumerate(self.rubber_bands):
             band.setSymbol(self._rubber_band_symbol_for_row(row_number + 1))
             band.update()
@@ -260,79 +403,44 @@ class GcpManager(QAbstractTableModel):
         """
         Creates a GCP transformer using the points added to this manager
         """
-        current_method = SettingsRegistry.transform_method()
-
-        gcp_transformer = QgsGcpTransformerInterface.create(current_method)
-        if len(self.gcps) < gcp_transformer.minimumGcpCount():
-            raise NotEnoughGcpsException(
-                self.tr('{} transformation requires at least {} points').format(
-                    QgsGcpTransformerInterface.methodToString(current_method),
-                    gcp_transformer.minimumGcpCount()))
-
-        origin_points = []
-        destination_points = []
-
-        for gcp in self.gcps:
-            ct = QgsCoordinateTransform(gcp.crs, destination_crs, QgsProject.instance().transformContext())
-            origin_points.append(ct.transform(gcp.origin))
-            destination_points.append(ct.transform(gcp.destination))
-
-        if not gcp_transformer.updateParametersFromGcps(origin_points,
-                                                        destination_points):
-            raise TransformCreationException(self.tr('Could not create transform from the defined GCPs'))
-
-        return gcp_transformer
+        return self.collection.to_gcp_transformer(destination_crs)
 
     def update_residuals(self):
         """
         Calculates the residuals for all registered GCPs
         """
-        if not self.gcps:
+        if self._batch_depth:
+            # deferred until the batch ends
             return
 
-        destination_crs = self.gcps[0].crs
-        try:
-            transformer = self.to_gcp_transformer(destination_crs)
-        except NotEnoughGcpsException:
-            transformer = None
-        except TransformCreationException:
-            transformer = None
-
-        if not transformer:
-            for gcp in self.gcps:
-                gcp.residual = None
-            return
+        self.collection.update_residuals()
+        self._emit_residuals_changed()
 
-        for gcp in self.gcps:
-            ct = QgsCoordinateTransform(gcp.crs, destination_crs, QgsProject.instance().transformContext())
-            src = ct.transform(gcp.origin)
-            ok, x, y = transformer.transform(src.x(), src.y())
-            if ok:
-                dst = ct.transform(gcp.destination)
-                gcp.residual = dst.distance(x, y)
-            else:
-                gcp.residual = None
-
-    def transform_features(self,
+    def _emit_residuals_changed(self):
+        """
+        Notifies views that the residuals for all rows have changed
+        """
+        if self.gcps:
+            self.dataChanged.emit(self.index(0, GcpManager.COLUMN_RESIDUAL),
+                                  self.index(len(self.gcps) - 1, GcpManager.COLUMN_STATUS))
+
+    def transform_features(self,  # pylint: disable=too-many-arguments
                            features: Dict[int, QgsGeometry],
                            feature_crs: QgsCoordinateReferenceSystem,
                            extent: QgsRectangle,
-                           extent_crs: QgsCoordinateReferenceSystem
-                           ):
+                           extent_crs: QgsCoordinateReferenceSystem,
+                           statistics: Optional[TransformStatistics] = None,
+                           vertex_cache: Optional[VertexCache] = None
+                           ) -> Dict[int, QgsGeometry]:
         """
-        Transforms the specified set of geometries
+        Transforms the specified set of geometries, returning only the changed features
         """
-        gcp_transformer = self.to_gcp_transformer(feature_crs)
-        transformer = QgsGcpGeometryTransformer(gcp_transformer)
-
-        feature_to_extent_transform = QgsCoordinateTransform(feature_crs,
-                                                             extent_crs,
-                                                             QgsProject.instance().transformContext())
-
-        return {
-            _id: GcpManager.transform_vertices_in_extent(transformer, geom, extent, feature_to_extent_transform)
-            for _id, geom in features.items()
-        }
+        return self.collection.transform_features(features=features,
+                                                  feature_crs=feature_crs,
+                                                  extent=extent,
+                                                  extent_crs=extent_crs,
+                                                  statistics=statistics,
+                                                  vertex_cache=vertex_cache)
 
     @staticmethod
     def transform_vertices_in_extent(transformer: QgsGcpGeometryTransformer,
@@ -342,71 +450,23 @@ class GcpManager(QAbstractTableModel):
         """
         Transforms only the vertices within the specified extent
         """
-        to_transform = {}
-
-        for n, point in enumerate(geometry.vertices()):
-            # transform point to extent crs, in order to check exact intersection of the point and the visible extent
-            transformed_point = geometry_to_extent_transform.transform(QgsPointXY(point.x(), point.y()))
-
-            if extent.contains(transformed_point):
-                to_transform[n] = point
-
-        for n, point in to_transform.items():
-            ok, transformed_x, transformed_y = transformer.gcpTransformer().transform(point.x(), point.y())
-            if not ok:
-                return QgsGeometry()
+        return GcpCollection.transform_vertices_in_extent(transformer.gcpTransformer(), geometry, extent,
+                                                          geometry_to_extent_transform)
 
-            geometry.moveVertex(transformed_x, transformed_y, n)
-
-        return geometry
-
-    def export_to_layer(self, path: str):
+    def export_to_layer(self, path: str, batch_size: int = GcpCollection.EXPORT_BATCH_SIZE):
         """
         Exports the GCPs to a layer at the specified path
         """
-        fields = QgsFields()
-        fields.append(QgsField('row', QVariant.Int))
-        fields.append(QgsField('source_x', QVariant.Double))
-        fields.append(QgsField('source_y', QVariant.Double))
-        fields.append(QgsField('dest_x', QVariant.Double))
-        fields.append(QgsField('dest_y', QVariant.Double))
-        fields.append(QgsField('residual', QVariant.Double))
-
-        layer = QgsMemoryProviderUtils.createMemoryLayer('temp', fields, QgsWkbTypes.LineString, self.gcps[0].crs)
-
-        for idx, gcp in enumerate(self.gcps):
-            ct = QgsCoordinateTransform(gcp.crs, layer.crs(), QgsProject.instance().transformContext())
-            src = ct.transform(gcp.origin)
-            dest = ct.transform(gcp.destination)
-
-            f = QgsFeature()
-            f.setAttributes([idx + 1, gcp.origin.x(), gcp.origin.y(), gcp.destination.x(), gcp.destination.y(),
-                             gcp.residual if gcp.residual is not None else NULL])
-            f.setGeometry(QgsLineString(QgsPoint(src.x(), src.y()), QgsPoint(dest.x(), dest.y())))
-            layer.dataProvider().addFeature(f)
-
-        options = QgsVectorFileWriter.SaveVectorOptions()
-
-        options.driverName = QgsVectorFileWriter.driverForExtension(os.path.splitext(path)[1])
-        _, error, new_filename, new_layer = QgsVectorFileWriter.writeAsVectorFormatV3(layer, path,
-                                                                                               QgsProject.instance().transformContext(),
-                                                                                               options)
-        return new_filename, new_layer, error
+        return self.collection.export_to_layer(path, batch_size)
 
     def save_to_file(self, path: str):
         """
         Saves the GCPs to a file
         """
-        with open(path, 'wt', encoding='utf8') as f:
-            for gcp in self.gcps:
-                f.write(gcp.to_string() + '\n')
+        self.collection.save_to_file(path)
 
     def load_from_file(self, path: str):
         """
         Loads GCPs from a file
         """
-        with open(path, 'rt', encoding='utf8') as f:
-            for line in f.readlines():
-                gcp = Gcp.from_string(line)
-                if gcp is not None:
-                    self.add_gcp(gcp.origin, gcp.destination, gcp.crs)
+        self.add_gcps(GcpCollection.read_file(path))
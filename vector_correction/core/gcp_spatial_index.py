@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""GCP spatial index
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+from typing import (
+    Dict,
+    List,
+    Optional
+)
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsGeometry,
+    QgsPointXY,
+    QgsProject,
+    QgsRectangle,
+    QgsSpatialIndex
+)
+
+from vector_correction.core.gcp_collection import Gcp
+from vector_correction.core.transformer_cache import FittedTransformerCache
+
+
+class GcpSpatialIndex:
+    """
+    A spatial index over the origin and destination points of GCPs.
+
+    GCPs can be inserted and removed individually, so the index can be kept up to date as GCPs
+    are edited without rebuilding it. All points are stored in a single index CRS, which is
+    taken from the first inserted GCP. Query points and rectangles may be in any CRS.
+    """
+
+    def __init__(self, transform_context: Optional[QgsCoordinateTransformContext] = None):
+        """
+        Constructor for GcpSpatialIndex.
+
+        :param transform_context: coordinate transform context to use when reprojecting. If not
+            set the current project's transform context will be used.
+        """
+        self.transform_context = transform_context
+        self.crs: Optional[QgsCoordinateReferenceSystem] = None
+        self._index = QgsSpatialIndex()
+        self._gcps: Dict[int, Gcp] = {}
+        # maps id(gcp) to the key used for the GCP in the index
+        self._keys: Dict[int, int] = {}
+        self._next_key = 0
+        self._transforms: Dict[tuple, QgsCoordinateTransform] = {}
+
+    def __len__(self) -> int:
+        return len(self._gcps)
+
+    def _transform(self, source_crs: QgsCoordinateReferenceSystem,
+                   destination_crs: QgsCoordinateReferenceSystem) -> QgsCoordinateTransform:
+        """
+        Returns a cached coordinate transform
+        """
+        key = (FittedTransformerCache.crs_key(source_crs), FittedTransformerCache.crs_key(destination_crs))
+        ct = self._transforms.get(key)
+        if ct is None:
+            context = self.transform_context if self.transform_context is not None else \
+                QgsProject.instance().transformContext()
+            ct = QgsCoordinateTransform(source_crs, destination_crs, context)
+            self._transforms[key] = ct
+        return ct
+
+    def _to_index_point(self, point: QgsPointXY, crs: QgsCoordinateReferenceSystem) -> QgsPointXY:
+        """
+        Transforms a point to the index CRS
+        """
+        if self.crs is None or crs == self.crs:
+            return point
+        return self._transform(crs, self.crs).transform(point)
+
+    def _entries(self, key: int, gcp: Gcp) -> List[QgsFeature]:
+        """
+        Returns the index entries for a GCP. Each GCP is stored as two point entries, with ids
+        2 * key for the origin and 2 * key + 1 for the destination.
+        """
+        res = []
+        for offset, point in enumerate((gcp.origin, gcp.destination)):
+            f = QgsFeature(2 * key + offset)
+            f.setGeometry(QgsGeometry.fromPointXY(self._to_index_point(point, gcp.crs)))
+            res.append(f)
+        return res
+
+    def insert(self, gcp: Gcp):
+        """
+        Adds a GCP to the index
+        """
+        if self.crs is None:
+            self.crs = gcp.crs
+
+        key = self._next_key
+        self._next_key += 1
+        self._gcps[key] = gcp
+        self._keys[id(gcp)] = key
+        for f in self._entries(key, gcp):
+            self._index.addFeature(f)
+
+    def remove(self, gcp: Gcp):
+        """
+        Removes a GCP from the index
+        """
+        key = self._keys.pop(id(gcp), None)
+        if key is None:
+            return
+
+        for f in self._entries(key, gcp):
+            self._index.deleteFeature(f)
+        del self._gcps[key]
+
+    def clear(self):
+        """
+        Removes all GCPs from the index
+        """
+        self.crs = None
+        self._index = QgsSpatialIndex()
+        self._gcps = {}
+        self._keys = {}
+        self._next_key = 0
+
+    def _unique_gcps(self, ids: List[int]) -> List[Gcp]:
+        """
+        Returns the unique GCPs matching a list of index entry ids, preserving order
+        """
+        res = []
+        seen = set()
+        for _id in ids:
+            key = _id // 2
+            if key in seen:
+                continue
+            seen.add(key)
+            res.append(self._gcps[key])
+        return res
+
+    def nearest(self, point: QgsPointXY, crs: QgsCoordinateReferenceSystem,
+                count: int = 1, max_distance: float = 0) -> List[Gcp]:
+        """
+        Returns the GCPs with an origin or destination nearest to a point, closest first.
+
+        :param point: point to search from
+        :param crs: CRS of point
+        :param count: maximum number of GCPs to return
+        :param max_distance: optional maximum search distance, in the index CRS units
+        """
+        if not self._gcps:
+            return []
+
+        # each GCP may match twice (origin and destination)
+        ids = self._index.nearestNeighbor(self._to_index_point(point, crs), count * 2, max_distance)
+        return self._unique_gcps(ids)[:count]
+
+    def intersects(self, rect: QgsRectangle, crs: QgsCoordinateReferenceSystem) -> List[Gcp]:
+        """
+        Returns the GCPs with an origin or destination inside a rectangle
+        """
+        if not self._gcps:
+            return []
+
+        if self.crs is not None and crs != self.crs:
+            rect = self._transform(crs, self.crs).transformBoundingBox(rect)
+
+        return self._unique_gcps(sorted(self._index.intersects(rect)))
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""Geometry transformer
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import time
+from typing import (
+    List,
+    Optional,
+    Tuple
+)
+
+from qgis.core import (
+    QgsAbstractGeometryTransformer,
+    QgsCoordinateTransform,
+    QgsCsException,
+    QgsGeometry,
+    QgsPointXY,
+    QgsRectangle
+)
+
+from vector_correction.core.profiler import (
+    NULL_PROFILER,
+    Profiler
+)
+from vector_correction.core.vertex_cache import VertexCache
+
+
+class ExtentGeometryTransformer(QgsAbstractGeometryTransformer):
+    """
+    A geometry transformer which applies a fitted GCP transformer to the vertices of a
+    geometry which fall inside an extent.
+
+    The transformer is applied via QgsAbstractGeometry.transform(), so every geometry type is
+    handled natively, including the control points of curved geometries (CircularString,
+    CompoundCurve, CurvePolygon). Z and M values are passed through unchanged.
+    """
+
+    def __init__(self,
+                 gcp_transformer,
+                 extent: QgsRectangle,
+                 geometry_to_extent_transform: QgsCoordinateTransform,
+                 vertex_cache: Optional[VertexCache] = None,
+                 profiler: Profiler = NULL_PROFILER):
+        """
+        Constructor for ExtentGeometryTransformer.
+
+        :param gcp_transformer: fitted GCP transformer, as returned by GcpCollection.to_gcp_transformer()
+        :param extent: extent to transform vertices within
+        :param geometry_to_extent_transform: transform from the geometry CRS (i.e. the CRS the GCP transformer
+            was fitted in) to the extent CRS
+        :param vertex_cache: optional cache of corrected vertices
+        :param profiler: optional profiler for recording vertex timings and counters
+        """
+        super().__init__()
+        self.gcp_transformer = gcp_transformer
+        self.extent = extent
+        self.geometry_to_extent_transform = geometry_to_extent_transform
+        # when the geometry and extent CRS match, vertices are tested against the extent directly
+        self.reproject_for_extent = not geometry_to_extent_transform.isShortCircuited()
+        self.vertex_cache = vertex_cache
+        self.profiler = profiler
+        self.changed_vertex_count = 0
+
+    def begin_geometry(self, geometry: QgsGeometry):
+        """
+        Must be called before each geometry (in the CRS of the GCP transformer) is transformed
+        """
+        if self.vertex_cache is not None:
+            self.vertex_cache.begin_feature((vertex.x(), vertex.y()) for vertex in geometry.vertices())
+
+    def vertex_in_extent(self, x: float, y: float) -> bool:
+        """
+        Returns True if a vertex is within the extent
+        """
+        point = QgsPointXY(x, y)
+        if self.reproject_for_extent:
+            # transform point to extent crs, in order to check exact intersection of the point and the visible extent
+            if self.profiler.enabled:
+                # only pay for timing every vertex when profiling
+                start = time.perf_counter()
+                point = self.geometry_to_extent_transform.transform(point)
+                self.profiler.add_time('transform/reprojection', time.perf_counter() - start)
+                self.profiler.count('vertex_reprojections')
+            else:
+                point = self.geometry_to_extent_transform.transform(point)
+        return self.extent.contains(point)
+
+    def transform_vertex(self, x: float, y: float) -> Tuple[bool, Optional[float], Optional[float]]:
+        """
+        Transforms a single vertex, if it is within the extent.
+
+        Returns a tuple of (ok, x, y), where x and y will be None if the vertex is outside the extent.
+        """
+        if not self.vertex_in_extent(x, y):
+            return VertexCache.UNCHANGED
+
+        return self._gcp_transform_vertex(x, y)
+
+    def _gcp_transform_vertex(self, x: float, y: float) -> Tuple[bool, Optional[float], Optional[float]]:
+        """
+        Applies the GCP transformer to a vertex, regardless of the extent
+        """
+        if self.profiler.enabled:
+            start = time.perf_counter()
+            ok, transformed_x, transformed_y = self.gcp_transformer.transform(x, y)
+            self.profiler.add_time('transform/gcp_transform', time.perf_counter() - start)
+            self.profiler.count('vertex_transforms')
+        else:
+            ok, transformed_x, transformed_y = self.gcp_transformer.transform(x, y)
+        if not ok:
+            return VertexCache.FAILED
+
+        return True, transformed_x, transformed_y
+
+    def cached_transform_vertex(self, x: float, y: float) -> Tuple[bool, Optional[float], Optional[float]]:
+        """
+        Transforms a single vertex, using the vertex cache if set.
+
+        See transform_vertex().
+        """
+        if self.vertex_cache is None:
+            return self.transform_vertex(x, y)
+
+        key = self.vertex_cache.key(x, y)
+        res = self.vertex_cache.get(key)
+        if res is not None:
+            return res
+
+        if not self.vertex_in_extent(x, y):
+            res = VertexCache.UNCHANGED
+            self.vertex_cache.insert(key, res)
+            return res
+
+        # a vertex inside the extent which is near a vertex of another feature takes the same corrected position
+        res = self.vertex_cache.nearby(x, y)
+        if res is not None:
+            self.vertex_cache.insert(key, res, shared=False)
+            return res
+
+        res = self._gcp_transform_vertex(x, y)
+        self.vertex_cache.insert(key, res)
+        return res
+
+    def transformPoint(self, x, y, z, m):  # pylint: disable=missing-function-docstring
+        ok, transformed_x, transformed_y = self.cached_transform_vertex(x, y)
+        if not ok:
+            return False, x, y, z, m
+
+        if transformed_x is None or (transformed_x == x and transformed_y == y):
+            return True, x, y, z, m
+
+        self.changed_vertex_count += 1
+        return True, transformed_x, transformed_y, z, m
+
+
+class _VertexRecorder(QgsAbstractGeometryTransformer):
+    """
+    Records the result of an ExtentGeometryTransformer for every vertex of a geometry, without changing it
+    """
+
+    def __init__(self, transformer: ExtentGeometryTransformer):
+        super().__init__()
+        self.transformer = transformer
+        # for every vertex in transform order, True if the vertex is moved
+        self.moved_flags: List[bool] = []
+        self.moved_vertices: List[QgsPointXY] = []
+
+    def transformPoint(self, x, y, z, m):  # pylint: disable=missing-function-docstring
+        ok, transformed_x, transformed_y = self.transformer.cached_transform_vertex(x, y)
+        if not ok:
+            return False, x, y, z, m
+
+        moved = transformed_x is not None and (transformed_x != x or transformed_y != y)
+        self.moved_flags.append(moved)
+        if moved:
+            self.moved_vertices.append(QgsPointXY(transformed_x, transformed_y))
+        return True, x, y, z, m
+
+
+class _VertexReplayer(QgsAbstractGeometryTransformer):
+    """
+    Moves the vertices of a geometry to positions recorded by a _VertexRecorder for the same geometry
+    """
+
+    def __init__(self, moved_flags: List[bool], moved_vertices: List[QgsPointXY]):
+        super().__init__()
+        self.moved_flags = moved_flags
+        self.moved_vertices = moved_vertices
+        self._vertex_index = 0
+        self._moved_index = 0
+
+    def transformPoint(self, x, y, z, m):  # pylint: disable=missing-function-docstring
+        moved = self.moved_flags[self._vertex_index]
+        self._vertex_index += 1
+        if not moved:
+            return True, x, y, z, m
+
+        point = self.moved_vertices[self._moved_index]
+        self._moved_index += 1
+        return True, point.x(), point.y(), z, m
+
+
+class ReprojectingGeometryTransformer:
+    """
+    Applies an ExtentGeometryTransformer to geometries in a different CRS from the working CRS, i.e. the CRS
+    which the GCP transformer was fitted in.
+
+    Each geometry is reprojected to the working CRS in a single batch, the extent test and GCP transform are
+    applied to its vertices there, and then only the moved vertices are reprojected back to the geometry CRS
+    in a single batch. Vertices which are not moved keep their exact original coordinates.
+    """
+
+    def __init__(self,
+                 transformer: ExtentGeometryTransformer,
+                 geometry_to_working_transform: QgsCoordinateTransform):
+        """
+        Constructor for ReprojectingGeometryTransformer.
+
+        :param transformer: transformer for vertices in the working CRS
+        :param geometry_to_working_transform: transform from the geometry CRS to the working CRS
+        """
+        self.transformer = transformer
+        self.geometry_to_working_transform = geometry_to_working_transform
+        self.changed_vertex_count = 0
+
+    def begin_geometry(self, geometry: QgsGeometry):
+        """
+        Must be called before each geometry (in the geometry CRS) is transformed
+        """
+        vertex_cache = self.transformer.vertex_cache
+        if vertex_cache is None or vertex_cache.tolerance <= 0:
+            # the vertices of the geometry are only needed for matching vertices within a tolerance
+            self.transformer.begin_geometry(QgsGeometry())
+            return
+
+        working_geometry = QgsGeometry(geometry)
+        try:
+            working_geometry.transform(self.geometry_to_working_transform)
+        except QgsCsException:
+            working_geometry = QgsGeometry()
+        self.transformer.begin_geometry(working_geometry)
+
+    def cached_transform_vertex(self, x: float, y: float) -> Tuple[bool, Optional[float], Optional[float]]:
+        """
+        Transforms a single vertex in the geometry CRS, reprojecting it individually.
+
+        See ExtentGeometryTransformer.transform_vertex().
+        """
+        try:
+            point = self.geometry_to_working_transform.transform(QgsPointXY(x, y))
+            ok, transformed_x, transformed_y = self.transformer.cached_transform_vertex(point.x(), point.y())
+            if not ok or transformed_x is None:
+                return ok, None, None
+
+            point = self.geometry_to_working_transform.transform(QgsPointXY(transformed_x, transformed_y),
+                                                                 QgsCoordinateTransform.ReverseTransform)
+        except QgsCsException:
+            return VertexCache.FAILED
+
+        return True, point.x(), point.y()
+
+    def transform(self, geometry: QgsGeometry) -> bool:
+        """
+        Transforms a geometry in place. Returns False if any vertex could not be transformed.
+        """
+        profiler = self.transformer.profiler
+        working_geometry = QgsGeometry(geometry)
+        try:
+            with profiler.stage('transform/reprojection'):
+                working_geometry.transform(self.geometry_to_working_transform)
+        except QgsCsException:
+            return False
+        profiler.count('geometry_reprojections')
+
+        recorder = _VertexRecorder(self.transformer)
+        if not working_geometry.get().transform(recorder):
+            return False
+
+        if not recorder.moved_vertices:
+            return True
+
+        moved = QgsGeometry.fromMultiPointXY(recorder.moved_vertices)
+        try:
+            with profiler.stage('transform/reprojection'):
+                moved.transform(self.geometry_to_working_transform, QgsCoordinateTransform.ReverseTransform)
+        except QgsCsException:
+            return False
+        profiler.count('geometry_reprojections')
+
+        if not geometry.get().transform(_VertexReplayer(recorder.moved_flags, moved.asMultiPoint())):
+            return False
+
+        self.changed_vertex_count += len(recorder.moved_vertices)
+        return True
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Geometry writer
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+from typing import (
+    Dict,
+    Optional,
+    Set
+)
+
+from qgis.core import (
+    QgsGeometry,
+    QgsTransaction,
+    QgsVectorLayer
+)
+
+
+class GeometryWriter:
+    """
+    Writes corrected geometries back to a layer
+    """
+
+    @staticmethod
+    def write_per_feature(layer: QgsVectorLayer,
+                          geometries: Dict[int, QgsGeometry],
+                          command_text: str,
+                          failed_ids: Optional[Set[int]] = None) -> bool:
+        """
+        Writes geometries to the layer's edit buffer one feature at a time, as a single edit command.
+
+        Every change emits the layer's change signals immediately, so this is only suitable for
+        small numbers of features. Use write_bulk() for larger sets.
+
+        Returns False if any geometry could not be changed. If failed_ids is set, the IDs of
+        these features are added to it.
+        """
+        layer.beginEditCommand(command_text)
+        res = True
+        for _id, geometry in geometries.items():
+            res = GeometryWriter._change_geometry(layer, _id, geometry, failed_ids) and res
+        layer.endEditCommand()
+        return res
+
+    @staticmethod
+    def write_bulk(layer: QgsVectorLayer,
+                   geometries: Dict[int, QgsGeometry],
+                   command_text: str,
+                   failed_ids: Optional[Set[int]] = None) -> bool:
+        """
+        Writes geometries to the layer's edit buffer as a single undoable edit command.
+
+        The layer and undo stack signals are blocked while the geometries are changed, so that
+        listeners (attribute tables, snapping indexes, the canvas) are not notified once per
+        feature. A single dataChanged signal is emitted after all geometries have been written
+        so that these listeners refresh once.
+
+        Returns False if any geometry could not be changed. If failed_ids is set, the IDs of
+        these features are added to it.
+        """
+        if not geometries:
+            return True
+
+        undo_stack = layer.undoStack()
+
+        layer.beginEditCommand(command_text)
+        layer_signals_blocked = layer.blockSignals(True)
+        undo_stack_signals_blocked = undo_stack.blockSignals(True) if undo_stack is not None else False
+        res = True
+        try:
+            for _id, geometry in geometries.items():
+                res = GeometryWriter._change_geometry(layer, _id, geometry, failed_ids) and res
+        finally:
+            if undo_stack is not None:
+                undo_stack.blockSignals(undo_stack_signals_blocked)
+            layer.blockSignals(layer_signals_blocked)
+
+        layer.endEditCommand()
+
+        if not layer_signals_blocked:
+            layer.dataChanged.emit()
+
+        return res
+
+    @staticmethod
+    def _change_geometry(layer: QgsVectorLayer, _id: int, geometry: QgsGeometry,
+                         failed_ids: Optional[Set[int]]) -> bool:
+        """
+        Changes a single geometry in the layer's edit buffer, recording the ID in failed_ids on failure
+        """
+        if layer.changeGeometry(_id, geometry, True):
+            return True
+
+        if failed_ids is not None:
+            failed_ids.add(_id)
+        return False
+
+
+class ProviderGeometryWriter:
+    """
+    Writes corrected geometries directly to a layer's data provider in batches, bypassing the
+    layer's edit buffer.
+
+    If the provider supports transactions, all batches are written inside a transaction which
+    is committed by finish(), or after every batch if commit_batches is set. Otherwise every
+    batch is saved as soon as it is written, and rollback() is not possible.
+
+    In dry run mode batches are written inside the transaction (so that the provider validates
+    them) and then rolled back. If transactions are not supported nothing is written in dry run mode.
+    """
+
+    def __init__(self, layer: QgsVectorLayer, commit_batches: bool = False, dry_run: bool = False):
+        """
+        Constructor for ProviderGeometryWriter.
+
+        :param layer: target layer
+        :param commit_batches: set to True to commit each batch as it is written
+        :param dry_run: set to True to validate writes without saving any changes
+        """
+        self.layer = layer
+        self.commit_batches = commit_batches
+        self.dry_run = dry_run
+        self.transaction = None
+        self.written_count = 0
+        self.error = ''
+
+    def begin(self) -> bool:
+        """
+        Starts writing, creating a transaction if the provider supports it
+        """
+        self.written_count = 0
+        self.error = ''
+        if QgsTransaction.supportsTransaction(self.layer) and self.layer.dataProvider().transaction() is None:
+            self.transaction = QgsTransaction.create({self.layer})
+
+        if self.transaction is not None:
+            ok, self.error = self.transaction.begin()
+            if not ok:
+                self.transaction = None
+                return False
+
+        return True
+
+    def supports_rollback(self) -> bool:
+        """
+        Returns True if uncommitted writes can be rolled back
+        """
+        return self.transaction is not None
+
+    def saves_batches(self) -> bool:
+        """
+        Returns True if every batch is saved permanently as soon as it is written
+        """
+        return not self.dry_run and (self.transaction is None or self.commit_batches)
+
+    def write(self, geometries: Dict[int, QgsGeometry]) -> bool:
+        """
+        Writes a batch of geometries to the provider
+        """
+        if not geometries or (self.dry_run and self.transaction is None):
+            return True
+
+        provider = self.layer.dataProvider()
+        provider.clearErrors()
+        if not provider.changeGeometryValues(geometries):
+            self.error = '\n'.join(provider.errors())
+            return False
+
+        self.written_count += len(geometries)
+
+        if self.commit_batches and not self.dry_run and self.transaction is not None:
+            ok, self.error = self.transaction.commit()
+            if not ok:
+                return False
+            ok, self.error = self.transaction.begin()
+            if not ok:
+                self.transaction = None
+                return False
+
+        return True
+
+    def finish(self) -> bool:
+        """
+        Finishes writing, committing the transaction (or rolling it back for dry runs)
+        """
+        if self.transaction is None:
+            return True
+
+        if self.dry_run:
+            return self.rollback()
+
+        ok, self.error = self.transaction.commit()
+        self.transaction = None
+        return ok
+
+    def rollback(self) -> bool:
+        """
+        Rolls back all uncommitted writes. Returns False if the writes could not be rolled back.
+        """
+        if self.transaction is None:
+            return False
+
+        ok, self.error = self.transaction.rollback()
+        self.transaction = None
+        return ok
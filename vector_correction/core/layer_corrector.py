@@ -0,0 +1,729 @@
+# -*- coding: utf-8 -*-
+"""Layer corrector
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+from array import array
+from contextlib import nullcontext
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsFeatureRequest,
+    QgsFeedback,
+    QgsGeometry,
+    QgsRectangle,
+    QgsVectorDataProvider,
+    QgsVectorLayer
+)
+
+from vector_correction.core.correction_checkpoint import CorrectionCheckpoint
+from vector_correction.core.correction_history import CorrectionHistory
+from vector_correction.core.gcp_collection import (
+    GcpCollection,
+    TransformStatistics
+)
+from vector_correction.core.geometry_writer import (
+    GeometryWriter,
+    ProviderGeometryWriter
+)
+from vector_correction.core.profiler import (
+    NULL_PROFILER,
+    Profiler
+)
+from vector_correction.core.settings_registry import SettingsRegistry
+from vector_correction.core.transform_methods import PluginGcpTransformer
+from vector_correction.core.transformer_cache import FittedTransformerCache
+from vector_correction.core.vertex_cache import VertexCache
+
+
+class CorrectionException(Exception):
+    """
+    Raised when corrections could not be applied to a layer
+    """
+
+
+class LayerCorrector:
+    """
+    Applies the corrections defined by a GCP collection to the features of vector layers
+    which fall inside an extent.
+
+    By default corrected geometries are written to the layer's edit buffer as a single undoable
+    edit command. Alternatively corrections can be written directly to the layer's data provider
+    in batches of batch_size features, which keeps memory use bounded for very large layers.
+
+    If tile_size is set the extent is split into a grid of square tiles (in extent CRS units), and the
+    features of each tile are fetched, corrected and written in turn, so that only one tile's features
+    are held in memory at a time. Progress is reported per tile (or per batch) to the optional feedback
+    object, which can also be used to cancel the correction.
+
+    If a checkpoint is set, corrections written directly to a data provider record their progress in
+    the checkpoint as each batch or tile is saved. Rerunning an interrupted correction with the same
+    GCPs and settings then skips the work which was already saved. The checkpoint is removed once a
+    correction completes. Checkpoints are not used when writing to the edit buffer, or when batches
+    are only saved at the end of the run, since an interrupted run saves nothing in these cases.
+
+    If a history is set, corrections made in the edit buffer with a local transform method (such as piecewise
+    affine) remember the original geometries of the changed features. When the layer is next corrected with
+    the same extent and settings, the previous correction is updated instead: only features inside the region
+    affected by the changed GCPs are recomputed from their original geometries. Features whose corrected
+    geometries could not be written to the edit buffer are counted as failed in the statistics, and are not
+    recorded in the history.
+
+    For local transform methods, features are fetched in two passes: first the IDs of the features intersecting
+    the regions which the transform can change are fetched without geometries, and then full geometries are
+    fetched only for these features.
+
+    Fitted transformers and the reprojected extent are shared by all layers corrected by a corrector, so a
+    single corrector should be used for all the layers in a correction run. The transform is then fitted only
+    once for each distinct layer CRS, regardless of the number of layers.
+
+    If a profiler is set, the time spent in each stage of the correction is recorded in it.
+    """
+
+    # maximum number of separate influence regions to request features for
+    MAXIMUM_INFLUENCE_REGIONS = 100
+
+    def __init__(self,
+                 collection: GcpCollection,
+                 extent: QgsRectangle,
+                 extent_crs: QgsCoordinateReferenceSystem):
+        """
+        Constructor for LayerCorrector.
+
+        :param collection: GCPs defining the correction
+        :param extent: extent to correct features within
+        :param extent_crs: CRS of extent
+        """
+        self.collection = collection
+        self.extent = QgsRectangle(extent)
+        self.extent_crs = extent_crs
+
+        self.write_to_provider = False
+        self.batch_size = 1000
+        self.commit_batches = False
+        self.dry_run = False
+        self.shared_vertex_tolerance = 0
+        self.vertex_cache: Optional[VertexCache] = None
+        self.profiler: Profiler = NULL_PROFILER
+        self.tile_size = 0
+        self.feedback: Optional[QgsFeedback] = None
+        self.checkpoint: Optional[CorrectionCheckpoint] = None
+        self.history: Optional[CorrectionHistory] = None
+        self._influence_regions: Optional[List[QgsRectangle]] = None
+        # fitted transformers and reprojected extents shared by all layers, by key
+        self._gcp_transformers = {}
+        self._layer_extents: Dict[str, QgsRectangle] = {}
+
+    @staticmethod
+    def from_settings(collection: GcpCollection,
+                      extent: QgsRectangle,
+                      extent_crs: QgsCoordinateReferenceSystem) -> 'LayerCorrector':
+        """
+        Creates a layer corrector using the options from the plugin settings
+        """
+        corrector = LayerCorrector(collection, extent, extent_crs)
+        corrector.write_to_provider = SettingsRegistry.write_to_provider()
+        corrector.batch_size = SettingsRegistry.provider_batch_size()
+        corrector.commit_batches = SettingsRegistry.commit_provider_batches()
+        corrector.dry_run = SettingsRegistry.dry_run()
+        corrector.shared_vertex_tolerance = SettingsRegistry.shared_vertex_tolerance()
+        corrector.tile_size = SettingsRegistry.correction_tile_size()
+        if SettingsRegistry.profiling_enabled():
+            corrector.profiler = Profiler()
+        return corrector
+
+    @staticmethod
+    def tr(message: str) -> str:
+        """
+        Get the translation for a string using Qt translation API
+        """
+        # noinspection PyTypeChecker,PyArgumentList,PyCallByClass
+        return QCoreApplication.translate('LayerCorrector', message)
+
+    def feature_request(self, layer: QgsVectorLayer, extent: Optional[QgsRectangle] = None) -> QgsFeatureRequest:
+        """
+        Returns a feature request for fetching the features from a layer which may need correcting.
+
+        :param layer: layer to fetch features from
+        :param extent: optional extent (in the corrector's extent CRS) to fetch features from. If not set
+            the whole correction extent will be used.
+        """
+        # we need to transform the extent to the layer crs in order to filter features
+        request = QgsFeatureRequest()
+        request.setFilterRect(self.layer_extent(layer) if extent is None else self._to_layer_crs(layer, extent))
+        request.setNoAttributes()
+        return request
+
+    def _to_layer_crs(self, layer: QgsVectorLayer, rectangle: QgsRectangle,
+                      rectangle_crs: Optional[QgsCoordinateReferenceSystem] = None) -> QgsRectangle:
+        """
+        Transforms a rectangle from the extent CRS (or rectangle_crs, if set) to the bounding box of the
+        rectangle in a layer's CRS
+        """
+        to_layer_transform = QgsCoordinateTransform(self.extent_crs if rectangle_crs is None else rectangle_crs,
+                                                    layer.crs(),
+                                                    self.collection.coordinate_transform_context())
+        return to_layer_transform.transformBoundingBox(rectangle)
+
+    def layer_extent(self, layer: QgsVectorLayer) -> QgsRectangle:
+        """
+        Returns the bounding box of the correction extent in a layer's CRS.
+
+        The reprojected extent is calculated once for each CRS and shared by all layers.
+        """
+        key = FittedTransformerCache.crs_key(layer.crs()) + '|' + self.extent.toString(17)
+        layer_extent = self._layer_extents.get(key)
+        if layer_extent is None:
+            layer_extent = self._to_layer_crs(layer, self.extent)
+            self._layer_extents[key] = layer_extent
+
+        return QgsRectangle(layer_extent)
+
+    def working_crs(self) -> QgsCoordinateReferenceSystem:
+        """
+        Returns the CRS which the transform is fitted and applied in, for all layers
+        """
+        return self.collection.working_crs(self.extent_crs)
+
+    def gcp_transformer(self):
+        """
+        Returns the fitted GCP transformer, in the working CRS, or the collection's loaded displacement grid.
+
+        The transformer is fitted once and shared by all layers (whatever their CRS), for as long as the
+        GCPs and fitting settings are unchanged. Unlike the GcpCollection's cache, transformers used by a
+        corrector are never evicted.
+        """
+        if self.collection.loaded_grid is not None:
+            return self.collection.loaded_grid
+
+        working_crs = self.working_crs()
+        key = self.collection.transformer_key(working_crs)
+        transformer = self._gcp_transformers.get(key)
+        if transformer is None:
+            transformer = self.collection.to_gcp_transformer(working_crs, self.profiler)
+            self._gcp_transformers[key] = transformer
+        else:
+            self.profiler.count('shared_transformer_hits')
+
+        return transformer
+
+    def correction_key(self, layer: QgsVectorLayer) -> str:
+        """
+        Returns a key identifying the layer, extent, transform method, loaded displacement grid and settings
+        (but not the GCPs) used when correcting a layer
+        """
+        return '|'.join((layer.source(),
+                         FittedTransformerCache.crs_key(layer.crs()),
+                         str(int(SettingsRegistry.transform_method())),
+                         str(SettingsRegistry.robust_fitting()),
+                         str(SettingsRegistry.outlier_threshold()),
+                         str(SettingsRegistry.densify_tolerance() if SettingsRegistry.densify() else None),
+                         str(self.shared_vertex_tolerance),
+                         self.extent.toString(17),
+                         FittedTransformerCache.crs_key(self.extent_crs),
+                         FittedTransformerCache.crs_key(self.working_crs()),
+                         str(self.collection.loaded_grid_path)))
+
+    def checkpoint_key(self, layer: QgsVectorLayer) -> str:
+        """
+        Returns a key identifying a correction run for a layer, for use with checkpoints.
+
+        Checkpoints are only resumed by runs with a matching key, i.e. runs for the same layer which use
+        the same GCPs, transform method, extent, settings and tiling.
+        """
+        return '|'.join((self.correction_key(layer),
+                         self.collection.fingerprint(),
+                         str(self.tile_size)))
+
+    def tiles(self) -> List[QgsRectangle]:
+        """
+        Returns the tiles covering the correction extent, in row major order.
+
+        If tiling is disabled a single tile covering the whole extent is returned.
+        """
+        if self.tile_size <= 0:
+            return [QgsRectangle(self.extent)]
+
+        columns, rows = self._tile_counts()
+        res = []
+        for row in range(rows):
+            for column in range(columns):
+                x_min = self.extent.xMinimum() + column * self.tile_size
+                y_min = self.extent.yMinimum() + row * self.tile_size
+                res.append(QgsRectangle(x_min, y_min,
+                                        min(x_min + self.tile_size, self.extent.xMaximum()),
+                                        min(y_min + self.tile_size, self.extent.yMaximum())))
+        return res
+
+    def _tile_counts(self) -> Tuple[int, int]:
+        """
+        Returns the number of tile columns and rows covering the correction extent
+        """
+        return (max(1, math.ceil(self.extent.width() / self.tile_size)),
+                max(1, math.ceil(self.extent.height() / self.tile_size)))
+
+    def correct_layer(self, layer: QgsVectorLayer,
+                      statistics: Optional[TransformStatistics] = None) -> TransformStatistics:
+        """
+        Corrects the features from a layer.
+
+        :raises NotEnoughGcpsException: if not enough GCPs are defined
+        :raises TransformCreationException: if the transform could not be created
+        :raises CorrectionException: if the corrections could not be applied, or the correction was canceled
+        """
+        if statistics is None:
+            statistics = TransformStatistics()
+
+        # shared vertices are only transformed once per layer, and are guaranteed to remain coincident
+        self.vertex_cache = VertexCache(self.shared_vertex_tolerance)
+
+        if self.feedback is not None:
+            self.feedback.setProgress(0)
+
+        with self.profiler.stage('total'):
+            if self.write_to_provider:
+                self._correct_via_provider(layer, statistics)
+            else:
+                self._correct_via_edit_buffer(layer, statistics)
+
+        self.profiler.count('vertex_cache_hits', self.vertex_cache.hits)
+        self.profiler.count('vertex_cache_misses', self.vertex_cache.misses)
+        self.profiler.count('vertex_cache_snapped', self.vertex_cache.snapped)
+        return statistics
+
+    def _transform_batch(self, layer: QgsVectorLayer,
+                         geometries: Dict[int, QgsGeometry],
+                         statistics: TransformStatistics) -> Dict[int, QgsGeometry]:
+        """
+        Transforms a batch of geometries, returning the changed geometries
+        """
+        gcp_transformer = None if SettingsRegistry.use_displacement_grid() else self.gcp_transformer()
+        transformed = self.collection.transform_features(features=geometries,
+                                                         feature_crs=layer.crs(),
+                                                         extent=self.extent,
+                                                         extent_crs=self.extent_crs,
+                                                         statistics=statistics,
+                                                         vertex_cache=self.vertex_cache,
+                                                         profiler=self.profiler,
+                                                         gcp_transformer=gcp_transformer)
+        if any(g.isNull() for g in transformed.values()):
+            raise CorrectionException(self.tr('One or more features failed to transform'))
+
+        return transformed
+
+    def _check_canceled(self):
+        """
+        Raises a CorrectionException if the correction has been canceled
+        """
+        if self.feedback is not None and self.feedback.isCanceled():
+            raise CorrectionException(self.tr('Correction was canceled'))
+
+    def _fetch_geometries(self, source, request: QgsFeatureRequest) -> Dict[int, QgsGeometry]:
+        """
+        Fetches the geometries matching a request from a layer or data provider
+        """
+        with self.profiler.stage('fetch'):
+            return {
+                f.id(): f.geometry()
+                for f in source.getFeatures(request)
+            }
+
+    def _calculate_influence_regions(self, layer: QgsVectorLayer) -> Optional[List[QgsRectangle]]:
+        """
+        Calculates the regions (in the layer CRS) outside of which the correction leaves vertices unchanged,
+        or returns None if the correction may change vertices anywhere
+        """
+        if SettingsRegistry.use_displacement_grid():
+            return None
+
+        transformer = self.gcp_transformer()
+        if not isinstance(transformer, PluginGcpTransformer):
+            return None
+
+        regions = transformer.influence_regions()
+        if regions is None:
+            return None
+
+        # regions are in the working CRS
+        layer_extent = self.layer_extent(layer)
+        regions = [self._to_layer_crs(layer, region, self.working_crs()).intersect(layer_extent)
+                   for region in regions]
+        regions = [region for region in regions if not region.isEmpty()]
+        if len(regions) > LayerCorrector.MAXIMUM_INFLUENCE_REGIONS:
+            # avoid making many small requests
+            combined = QgsRectangle(regions[0])
+            for region in regions[1:]:
+                combined.combineExtentWith(region)
+            regions = [combined]
+
+        self.profiler.count('influence_regions', len(regions))
+        return regions
+
+    def _candidate_ids(self, layer: QgsVectorLayer, source,
+                       extent: Optional[QgsRectangle] = None) -> Iterable[int]:
+        """
+        Fetches the IDs (without geometries) of the features within the correction extent (or part of it) which
+        could be changed by the correction, i.e. the features which intersect the influence regions
+        """
+        request = self.feature_request(layer, extent)
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        if self._influence_regions is None:
+            return (f.id() for f in source.getFeatures(request))
+
+        filter_rect = request.filterRect()
+        ids = set()
+        for region in self._influence_regions:
+            region = region.intersect(filter_rect)
+            if region.isEmpty():
+                continue
+            request.setFilterRect(region)
+            ids.update(f.id() for f in source.getFeatures(request))
+
+        return sorted(ids)
+
+    def _fetch_candidate_geometries(self, layer: QgsVectorLayer, source,
+                                    extent: Optional[QgsRectangle] = None) -> Dict[int, QgsGeometry]:
+        """
+        Fetches the geometries of the features within the correction extent (or part of it) which could be
+        changed by the correction.
+
+        If the influence regions of the transform are known, then the IDs of candidate features are fetched
+        first and full geometries are only fetched for these. This avoids transferring geometries which
+        cannot change, which is significant for remote providers.
+        """
+        if self._influence_regions is None:
+            return self._fetch_geometries(source, self.feature_request(layer, extent))
+
+        with self.profiler.stage('fetch/ids'):
+            feature_ids = list(self._candidate_ids(layer, source, extent))
+        if not feature_ids:
+            return {}
+
+        request = QgsFeatureRequest()
+        request.setFilterFids(feature_ids)
+        request.setNoAttributes()
+        return self._fetch_geometries(source, request)
+
+    def _corrected_tiles(self, layer: QgsVectorLayer, source,
+                         statistics: TransformStatistics,
+                         checkpoint: Optional[CorrectionCheckpoint] = None) -> Iterator[Dict[int, QgsGeometry]]:
+        """
+        Fetches and corrects geometries from a layer or data provider tile by tile, yielding the corrected
+        geometries for each tile.
+
+        Every feature is corrected in the first tile whose request returns it, so features which span several
+        tiles are only corrected once. The corrected geometries for a tile must be written before the next tile
+        is requested.
+
+        If a checkpoint is specified then tiles and features which it lists as completed are skipped, and
+        each tile is recorded in the checkpoint as pending before its corrected geometries are written and
+        as completed once they have been written.
+        """
+        # features which span several tiles are returned by each of their requests, and written geometries
+        # are returned by later requests, so skip features which were already processed by an earlier tile.
+        # (The tile containing a feature's bounding box center is not a safe owner, since providers which filter
+        # exactly may never return a feature for that tile.)
+        processed_ids = set()
+
+        tiles = self.tiles()
+        completed_ids = checkpoint.completed_ids if checkpoint is not None else set()
+        for tile_index, tile in enumerate(tiles):
+            self._check_canceled()
+            if checkpoint is not None and tile_index in checkpoint.completed_tiles:
+                continue
+
+            geometries = {}
+            for _id, geometry in self._fetch_candidate_geometries(layer, source, tile).items():
+                if _id in processed_ids:
+                    # already corrected in an earlier tile
+                    continue
+                processed_ids.add(_id)
+                if _id in completed_ids:
+                    # already corrected by an interrupted run
+                    continue
+                geometries[_id] = geometry
+
+            transformed = self._transform_batch(layer, geometries, statistics)
+
+            self.profiler.count('tiles')
+            if checkpoint is not None:
+                checkpoint.record_pending(transformed)
+            yield transformed
+
+            if checkpoint is not None:
+                checkpoint.record(transformed.keys(), tile_index)
+
+            if self.feedback is not None:
+                self.feedback.setProgress(100 * (tile_index + 1) / len(tiles))
+
+    def _correct_via_edit_buffer(self, layer: QgsVectorLayer, statistics: TransformStatistics):
+        """
+        Corrects a layer's features, storing the changes in the layer's edit buffer
+        """
+        if not layer.isEditable():
+            raise CorrectionException(self.tr('Layer {} is not editable').format(layer.name()))
+
+        self._influence_regions = self._calculate_influence_regions(layer)
+
+        if self.tile_size <= 0:
+            self._check_canceled()
+            transformer = self._local_transformer()
+            if transformer is not None and self._update_correction(layer, transformer, statistics):
+                return
+
+            geometries = self._fetch_candidate_geometries(layer, layer)
+            # geometries are transformed in place, so keep copies of the originals for the history
+            original_geometries = {_id: QgsGeometry(geometry) for _id, geometry in geometries.items()} \
+                if transformer is not None else {}
+            transformed = self._transform_batch(layer, geometries, statistics)
+            if not self.dry_run:
+                failed_ids = self._write_to_edit_buffer(layer, transformed, self.tr('Correct features'), statistics)
+
+                if transformer is not None:
+                    # features which failed to be written still have their original geometries
+                    self.history.reset(self.correction_key(layer), transformer,
+                                       {_id: original_geometries[_id] for _id in transformed
+                                        if _id not in failed_ids})
+                elif self.history is not None:
+                    self.history.clear()
+            return
+
+        if self.history is not None and not self.dry_run:
+            self.history.clear()
+
+        # the changes from all tiles are grouped into a single undoable command
+        macro_started = False
+        try:
+            for transformed in self._corrected_tiles(layer, layer, statistics):
+                if self.dry_run or not transformed:
+                    continue
+
+                if not macro_started:
+                    layer.undoStack().beginMacro(self.tr('Correct features'))
+                    macro_started = True
+                self._write_to_edit_buffer(layer, transformed, self.tr('Correct features'), statistics)
+        finally:
+            if macro_started:
+                layer.undoStack().endMacro()
+
+    def _local_transformer(self):
+        """
+        Returns the fitted transformer if the correction can be recorded in the history, i.e.
+        a history is set and the transform method is local. Returns None otherwise.
+        """
+        if self.history is None or SettingsRegistry.use_displacement_grid():
+            return None
+
+        transformer = self.gcp_transformer()
+        if not isinstance(transformer, PluginGcpTransformer) or not transformer.is_local():
+            return None
+
+        return transformer
+
+    def _writing_history(self):
+        """
+        Returns a context manager which must wrap writes to the edit buffer, so that they are not mistaken for
+        other edits which invalidate the history
+        """
+        return self.history.writing() if self.history is not None else nullcontext()
+
+    def _update_correction(self, layer: QgsVectorLayer, transformer, statistics: TransformStatistics) -> bool:
+        """
+        Updates the previous correction of a layer, recomputing only the features within the region affected by
+        changes to the GCPs since that correction.
+
+        Returns False if the previous correction cannot be updated, in which case the layer must be corrected
+        in full.
+        """
+        if not self.history.can_update(self.correction_key(layer)):
+            return False
+
+        layer_extent = self.layer_extent(layer)
+        region = transformer.changed_region(self.history.transformer)
+        if region is None:
+            # the changes may affect the whole extent
+            region = layer_extent
+        else:
+            region = self._to_layer_crs(layer, region, self.working_crs()).intersect(layer_extent)
+        self.profiler.count('incremental_updates')
+
+        # features are recomputed from their original geometries. Features which were not changed by
+        # the previous correction still have their original geometries.
+        original_geometries = {}
+        if not region.isEmpty():
+            request = QgsFeatureRequest()
+            request.setFilterRect(region)
+            request.setNoAttributes()
+            with self.profiler.stage('fetch'):
+                for f in layer.getFeatures(request):
+                    original_geometries[f.id()] = self.history.original_geometries.get(f.id(), f.geometry())
+
+                # previously corrected features may have been moved out of the region by the correction
+                # (or deleted since)
+                moved_ids = [_id for _id in self.history.ids_in_rect(region) if _id not in original_geometries]
+                if moved_ids:
+                    request = QgsFeatureRequest()
+                    request.setFilterFids(moved_ids)
+                    request.setFlags(QgsFeatureRequest.NoGeometry)
+                    request.setNoAttributes()
+                    for f in layer.getFeatures(request):
+                        original_geometries[f.id()] = self.history.original_geometries[f.id()]
+
+        transformed = self._transform_batch(layer,
+                                            {_id: QgsGeometry(geometry) for _id, geometry in original_geometries.items()},
+                                            statistics)
+
+        # previously corrected features which are no longer changed are restored to their original geometries
+        restored = {_id: QgsGeometry(geometry) for _id, geometry in original_geometries.items()
+                    if _id not in transformed and _id in self.history.original_geometries}
+        statistics.changed_feature_count += len(restored)
+
+        if not self.dry_run:
+            failed_ids = self._write_to_edit_buffer(layer, {**transformed, **restored},
+                                                    self.tr('Update feature corrections'), statistics)
+            if failed_ids:
+                # features which failed to be written are left with geometries from neither correction,
+                # so the history no longer describes the layer
+                self.history.clear()
+            else:
+                self.history.update(transformer,
+                                    {_id: original_geometries[_id] for _id in transformed},
+                                    list(restored.keys()))
+
+        return True
+
+    def _write_to_edit_buffer(self, layer: QgsVectorLayer, geometries: Dict[int, QgsGeometry], command_text: str,
+                              statistics: TransformStatistics) -> Set[int]:
+        """
+        Writes corrected geometries to a layer's edit buffer, returning the IDs of features which could not
+        be changed. These features are counted as failed rather than changed in the statistics.
+        """
+        failed_ids = set()
+        with self.profiler.stage('write'), self._writing_history():
+            GeometryWriter.write_bulk(layer, geometries, command_text, failed_ids)
+
+        if failed_ids:
+            self.profiler.count('failed_features', len(failed_ids))
+            statistics.changed_feature_count -= len(failed_ids)
+            statistics.failed_feature_count += len(failed_ids)
+        return failed_ids
+
+    def _provider_batches(self, layer: QgsVectorLayer, provider,
+                          statistics: TransformStatistics,
+                          checkpoint: Optional[CorrectionCheckpoint] = None) -> Iterator[Dict[int, QgsGeometry]]:
+        """
+        Fetches and corrects geometries from a data provider in batches of batch_size features, or tile by tile
+        if tiling is enabled, yielding the corrected geometries for each batch.
+
+        If a checkpoint is specified then features which it lists as completed are skipped, and each batch is
+        recorded in the checkpoint as pending before its corrected geometries are written and as completed
+        once they have been written.
+        """
+        if self.tile_size > 0:
+            yield from self._corrected_tiles(layer, provider, statistics, checkpoint)
+            return
+
+        # the ids are fetched up-front so that no provider iterators are open while writing,
+        # and then geometries are fetched batch by batch
+        with self.profiler.stage('fetch/ids'):
+            candidate_ids = self._candidate_ids(layer, provider)
+            if checkpoint is not None and checkpoint.completed_ids:
+                feature_ids = array('q', (_id for _id in candidate_ids if _id not in checkpoint.completed_ids))
+            else:
+                feature_ids = array('q', candidate_ids)
+
+        batch_size = max(self.batch_size, 1)
+        for start in range(0, len(feature_ids), batch_size):
+            self._check_canceled()
+            batch_ids = list(feature_ids[start:start + batch_size])
+            request = QgsFeatureRequest()
+            request.setFilterFids(batch_ids)
+            request.setNoAttributes()
+            transformed = self._transform_batch(layer, self._fetch_geometries(provider, request), statistics)
+            if checkpoint is not None:
+                checkpoint.record_pending(transformed)
+            yield transformed
+
+            if checkpoint is not None:
+                checkpoint.record(batch_ids)
+
+            if self.feedback is not None:
+                self.feedback.setProgress(100 * min(start + batch_size, len(feature_ids)) / len(feature_ids))
+
+    def _correct_via_provider(self, layer: QgsVectorLayer, statistics: TransformStatistics):
+        """
+        Corrects a layer's features in batches, writing the changes directly to the layer's data provider
+        """
+        if layer.isEditable():
+            raise CorrectionException(
+                self.tr('Layer {} is in edit mode. Stop editing before writing corrections directly to the '
+                        'data provider').format(layer.name()))
+
+        provider = layer.dataProvider()
+        if not provider.capabilities() & QgsVectorDataProvider.ChangeGeometries:
+            raise CorrectionException(
+                self.tr('Layer {} does not support changing geometries').format(layer.name()))
+
+        self._influence_regions = self._calculate_influence_regions(layer)
+
+        writer = ProviderGeometryWriter(layer, commit_batches=self.commit_batches, dry_run=self.dry_run)
+        if not writer.begin():
+            raise CorrectionException(
+                self.tr('Could not start a transaction for layer {}: {}').format(layer.name(), writer.error))
+
+        checkpoint = self.checkpoint if writer.saves_batches() else None
+        if checkpoint is not None and checkpoint.begin(self.checkpoint_key(layer), self.collection.gcps,
+                                                       CorrectionCheckpoint.precision_for_layer(layer)):
+            if checkpoint.pending:
+                # the previous run was interrupted while writing a batch, so check which of its features were saved
+                request = QgsFeatureRequest()
+                request.setFilterFids(list(checkpoint.pending.keys()))
+                request.setNoAttributes()
+                checkpoint.resolve_pending(self._fetch_geometries(provider, request))
+            self.profiler.count('checkpoint_skipped_features', checkpoint.resumed_feature_count)
+
+        try:
+            for transformed in self._provider_batches(layer, provider, statistics, checkpoint):
+                with self.profiler.stage('write'):
+                    ok = writer.write(transformed)
+                if not ok:
+                    raise CorrectionException(
+                        self.tr('Could not write corrections to layer {}: {}').format(layer.name(), writer.error))
+                self.profiler.count('batches')
+        except Exception:
+            writer.rollback()
+            raise
+
+        with self.profiler.stage('commit'):
+            ok = writer.finish()
+        if not ok:
+            raise CorrectionException(
+                self.tr('Could not commit corrections to layer {}: {}').format(layer.name(), writer.error))
+
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        if writer.written_count:
+            layer.reload()
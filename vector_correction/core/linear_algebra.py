@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Linear algebra utilities
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+from typing import (
+    List,
+    Optional
+)
+
+
+class LinearAlgebra:
+    """
+    Small dense linear algebra utilities.
+
+    These are intended for the small systems which result from local fitting, and have no
+    dependencies outside of the Python standard library.
+    """
+
+    SINGULAR_TOLERANCE = 1e-12
+
+    @staticmethod
+    def solve(matrix: List[List[float]], rhs: List[List[float]]) -> Optional[List[List[float]]]:  # pylint: disable=too-many-locals
+        """
+        Solves the linear system matrix * x = rhs using Gaussian elimination with partial pivoting.
+
+        :param matrix: square matrix, as a list of rows
+        :param rhs: right hand sides, as a list of rows with one value per right hand side
+        :return: solution as a list of rows with one value per right hand side, or None if the system is singular
+        """
+        size = len(matrix)
+        if not size:
+            return []
+
+        rhs_count = len(rhs[0])
+        augmented = [list(row) + list(rhs_row) for row, rhs_row in zip(matrix, rhs)]
+        columns = size + rhs_count
+
+        scale = max(abs(v) for row in matrix for v in row)
+        if not scale:
+            return None
+        tolerance = scale * LinearAlgebra.SINGULAR_TOLERANCE
+
+        for k in range(size):
+            pivot_row = max(range(k, size), key=lambda r, col=k: abs(augmented[r][col]))
+            if abs(augmented[pivot_row][k]) <= tolerance:
+                return None
+
+            if pivot_row != k:
+                augmented[k], augmented[pivot_row] = augmented[pivot_row], augmented[k]
+
+            pivot = augmented[k]
+            inverse_pivot = 1.0 / pivot[k]
+            for r in range(k + 1, size):
+                row = augmented[r]
+                factor = row[k] * inverse_pivot
+                if factor:
+                    for c in range(k, columns):
+                        row[c] -= factor * pivot[c]
+
+        solution = [[0.0] * rhs_count for _ in range(size)]
+        for k in range(size - 1, -1, -1):
+            row = augmented[k]
+            for c in range(rhs_count):
+                value = row[size + c]
+                for j in range(k + 1, size):
+                    value -= row[j] * solution[j][c]
+                solution[k][c] = value / row[k]
+
+        return solution
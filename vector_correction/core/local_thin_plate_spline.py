@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""Local thin plate spline interpolation
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+
+from vector_correction.core.linear_algebra import LinearAlgebra
+
+
+class _Patch:
+    """
+    A thin plate spline fitted to the displacements of a small set of points, in coordinates
+    local to a grid node
+    """
+
+    def __init__(self, origin_x: float, origin_y: float, scale: float,  # pylint: disable=too-many-locals
+                 points: List[Tuple[float, float]],
+                 displacements: List[Tuple[float, float]]):
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.scale = scale
+        self.points = [((x - origin_x) / scale, (y - origin_y) / scale) for x, y in points]
+        self.displacements = displacements
+        self.weights = None
+        self.affine = None
+
+        size = len(self.points)
+        matrix = [[0.0] * (size + 3) for _ in range(size + 3)]
+        for i, (xi, yi) in enumerate(self.points):
+            row = matrix[i]
+            for j in range(i + 1, size):
+                xj, yj = self.points[j]
+                value = _Patch.kernel((xi - xj) ** 2 + (yi - yj) ** 2)
+                row[j] = value
+                matrix[j][i] = value
+            row[size] = 1.0
+            row[size + 1] = xi
+            row[size + 2] = yi
+            matrix[size][i] = 1.0
+            matrix[size + 1][i] = xi
+            matrix[size + 2][i] = yi
+
+        rhs = [list(d) for d in displacements] + [[0.0, 0.0]] * 3
+        solution = LinearAlgebra.solve(matrix, rhs)
+        if solution is not None:
+            self.weights = solution[:size]
+            self.affine = solution[size:]
+
+    @staticmethod
+    def kernel(squared_distance: float) -> float:
+        """
+        Thin plate spline radial basis function, r^2 log(r), evaluated from a squared distance
+        """
+        if squared_distance <= 0:
+            return 0.0
+        return 0.5 * squared_distance * math.log(squared_distance)
+
+    def displacement(self, x: float, y: float) -> Tuple[float, float]:
+        """
+        Evaluates the displacement at a point
+        """
+        x = (x - self.origin_x) / self.scale
+        y = (y - self.origin_y) / self.scale
+
+        if self.weights is None:
+            return self._inverse_distance_displacement(x, y)
+
+        dx = self.affine[0][0] + self.affine[1][0] * x + self.affine[2][0] * y
+        dy = self.affine[0][1] + self.affine[1][1] * x + self.affine[2][1] * y
+        for (px, py), (wx, wy) in zip(self.points, self.weights):
+            u = _Patch.kernel((x - px) ** 2 + (y - py) ** 2)
+            dx += wx * u
+            dy += wy * u
+
+        return dx, dy
+
+    def _inverse_distance_displacement(self, x: float, y: float) -> Tuple[float, float]:
+        """
+        Fallback interpolation for point sets which cannot be fitted by a thin plate spline,
+        e.g. colinear points
+        """
+        sum_weights = 0
+        dx = 0
+        dy = 0
+        for (px, py), (point_dx, point_dy) in zip(self.points, self.displacements):
+            squared_distance = (x - px) ** 2 + (y - py) ** 2
+            if squared_distance == 0:
+                return point_dx, point_dy
+            weight = 1.0 / squared_distance
+            sum_weights += weight
+            dx += weight * point_dx
+            dy += weight * point_dy
+
+        if not sum_weights:
+            return 0.0, 0.0
+
+        return dx / sum_weights, dy / sum_weights
+
+
+class LocalThinPlateSpline:
+    """
+    A scalable approximation of thin plate spline interpolation, using a partition of unity of
+    local thin plate splines.
+
+    Points are bucketed into a regular grid sized so that each cell contains a handful of points.
+    A small thin plate spline is fitted around each grid node using only the points from the
+    four cells adjacent to that node, and the patches are blended using bilinear weights. Since
+    every patch interpolates all points within its support, the blended surface still interpolates
+    the control points exactly (except in very dense clusters, where patches are capped in size).
+
+    Bucketing is O(N), each patch fit is O(k^3) for a small, bounded k and each evaluation is O(k).
+    Patches are fitted lazily on first use, so only the regions which are actually evaluated
+    incur fitting costs. Points outside the extent of the control points are extrapolated by the
+    patches along the edge of the grid.
+    """
+
+    TARGET_POINTS_PER_CELL = 4
+    MINIMUM_PATCH_POINTS = 8
+    MAXIMUM_PATCH_POINTS = 48
+
+    def __init__(self, source: List[Tuple[float, float]], destination: List[Tuple[float, float]]):
+        """
+        Constructor for LocalThinPlateSpline.
+
+        :param source: list of (x, y) source points
+        :param destination: list of (x, y) destination points, matching source
+        """
+        self.source = []
+        self.displacements = []
+
+        seen = set()
+        for (sx, sy), (dx, dy) in zip(source, destination):
+            # duplicate source points cannot be interpolated, keep the first occurrence
+            if (sx, sy) in seen:
+                continue
+            seen.add((sx, sy))
+            self.source.append((sx, sy))
+            self.displacements.append((dx - sx, dy - sy))
+
+        self.x_origin = min((p[0] for p in self.source), default=0)
+        self.y_origin = min((p[1] for p in self.source), default=0)
+        width = max((p[0] for p in self.source), default=0) - self.x_origin
+        height = max((p[1] for p in self.source), default=0) - self.y_origin
+
+        count = max(len(self.source), 1)
+        if width > 0 and height > 0:
+            self.cell_size = math.sqrt(width * height * LocalThinPlateSpline.TARGET_POINTS_PER_CELL / count)
+        else:
+            self.cell_size = max(width, height) * LocalThinPlateSpline.TARGET_POINTS_PER_CELL / count
+        if not self.cell_size:
+            self.cell_size = 1.0
+
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        for index, (x, y) in enumerate(self.source):
+            self.cells.setdefault(self._cell(x, y), []).append(index)
+
+        self.columns = int(width / self.cell_size) + 1
+        self.rows = int(height / self.cell_size) + 1
+        self.max_ring = self.columns + self.rows
+        self.patches: Dict[Tuple[int, int], _Patch] = {}
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        """
+        Returns the grid cell containing a point
+        """
+        return (math.floor((x - self.x_origin) / self.cell_size),
+                math.floor((y - self.y_origin) / self.cell_size))
+
+    def _patch_indices(self, i: int, j: int) -> List[int]:
+        """
+        Returns the indices of the points to use for the patch centered on node (i, j)
+        """
+        required = min(LocalThinPlateSpline.MINIMUM_PATCH_POINTS, len(self.source))
+
+        indices = []
+        for cell in ((i - 1, j - 1), (i, j - 1), (i - 1, j), (i, j)):
+            indices.extend(self.cells.get(cell, []))
+
+        ring = 1
+        while len(indices) < required:
+            ring += 1
+            if ring > self.max_ring:
+                # node is far from the populated grid
+                return self._nearest_indices(i, j, required)
+
+            for ci in range(i - ring, i + ring):
+                for cj in range(j - ring, j + ring):
+                    if i - ring < ci < i + ring - 1 and j - ring < cj < j + ring - 1:
+                        continue
+                    indices.extend(self.cells.get((ci, cj), []))
+
+        if len(indices) > LocalThinPlateSpline.MAXIMUM_PATCH_POINTS:
+            indices = self._closest_to_node(i, j, indices, LocalThinPlateSpline.MAXIMUM_PATCH_POINTS)
+
+        return indices
+
+    def _patch_points(self, i: int, j: int) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
+        """
+        Returns the (point, displacement) pairs used for the patch centered on node (i, j)
+        """
+        return [(self.source[index], self.displacements[index]) for index in self._patch_indices(i, j)]
+
+    def changed_nodes(self, other: 'LocalThinPlateSpline') -> Optional[Set[Tuple[int, int]]]:
+        """
+        Returns the grid nodes whose patches differ from the patches of another spline, or None if the
+        splines use different grids (in which case every patch may differ).
+
+        The grid depends only on the number and extent of the points, so tweaking the positions of
+        points within the existing extent affects only the patches near those points.
+        """
+        if (self.x_origin, self.y_origin, self.cell_size, self.columns, self.rows) != \
+                (other.x_origin, other.y_origin, other.cell_size, other.columns, other.rows):
+            return None
+
+        if self.source == other.source and self.displacements == other.displacements:
+            return set()
+
+        # patches grow outwards until they contain enough points, so a changed point can affect
+        # distant patches in sparse regions. Comparing the inputs of every patch is exact and still
+        # much cheaper than fitting them.
+        return {(i, j)
+                for i in range(self.columns + 1)
+                for j in range(self.rows + 1)
+                if self._patch_points(i, j) != other._patch_points(i, j)}  # pylint: disable=protected-access
+
+    def displaced_nodes(self) -> Set[Tuple[int, int]]:
+        """
+        Returns the grid nodes whose patches have a non-zero displacement.
+
+        Patches fitted only to points without displacement are exactly zero, so the spline leaves points
+        unchanged away from these nodes.
+        """
+        return {(i, j)
+                for i in range(self.columns + 1)
+                for j in range(self.rows + 1)
+                if any(dx or dy for _, (dx, dy) in self._patch_points(i, j))}
+
+    def node_bounds(self, nodes: Set[Tuple[int, int]]) -> Optional[Tuple[float, float, float, float]]:
+        """
+        Returns the (x_min, y_min, x_max, y_max) bounds of the region influenced by a set of grid nodes,
+        or None if the region is unbounded
+        """
+        if not nodes:
+            return None
+
+        min_i = min(i for i, _ in nodes)
+        max_i = max(i for i, _ in nodes)
+        min_j = min(j for _, j in nodes)
+        max_j = max(j for _, j in nodes)
+        if min_i <= 0 or min_j <= 0 or max_i >= self.columns or max_j >= self.rows:
+            # points outside the grid are extrapolated by the patches along the grid edge
+            return None
+
+        x_min, y_min = self._node_position(min_i - 1, min_j - 1)
+        x_max, y_max = self._node_position(max_i + 1, max_j + 1)
+        return x_min, y_min, x_max, y_max
+
+    def _node_position(self, i: int, j: int) -> Tuple[float, float]:
+        """
+        Returns the map position of node (i, j)
+        """
+        return self.x_origin + i * self.cell_size, self.y_origin + j * self.cell_size
+
+    def _closest_to_node(self, i: int, j: int, indices: List[int], count: int) -> List[int]:
+        """
+        Returns the count indices closest to node (i, j)
+        """
+        node_x, node_y = self._node_position(i, j)
+        return sorted(indices,
+                      key=lambda index: (self.source[index][0] - node_x) ** 2 + (self.source[index][1] - node_y) ** 2
+                      )[:count]
+
+    def _nearest_indices(self, i: int, j: int, count: int) -> List[int]:
+        """
+        Returns the count indices closest to node (i, j), scanning populated cells from nearest to furthest
+        """
+        cells = sorted(self.cells.keys(), key=lambda c: max(abs(c[0] - i), abs(c[1] - j)))
+        indices = []
+        for cell in cells:
+            indices.extend(self.cells[cell])
+            if len(indices) >= count:
+                break
+
+        return self._closest_to_node(i, j, indices, count)
+
+    def _patch(self, i: int, j: int) -> _Patch:
+        """
+        Returns the patch centered on node (i, j), fitting it if required
+        """
+        patch = self.patches.get((i, j))
+        if patch is None:
+            indices = self._patch_indices(i, j)
+            node_x, node_y = self._node_position(i, j)
+            patch = _Patch(node_x, node_y, self.cell_size,
+                           [self.source[index] for index in indices],
+                           [self.displacements[index] for index in indices])
+            self.patches[(i, j)] = patch
+
+        return patch
+
+    def fit_all(self):
+        """
+        Eagerly fits all patches which touch a control point
+        """
+        nodes = set()
+        for i, j in self.cells:
+            nodes.update(((i, j), (i + 1, j), (i, j + 1), (i + 1, j + 1)))
+        for i, j in nodes:
+            self._patch(i, j)
+
+    def displacement(self, x: float, y: float) -> Optional[Tuple[float, float]]:
+        """
+        Returns the interpolated displacement at a point, or None if no points have been set
+        """
+        if not self.source:
+            return None
+
+        # points outside the grid are extrapolated by the patches along the grid edge, which keeps
+        # the number of patches bounded
+        u = min(max((x - self.x_origin) / self.cell_size, 0), self.columns)
+        v = min(max((y - self.y_origin) / self.cell_size, 0), self.rows)
+        i = min(math.floor(u), self.columns - 1)
+        j = min(math.floor(v), self.rows - 1)
+        u -= i
+        v -= j
+
+        dx = 0
+        dy = 0
+        for node_i, node_j, weight in ((i, j, (1 - u) * (1 - v)),
+                                       (i + 1, j, u * (1 - v)),
+                                       (i, j + 1, (1 - u) * v),
+                                       (i + 1, j + 1, u * v)):
+            if weight <= 0:
+                continue
+            patch_dx, patch_dy = self._patch(node_i, node_j).displacement(x, y)
+            dx += weight * patch_dx
+            dy += weight * patch_dy
+
+        return dx, dy
+
+    def transform(self, x: float, y: float) -> Optional[Tuple[float, float]]:
+        """
+        Transforms a point, returning None if the transform failed
+        """
+        displacement = self.displacement(x, y)
+        if displacement is None:
+            return None
+
+        return x + displacement[0], y + displacement[1]
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Piecewise affine interpolation
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple
+)
+
+
+class _Triangle:
+    """
+    A single triangle of a piecewise affine transform, storing the affine transform mapping
+    the source triangle to the destination triangle
+    """
+
+    __slots__ = ('vertices', 'x0', 'y0', 'a', 'b', 'c', 'd', 'dx0', 'dy0', 'du', 'dv')
+
+    def __init__(self, vertices: Tuple[int, int, int],  # pylint: disable=too-many-locals
+                 source: List[Tuple[float, float]],
+                 destination: List[Tuple[float, float]]):
+        self.vertices = vertices
+        (x0, y0), (x1, y1), (x2, y2) = (source[v] for v in vertices)
+        det = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+
+        self.x0 = x0
+        self.y0 = y0
+        # inverse of the source triangle basis, used to calculate barycentric coordinates
+        self.a = (y2 - y0) / det
+        self.b = -(x2 - x0) / det
+        self.c = -(y1 - y0) / det
+        self.d = (x1 - x0) / det
+
+        (qx0, qy0), (qx1, qy1), (qx2, qy2) = (destination[v] for v in vertices)
+        self.dx0 = qx0
+        self.dy0 = qy0
+        self.du = (qx1 - qx0, qy1 - qy0)
+        self.dv = (qx2 - qx0, qy2 - qy0)
+
+    def barycentric(self, x: float, y: float) -> Tuple[float, float]:
+        """
+        Returns the (u, v) barycentric coordinates of a point relative to the triangle
+        """
+        x -= self.x0
+        y -= self.y0
+        return self.a * x + self.b * y, self.c * x + self.d * y
+
+    def transform(self, u: float, v: float) -> Tuple[float, float]:
+        """
+        Transforms a point given by barycentric coordinates
+        """
+        return (self.dx0 + u * self.du[0] + v * self.dv[0],
+                self.dy0 + u * self.du[1] + v * self.dv[1])
+
+
+class PiecewiseAffine:
+    """
+    Piecewise affine ("rubber sheeting") interpolation over a triangulation of the source points.
+
+    Each point is transformed using the affine transform of the triangle which contains it, so
+    every control point only influences the triangles which share it. Points outside the
+    triangulation are extrapolated using the affine transform of the triangle with the nearest
+    boundary edge, so only triangles on the edge of the triangulation affect points outside it.
+
+    Triangles are bucketed into a regular grid for point location, so each point is located in
+    (near) constant time. The most recently used triangle is checked first, which makes runs of
+    nearby vertices (as found in typical geometries) particularly cheap.
+    """
+
+    EPSILON = 1e-12
+
+    def __init__(self, source: List[Tuple[float, float]], destination: List[Tuple[float, float]],  # pylint: disable=too-many-locals
+                 triangles: List[Tuple[int, int, int]]):
+        """
+        Constructor for PiecewiseAffine.
+
+        :param source: list of (x, y) source points
+        :param destination: list of (x, y) destination points, matching source
+        :param triangles: triangulation of the source points, as triplets of point indices
+        """
+        self.triangles: List[_Triangle] = []
+        for vertices in triangles:
+            (x0, y0), (x1, y1), (x2, y2) = (source[v] for v in vertices)
+            area = abs((x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0))
+            scale = (x1 - x0) ** 2 + (y1 - y0) ** 2 + (x2 - x0) ** 2 + (y2 - y0) ** 2
+            if area <= PiecewiseAffine.EPSILON * scale:
+                # degenerate (colinear) triangle
+                continue
+            self.triangles.append(_Triangle(vertices, source, destination))
+
+        self.last_triangle: Optional[_Triangle] = None
+        self.cells: Dict[Tuple[int, int], List[_Triangle]] = {}
+        # edges on the boundary of the triangulation, as ((x1, y1, x2, y2), triangle) tuples
+        self.boundary_edges: List[Tuple[Tuple[float, float, float, float], _Triangle]] = []
+        self.boundary_cells: Dict[Tuple[int, int], List[int]] = {}
+        if not self.triangles:
+            self.x_origin = self.y_origin = 0
+            self.cell_size = 1
+            self.columns = self.rows = 0
+            return
+
+        used = {v for t in self.triangles for v in t.vertices}
+        self.x_origin = min(source[v][0] for v in used)
+        self.y_origin = min(source[v][1] for v in used)
+        width = max(source[v][0] for v in used) - self.x_origin
+        height = max(source[v][1] for v in used) - self.y_origin
+        self.cell_size = max(math.sqrt(width * height / len(self.triangles)) * 2, PiecewiseAffine.EPSILON)
+        self.columns = int(width / self.cell_size) + 1
+        self.rows = int(height / self.cell_size) + 1
+
+        for triangle in self.triangles:
+            xs = [source[v][0] for v in triangle.vertices]
+            ys = [source[v][1] for v in triangle.vertices]
+            for cell in self._cells_in_bounds(min(xs), min(ys), max(xs), max(ys)):
+                self.cells.setdefault(cell, []).append(triangle)
+
+        self._index_boundary_edges(source)
+
+    def _index_boundary_edges(self, source: List[Tuple[float, float]]):
+        """
+        Finds the edges used by only a single triangle, and buckets them into the grid
+        """
+        edge_triangles: Dict[Tuple[int, int], List[_Triangle]] = {}
+        for triangle in self.triangles:
+            a, b, c = triangle.vertices
+            for edge in ((a, b), (b, c), (c, a)):
+                edge_triangles.setdefault((min(edge), max(edge)), []).append(triangle)
+
+        for (a, b), triangles in edge_triangles.items():
+            if len(triangles) != 1:
+                continue
+
+            (x1, y1), (x2, y2) = source[a], source[b]
+            for cell in self._cells_in_bounds(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)):
+                self.boundary_cells.setdefault(cell, []).append(len(self.boundary_edges))
+            self.boundary_edges.append(((x1, y1, x2, y2), triangles[0]))
+
+    def __bool__(self):
+        return bool(self.triangles)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        """
+        Returns the grid cell containing a point, clamped to the grid
+        """
+        i = min(max(math.floor((x - self.x_origin) / self.cell_size), 0), self.columns - 1)
+        j = min(max(math.floor((y - self.y_origin) / self.cell_size), 0), self.rows - 1)
+        return i, j
+
+    def _cells_in_bounds(self, min_x: float, min_y: float, max_x: float, max_y: float) -> Iterator[Tuple[int, int]]:
+        """
+        Yields the grid cells overlapping a bounding box
+        """
+        min_i, min_j = self._cell(min_x, min_y)
+        max_i, max_j = self._cell(max_x, max_y)
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                yield i, j
+
+    @staticmethod
+    def _ring_cells(i: int, j: int, ring: int) -> Iterator[Tuple[int, int]]:
+        """
+        Yields the grid cells on a square ring around a cell
+        """
+        for ci in range(i - ring, i + ring + 1):
+            for cj in range(j - ring, j + ring + 1):
+                if i - ring < ci < i + ring and j - ring < cj < j + ring:
+                    continue
+                yield ci, cj
+
+    @staticmethod
+    def _contains(u: float, v: float) -> bool:
+        """
+        Returns True if barycentric coordinates are inside a triangle
+        """
+        return u >= -PiecewiseAffine.EPSILON and v >= -PiecewiseAffine.EPSILON and \
+            u + v <= 1 + PiecewiseAffine.EPSILON
+
+    @staticmethod
+    def _segment_distance_squared(x: float, y: float, segment: Tuple[float, float, float, float]) -> float:
+        """
+        Returns the squared distance from a point to a line segment, given as (x1, y1, x2, y2)
+        """
+        x1, y1, x2, y2 = segment
+        dx = x2 - x1
+        dy = y2 - y1
+        length_squared = dx * dx + dy * dy
+        t = 0 if length_squared == 0 else min(max(((x - x1) * dx + (y - y1) * dy) / length_squared, 0), 1)
+        return (x1 + t * dx - x) ** 2 + (y1 + t * dy - y) ** 2
+
+    def _nearest_boundary_triangle(self, x: float, y: float) -> _Triangle:
+        """
+        Returns the triangle with the boundary edge nearest to a point.
+
+        Grid cells are searched in rings around the point's cell until no unsearched cell can contain
+        a nearer edge.
+        """
+        i, j = self._cell(x, y)
+        nearest = None
+        nearest_distance = math.inf
+        for ring in range(max(self.columns, self.rows) + 1):
+            if nearest is not None and ((ring - 1) * self.cell_size) ** 2 > nearest_distance:
+                break
+
+            for cell in self._ring_cells(i, j, ring):
+                for index in self.boundary_cells.get(cell, []):
+                    segment, triangle = self.boundary_edges[index]
+                    distance = self._segment_distance_squared(x, y, segment)
+                    if distance < nearest_distance:
+                        nearest = triangle
+                        nearest_distance = distance
+
+        return nearest
+
+    def triangle_for_point(self, x: float, y: float) -> Optional[_Triangle]:
+        """
+        Returns the triangle to use for transforming a point. This is either the triangle containing
+        the point, or the triangle with the nearest boundary edge for points outside the triangulation.
+        """
+        if not self.triangles:
+            return None
+
+        if self.last_triangle is not None and self._contains(*self.last_triangle.barycentric(x, y)):
+            return self.last_triangle
+
+        for triangle in self.cells.get(self._cell(x, y), []):
+            if self._contains(*triangle.barycentric(x, y)):
+                self.last_triangle = triangle
+                return triangle
+
+        # outside the triangulation
+        return self._nearest_boundary_triangle(x, y)
+
+    def transform(self, x: float, y: float) -> Optional[Tuple[float, float]]:
+        """
+        Transforms a point, returning None if the transform failed
+        """
+        triangle = self.triangle_for_point(x, y)
+        if triangle is None:
+            return None
+
+        return triangle.transform(*triangle.barycentric(x, y))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Correction profiler
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import json
+import time
+from collections import defaultdict
+from contextlib import (
+    contextmanager,
+    nullcontext
+)
+from typing import Dict
+
+from qgis.core import (
+    Qgis,
+    QgsMessageLog
+)
+
+
+class Profiler:
+    """
+    Collects per-stage timings and counters for correction runs.
+
+    Stage timings are accumulated, so a stage entered many times (e.g. once per batch) reports
+    the total time spent in it. Stage names use '/' to indicate nesting, e.g. 'transform/reprojection'
+    is included in the 'transform' time.
+    """
+
+    LOG_TAG = 'Vector Correction'
+
+    enabled = True
+
+    def __init__(self):
+        self.timings: Dict[str, float] = defaultdict(float)
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Context manager which times a stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def add_time(self, name: str, seconds: float):
+        """
+        Adds time to a stage
+        """
+        self.timings[name] += seconds
+
+    def count(self, name: str, value: int = 1):
+        """
+        Increments a counter
+        """
+        self.counters[name] += value
+
+    def clear(self):
+        """
+        Clears all collected timings and counters
+        """
+        self.timings.clear()
+        self.counters.clear()
+
+    def to_dict(self) -> dict:
+        """
+        Returns the collected timings (in seconds) and counters as a dictionary
+        """
+        return {
+            'timings': dict(self.timings),
+            'counters': dict(self.counters)
+        }
+
+    def report(self) -> str:
+        """
+        Returns a human readable report of the collected timings and counters
+        """
+        lines = []
+        for name in sorted(self.timings.keys()):
+            indent = '  ' * name.count('/')
+            lines.append(f'{indent}{name.split("/")[-1]}: {self.timings[name] * 1000:.1f} ms')
+        for name in sorted(self.counters.keys()):
+            lines.append(f'{name}: {self.counters[name]}')
+        return '\n'.join(lines)
+
+    def log(self, title: str = ''):
+        """
+        Writes the report to the QGIS message log
+        """
+        report = self.report()
+        QgsMessageLog.logMessage(f'{title}\n{report}' if title else report, Profiler.LOG_TAG, Qgis.Info)
+
+    def write_json(self, path: str):
+        """
+        Writes the collected timings and counters to a JSON file
+        """
+        with open(path, 'wt', encoding='utf8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class NullProfiler(Profiler):
+    """
+    A profiler which does nothing, used when profiling is disabled.
+
+    Code which would otherwise perform work purely for profiling (e.g. timing every vertex)
+    should check the enabled flag and skip that work entirely.
+    """
+
+    enabled = False
+
+    _NULL_CONTEXT = nullcontext()
+
+    def stage(self, name: str):  # pylint: disable=unused-argument
+        return NullProfiler._NULL_CONTEXT
+
+    def add_time(self, name: str, seconds: float):
+        pass
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+    def report(self) -> str:
+        return ''
+
+    def log(self, title: str = ''):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
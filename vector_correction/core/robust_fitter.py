@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Robust fitter
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+from typing import (
+    List,
+    Optional,
+    Tuple
+)
+
+from qgis.core import QgsPointXY
+
+from vector_correction.core.transform_methods import TransformMethods
+
+
+class RobustFitter:
+    """
+    Fits GCP transformers while automatically excluding outlying GCPs.
+
+    Fitting is iteratively reweighted with binary weights: the transform is fitted to the current
+    inliers, residuals are calculated for every GCP, and GCPs with a residual greater than threshold
+    times a robust estimate of the residual standard deviation (1.4826 x the median residual) are
+    excluded from the next fit. This repeats until the set of inliers no longer changes.
+
+    Each iteration requires one fit and one pass over the GCPs, so the cost is a small multiple
+    of a regular fit.
+    """
+
+    DEFAULT_THRESHOLD = 3.0
+    DEFAULT_MAXIMUM_ITERATIONS = 10
+
+    # scale factor for estimating a standard deviation from a median absolute deviation
+    MAD_SCALE = 1.4826
+
+    # residuals below this are never considered outliers, which avoids flagging rounding errors
+    # for transforms which fit the inliers exactly
+    MINIMUM_LIMIT = 1e-8
+
+    @staticmethod
+    def residuals(transformer,
+                  origin_points: List[QgsPointXY],
+                  destination_points: List[QgsPointXY]) -> List[float]:
+        """
+        Calculates the residual for each GCP. Points which cannot be transformed have an infinite residual.
+        """
+        res = []
+        transform = transformer.transform
+        for origin, destination in zip(origin_points, destination_points):
+            ok, x, y = transform(origin.x(), origin.y())
+            res.append(math.hypot(destination.x() - x, destination.y() - y) if ok else math.inf)
+        return res
+
+    @staticmethod
+    def classify(residuals: List[Optional[float]], threshold: float = DEFAULT_THRESHOLD) -> List[bool]:
+        """
+        Classifies a list of residuals, returning True for inliers and False for outliers.
+
+        None residuals are considered outliers.
+        """
+        finite = sorted(r for r in residuals if r is not None and math.isfinite(r))
+        if not finite:
+            return [False] * len(residuals)
+
+        middle = len(finite) // 2
+        median = finite[middle] if len(finite) % 2 else (finite[middle - 1] + finite[middle]) * 0.5
+        limit = max(threshold * RobustFitter.MAD_SCALE * median, RobustFitter.MINIMUM_LIMIT)
+        return [r is not None and r <= limit for r in residuals]
+
+    @staticmethod
+    def fit(method,
+            origin_points: List[QgsPointXY],
+            destination_points: List[QgsPointXY],
+            threshold: float = DEFAULT_THRESHOLD,
+            maximum_iterations: int = DEFAULT_MAXIMUM_ITERATIONS) -> Tuple[Optional[object], List[bool]]:
+        """
+        Fits a transformer of the specified method, excluding outliers.
+
+        Returns a tuple of the fitted transformer and the inlier flags for the GCPs it was fitted to, both from
+        the last successful iteration. If no transformer could be fitted then None is returned, with every GCP
+        flagged as an outlier.
+        """
+        inliers = [True] * len(origin_points)
+        transformer = None
+        fitted_inliers = [False] * len(origin_points)
+        for _ in range(maximum_iterations):
+            candidate = TransformMethods.create(method)
+            inlier_origins = [p for p, inlier in zip(origin_points, inliers) if inlier]
+            if len(inlier_origins) < candidate.minimumGcpCount():
+                break
+
+            inlier_destinations = [p for p, inlier in zip(destination_points, inliers) if inlier]
+            if not candidate.updateParametersFromGcps(inlier_origins, inlier_destinations):
+                break
+
+            transformer = candidate
+            fitted_inliers = inliers
+            new_inliers = RobustFitter.classify(RobustFitter.residuals(transformer, origin_points,
+                                                                       destination_points), threshold)
+            if new_inliers == inliers:
+                break
+            inliers = new_inliers
+
+        return transformer, fitted_inliers
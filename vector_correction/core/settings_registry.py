@@ -13,6 +13,8 @@ __copyright__ = 'Copyright 2020, North Road'
 # This will get replaced with a git SHA1 when you do a git archive
 __revision__ = '$Format:%H$'
 
+from typing import Union
+
 from qgis.PyQt.QtXml import (
     QDomDocument
 )
@@ -35,33 +37,82 @@ from qgis.core import (
     QgsSimpleFillSymbolLayer
 )
 
+from vector_correction.core.transform_methods import TransformMethods
+
 
-class SettingsRegistry:
+# every plugin setting is exposed as a typed getter/setter pair, so the public method count grows with the settings
+class SettingsRegistry:  # pylint: disable=too-many-public-methods
     """
     Plugin settings registry
     """
 
     ARROW_SYMBOL = None
     EXTENT_SYMBOL = None
+    TRANSFORM_METHOD = None
+    PREVIEW_COLOR = None
+    VALUES = {}
+
+    @staticmethod
+    def invalidate_cache():
+        """
+        Discards all cached setting values, forcing them to be re-read from the stored settings.
+
+        This must be called whenever the stored settings are changed other than via the
+        setters in this class.
+        """
+        SettingsRegistry.ARROW_SYMBOL = None
+        SettingsRegistry.EXTENT_SYMBOL = None
+        SettingsRegistry.TRANSFORM_METHOD = None
+        SettingsRegistry.PREVIEW_COLOR = None
+        SettingsRegistry.VALUES = {}
 
     @staticmethod
-    def transform_method() -> QgsGcpTransformerInterface.TransformMethod:
+    def _value(key: str, default, value_type):
         """
-        Returns the current transform method
+        Returns a cached setting value, reading it from the stored settings if required
         """
+        if key not in SettingsRegistry.VALUES:
+            settings = QgsSettings()
+            SettingsRegistry.VALUES[key] = settings.value(key, default, value_type, QgsSettings.Plugins)
+
+        return SettingsRegistry.VALUES[key]
+
+    @staticmethod
+    def _set_value(key: str, value):
+        """
+        Sets a setting value, updating both the cache and the stored settings
+        """
+        SettingsRegistry.VALUES[key] = value
+
         settings = QgsSettings()
-        current_method = QgsGcpTransformerInterface.TransformMethod(
+        settings.setValue(key, value, QgsSettings.Plugins)
+
+    @staticmethod
+    def transform_method() -> Union[QgsGcpTransformerInterface.TransformMethod, int]:
+        """
+        Returns the current transform method.
+
+        This will either be a native QgsGcpTransformerInterface.TransformMethod or one of the
+        plugin methods from TransformMethods.
+        """
+        if SettingsRegistry.TRANSFORM_METHOD is not None:
+            return SettingsRegistry.TRANSFORM_METHOD
+
+        settings = QgsSettings()
+        SettingsRegistry.TRANSFORM_METHOD = TransformMethods.from_int(
             settings.value('vector_corrections/method',
                            int(QgsGcpTransformerInterface.TransformMethod.Helmert),
                            int, QgsSettings.Plugins)
         )
-        return current_method
+        return SettingsRegistry.TRANSFORM_METHOD
 
     @staticmethod
-    def set_transform_method(method: QgsGcpTransformerInterface.TransformMethod):
+    def set_transform_method(method: Union[QgsGcpTransformerInterface.TransformMethod, int]):
         """
         Sets the current transform method
         """
+        SettingsRegistry.TRANSFORM_METHOD = method
+
         settings = QgsSettings()
         settings.setValue('vector_corrections/method', int(method), QgsSettings.Plugins)
 
@@ -198,18 +249,250 @@ class SettingsRegistry:
         """
         Returns the feature preview color
         """
+        if SettingsRegistry.PREVIEW_COLOR is not None:
+            return QColor(SettingsRegistry.PREVIEW_COLOR)
+
         settings = QgsSettings()
-        return QgsSymbolLayerUtils.decodeColor(settings.value('vector_corrections/preview_color',
-                                                              QgsSymbolLayerUtils.encodeColor(QColor(200, 200, 200)),
-                                                              str, QgsSettings.Plugins))
+        SettingsRegistry.PREVIEW_COLOR = QgsSymbolLayerUtils.decodeColor(
+            settings.value('vector_corrections/preview_color',
+                           QgsSymbolLayerUtils.encodeColor(QColor(200, 200, 200)),
+                           str, QgsSettings.Plugins))
+        return QColor(SettingsRegistry.PREVIEW_COLOR)
 
     @staticmethod
     def set_preview_color(color: QColor):
         """
         Sets the feature preview color
         """
+        SettingsRegistry.PREVIEW_COLOR = QColor(color)
+
         settings = QgsSettings()
         settings.setValue('vector_corrections/preview_color', QgsSymbolLayerUtils.encodeColor(color), QgsSettings.Plugins)
 
+    @staticmethod
+    def use_displacement_grid() -> bool:
+        """
+        Returns True if corrections should be applied via a precomputed displacement grid
+        """
+        return SettingsRegistry._value('vector_corrections/use_displacement_grid', False, bool)
+
+    @staticmethod
+    def set_use_displacement_grid(use: bool):
+        """
+        Sets whether corrections should be applied via a precomputed displacement grid
+        """
+        SettingsRegistry._set_value('vector_corrections/use_displacement_grid', use)
+
+    @staticmethod
+    def displacement_grid_resolution() -> float:
+        """
+        Returns the displacement grid resolution, in map units of the area of interest
+        """
+        return SettingsRegistry._value('vector_corrections/displacement_grid_resolution', 10.0, float)
+
+    @staticmethod
+    def set_displacement_grid_resolution(resolution: float):
+        """
+        Sets the displacement grid resolution, in map units of the area of interest
+        """
+        SettingsRegistry._set_value('vector_corrections/displacement_grid_resolution', resolution)
+
+    @staticmethod
+    def displacement_grid_tolerance() -> float:
+        """
+        Returns the maximum allowed displacement grid interpolation error, in map units of the area of interest.
+
+        A value of 0 indicates that the grid resolution should not be refined.
+        """
+        return SettingsRegistry._value('vector_corrections/displacement_grid_tolerance', 0.01, float)
+
+    @staticmethod
+    def set_displacement_grid_tolerance(tolerance: float):
+        """
+        Sets the maximum allowed displacement grid interpolation error, in map units of the area of interest.
+
+        A value of 0 indicates that the grid resolution should not be refined.
+        """
+        SettingsRegistry._set_value('vector_corrections/displacement_grid_tolerance', tolerance)
+
+    @staticmethod
+    def displacement_grid_interpolation() -> int:
+        """
+        Returns the displacement grid interpolation method, as a DisplacementGrid interpolation constant
+        """
+        return SettingsRegistry._value('vector_corrections/displacement_grid_interpolation', 0, int)
+
+    @staticmethod
+    def set_displacement_grid_interpolation(interpolation: int):
+        """
+        Sets the displacement grid interpolation method, as a DisplacementGrid interpolation constant
+        """
+        SettingsRegistry._set_value('vector_corrections/displacement_grid_interpolation', interpolation)
+
+    @staticmethod
+    def write_to_provider() -> bool:
+        """
+        Returns True if corrected geometries should be written directly to the layer's data provider,
+        bypassing the layer's edit buffer
+        """
+        return SettingsRegistry._value('vector_corrections/write_to_provider', False, bool)
+
+    @staticmethod
+    def set_write_to_provider(write: bool):
+        """
+        Sets whether corrected geometries should be written directly to the layer's data provider,
+        bypassing the layer's edit buffer
+        """
+        SettingsRegistry._set_value('vector_corrections/write_to_provider', write)
+
+    @staticmethod
+    def provider_batch_size() -> int:
+        """
+        Returns the number of features to correct and write at once when writing directly to data providers
+        """
+        return SettingsRegistry._value('vector_corrections/provider_batch_size', 1000, int)
+
+    @staticmethod
+    def set_provider_batch_size(size: int):
+        """
+        Sets the number of features to correct and write at once when writing directly to data providers
+        """
+        SettingsRegistry._set_value('vector_corrections/provider_batch_size', size)
+
+    @staticmethod
+    def commit_provider_batches() -> bool:
+        """
+        Returns True if each batch should be committed as it is written when writing directly to data providers.
+
+        If False, all batches are written in a single transaction which is rolled back if any batch fails.
+        """
+        return SettingsRegistry._value('vector_corrections/commit_provider_batches', False, bool)
+
+    @staticmethod
+    def set_commit_provider_batches(commit: bool):
+        """
+        Sets whether each batch should be committed as it is written when writing directly to data providers
+        """
+        SettingsRegistry._set_value('vector_corrections/commit_provider_batches', commit)
+
+    @staticmethod
+    def dry_run() -> bool:
+        """
+        Returns True if corrections should be calculated and validated without saving any changes
+        """
+        return SettingsRegistry._value('vector_corrections/dry_run', False, bool)
+
+    @staticmethod
+    def set_dry_run(dry_run: bool):
+        """
+        Sets whether corrections should be calculated and validated without saving any changes
+        """
+        SettingsRegistry._set_value('vector_corrections/dry_run', dry_run)
+
+    @staticmethod
+    def shared_vertex_tolerance() -> float:
+        """
+        Returns the tolerance for treating vertices as shared, in GCP (working) CRS units.
+
+        Shared vertices are only corrected once and always moved to the same position. A value of 0
+        indicates that only identical vertices are shared.
+        """
+        return SettingsRegistry._value('vector_corrections/shared_vertex_tolerance', 0.0, float)
+
+    @staticmethod
+    def set_shared_vertex_tolerance(tolerance: float):
+        """
+        Sets the tolerance for treating vertices as shared, in GCP (working) CRS units.
+
+        A value of 0 indicates that only identical vertices are shared.
+        """
+        SettingsRegistry._set_value('vector_corrections/shared_vertex_tolerance', tolerance)
+
+    @staticmethod
+    def densify() -> bool:
+        """
+        Returns True if straight segments should be adaptively densified before correction
+        """
+        return SettingsRegistry._value('vector_corrections/densify', False, bool)
+
+    @staticmethod
+    def set_densify(densify: bool):
+        """
+        Sets whether straight segments should be adaptively densified before correction
+        """
+        SettingsRegistry._set_value('vector_corrections/densify', densify)
+
+    @staticmethod
+    def densify_tolerance() -> float:
+        """
+        Returns the maximum allowed deviation of corrected segments from the transform, in layer map units
+        """
+        return SettingsRegistry._value('vector_corrections/densify_tolerance', 0.1, float)
+
+    @staticmethod
+    def set_densify_tolerance(tolerance: float):
+        """
+        Sets the maximum allowed deviation of corrected segments from the transform, in layer map units
+        """
+        SettingsRegistry._set_value('vector_corrections/densify_tolerance', tolerance)
+
+    @staticmethod
+    def profiling_enabled() -> bool:
+        """
+        Returns True if timings and counters should be collected for correction runs
+        """
+        return SettingsRegistry._value('vector_corrections/profiling_enabled', False, bool)
+
+    @staticmethod
+    def set_profiling_enabled(enabled: bool):
+        """
+        Sets whether timings and counters should be collected for correction runs
+        """
+        SettingsRegistry._set_value('vector_corrections/profiling_enabled', enabled)
+
+    @staticmethod
+    def robust_fitting() -> bool:
+        """
+        Returns True if outlying GCPs should be automatically excluded when fitting transforms
+        """
+        return SettingsRegistry._value('vector_corrections/robust_fitting', False, bool)
+
+    @staticmethod
+    def set_robust_fitting(robust: bool):
+        """
+        Sets whether outlying GCPs should be automatically excluded when fitting transforms
+        """
+        SettingsRegistry._set_value('vector_corrections/robust_fitting', robust)
+
+    @staticmethod
+    def outlier_threshold() -> float:
+        """
+        Returns the threshold for flagging GCPs as outliers, as a multiple of the robust residual standard deviation
+        """
+        return SettingsRegistry._value('vector_corrections/outlier_threshold', 3.0, float)
+
+    @staticmethod
+    def set_outlier_threshold(threshold: float):
+        """
+        Sets the threshold for flagging GCPs as outliers, as a multiple of the robust residual standard deviation
+        """
+        SettingsRegistry._set_value('vector_corrections/outlier_threshold', threshold)
+
+    @staticmethod
+    def correction_tile_size() -> float:
+        """
+        Returns the size of tiles to split the area of interest into when applying corrections, in area
+        of interest CRS units. A size of 0 disables tiling.
+        """
+        return SettingsRegistry._value('vector_corrections/correction_tile_size', 0.0, float)
+
+    @staticmethod
+    def set_correction_tile_size(size: float):
+        """
+        Sets the size of tiles to split the area of interest into when applying corrections, in area
+        of interest CRS units. A size of 0 disables tiling.
+        """
+        SettingsRegistry._set_value('vector_corrections/correction_tile_size', size)
+
 
 SETTINGS_REGISTRY = SettingsRegistry()
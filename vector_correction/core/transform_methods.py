@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""Transform methods
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+from collections import defaultdict
+from typing import (
+    List,
+    Optional,
+    Tuple,
+    Union
+)
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.analysis import (
+    QgsGcpTransformerInterface
+)
+from qgis.core import (
+    QgsPointXY,
+    QgsGeometry,
+    QgsRectangle
+)
+
+from vector_correction.core.local_thin_plate_spline import LocalThinPlateSpline
+from vector_correction.core.piecewise_affine import PiecewiseAffine
+
+
+class PluginGcpTransformer:
+    """
+    Base class for GCP transformers implemented by the plugin.
+
+    The interface mirrors QgsGcpTransformerInterface, so that plugin transformers can be used
+    interchangeably with the native QGIS transformers.
+    """
+
+    def minimumGcpCount(self) -> int:  # pylint: disable=missing-function-docstring
+        raise NotImplementedError
+
+    def updateParametersFromGcps(self,  # pylint: disable=missing-function-docstring
+                                 source_coordinates: List[QgsPointXY],
+                                 destination_coordinates: List[QgsPointXY],
+                                 invert_y_axis: bool = False) -> bool:
+        raise NotImplementedError
+
+    def transform(self,  # pylint: disable=missing-function-docstring
+                  x: float, y: float, inverse: bool = False) -> Tuple[bool, float, float]:
+        raise NotImplementedError
+
+    def method(self) -> int:  # pylint: disable=missing-function-docstring
+        raise NotImplementedError
+
+    @staticmethod
+    def method_name() -> str:
+        """
+        Returns the translated, user-friendly name for the transform method
+        """
+        raise NotImplementedError
+
+    def is_local(self) -> bool:
+        """
+        Returns True if each GCP only influences the transform near it, so that the effects of changes to the
+        GCPs can be limited to a region (see changed_region())
+        """
+        return False
+
+    def changed_region(self, previous: 'PluginGcpTransformer') -> Optional[QgsRectangle]:  # pylint: disable=unused-argument
+        """
+        Returns the region (in source coordinates) in which the results of this transformer may differ from
+        those of a previously fitted transformer.
+
+        Returns None if the results may differ anywhere. An empty rectangle is returned if the two
+        transformers give identical results.
+        """
+        return None
+
+    def influence_regions(self) -> Optional[List[QgsRectangle]]:
+        """
+        Returns the regions (in source coordinates) outside of which this transformer leaves points unchanged.
+
+        Returns None if points may be changed anywhere.
+        """
+        return None
+
+
+class LocalThinPlateSplineTransformer(PluginGcpTransformer):
+    """
+    A thin plate spline approximation which scales to large numbers of GCPs.
+
+    See LocalThinPlateSpline for details.
+    """
+
+    def __init__(self):
+        self.forward = None
+        self.inverse = None
+        self.source = []
+        self.destination = []
+
+    def minimumGcpCount(self) -> int:  # pylint: disable=missing-function-docstring
+        return 1
+
+    def updateParametersFromGcps(self,  # pylint: disable=missing-function-docstring
+                                 source_coordinates: List[QgsPointXY],
+                                 destination_coordinates: List[QgsPointXY],
+                                 invert_y_axis: bool = False) -> bool:
+        if invert_y_axis or len(source_coordinates) < self.minimumGcpCount() or \
+                len(source_coordinates) != len(destination_coordinates):
+            return False
+
+        self.source = [(p.x(), p.y()) for p in source_coordinates]
+        self.destination = [(p.x(), p.y()) for p in destination_coordinates]
+        self.forward = LocalThinPlateSpline(self.source, self.destination)
+        # the inverse is rarely required, so it is only built on demand
+        self.inverse = None
+        return True
+
+    def transform(self,  # pylint: disable=missing-function-docstring
+                  x: float, y: float, inverse: bool = False) -> Tuple[bool, float, float]:
+        if self.forward is None:
+            return False, x, y
+
+        if inverse:
+            if self.inverse is None:
+                self.inverse = LocalThinPlateSpline(self.destination, self.source)
+            res = self.inverse.transform(x, y)
+        else:
+            res = self.forward.transform(x, y)
+
+        if res is None:
+            return False, x, y
+
+        return True, res[0], res[1]
+
+    def method(self) -> int:  # pylint: disable=missing-function-docstring
+        return TransformMethods.LOCAL_THIN_PLATE_SPLINE
+
+    def is_local(self) -> bool:  # pylint: disable=missing-function-docstring
+        return True
+
+    def changed_region(self, previous: PluginGcpTransformer) -> Optional[QgsRectangle]:  # pylint: disable=missing-function-docstring
+        if not isinstance(previous, LocalThinPlateSplineTransformer) or self.forward is None or \
+                previous.forward is None:
+            return None
+
+        nodes = self.forward.changed_nodes(previous.forward)
+        if nodes is None:
+            return None
+        if not nodes:
+            return QgsRectangle()
+
+        bounds = self.forward.node_bounds(nodes)
+        if bounds is None:
+            return None
+
+        return QgsRectangle(*bounds)
+
+    def influence_regions(self) -> Optional[List[QgsRectangle]]:  # pylint: disable=missing-function-docstring
+        if self.forward is None:
+            return None
+
+        res = []
+        for node in self.forward.displaced_nodes():
+            bounds = self.forward.node_bounds({node})
+            if bounds is None:
+                return None
+            res.append(QgsRectangle(*bounds))
+
+        return res
+
+    @staticmethod
+    def method_name() -> str:  # pylint: disable=missing-function-docstring
+        return TransformMethods.tr('Thin Plate Spline (Local, for large GCP sets)')
+
+
+class PiecewiseAffineTransformer(PluginGcpTransformer):
+    """
+    A piecewise affine ("rubber sheeting") transform over a Delaunay triangulation of the GCPs.
+
+    Each vertex is transformed by the affine transform of the triangle containing it, so every
+    GCP only influences the triangles which share it. See PiecewiseAffine for details.
+    """
+
+    def __init__(self):
+        self.forward = None
+        self.inverse = None
+        self.source = []
+        self.destination = []
+        self.triangles = []
+
+    def minimumGcpCount(self) -> int:  # pylint: disable=missing-function-docstring
+        return 3
+
+    @staticmethod
+    def triangulate(points: List[Tuple[float, float]]) -> List[Tuple[int, int, int]]:
+        """
+        Calculates the Delaunay triangulation of a list of points, returning triangles as
+        triplets of point indices
+        """
+        indices = {}
+        for index, point in enumerate(points):
+            indices.setdefault(point, index)
+
+        triangulation = QgsGeometry.fromMultiPointXY(
+            [QgsPointXY(x, y) for x, y in indices]
+        ).delaunayTriangulation()
+
+        triangles = []
+        if triangulation.isNull():
+            return triangles
+
+        for part in triangulation.constParts():
+            ring = part.exteriorRing()
+            try:
+                triangles.append(tuple(indices[(ring.xAt(i), ring.yAt(i))] for i in range(3)))
+            except KeyError:
+                # vertex not present in the input, can only happen for degenerate inputs
+                continue
+
+        return triangles
+
+    def updateParametersFromGcps(self,  # pylint: disable=missing-function-docstring
+                                 source_coordinates: List[QgsPointXY],
+                                 destination_coordinates: List[QgsPointXY],
+                                 invert_y_axis: bool = False) -> bool:
+        if invert_y_axis or len(source_coordinates) < self.minimumGcpCount() or \
+                len(source_coordinates) != len(destination_coordinates):
+            return False
+
+        self.source = [(p.x(), p.y()) for p in source_coordinates]
+        self.destination = [(p.x(), p.y()) for p in destination_coordinates]
+        self.triangles = self.triangulate(self.source)
+        self.forward = PiecewiseAffine(self.source, self.destination, self.triangles)
+        self.inverse = None
+        if not self.forward:
+            self.forward = None
+            return False
+
+        return True
+
+    def transform(self,  # pylint: disable=missing-function-docstring
+                  x: float, y: float, inverse: bool = False) -> Tuple[bool, float, float]:
+        if self.forward is None:
+            return False, x, y
+
+        if inverse:
+            if self.inverse is None:
+                # the source triangulation is reused, which keeps the inverse consistent with the forward transform
+                self.inverse = PiecewiseAffine(self.destination, self.source, self.triangles)
+            res = self.inverse.transform(x, y)
+        else:
+            res = self.forward.transform(x, y)
+
+        if res is None:
+            return False, x, y
+
+        return True, res[0], res[1]
+
+    def method(self) -> int:  # pylint: disable=missing-function-docstring
+        return TransformMethods.PIECEWISE_AFFINE
+
+    def is_local(self) -> bool:  # pylint: disable=missing-function-docstring
+        return True
+
+    def _triangle_keys(self) -> dict:
+        """
+        Returns the triangles of the fitted transform, keyed by the source and destination coordinates of
+        their vertices, with values indicating whether each triangle lies on the edge of the triangulation
+        """
+        edge_counts = defaultdict(int)
+        for triangle in self.forward.triangles:
+            a, b, c = (self.source[v] for v in triangle.vertices)
+            for edge in ((a, b), (b, c), (c, a)):
+                edge_counts[frozenset(edge)] += 1
+
+        res = {}
+        for triangle in self.forward.triangles:
+            a, b, c = (self.source[v] for v in triangle.vertices)
+            key = tuple(sorted((self.source[v], self.destination[v]) for v in triangle.vertices))
+            res[key] = any(edge_counts[frozenset(edge)] == 1 for edge in ((a, b), (b, c), (c, a)))
+
+        return res
+
+    def changed_region(self, previous: PluginGcpTransformer) -> Optional[QgsRectangle]:  # pylint: disable=missing-function-docstring
+        if not isinstance(previous, PiecewiseAffineTransformer) or self.forward is None or \
+                previous.forward is None:
+            return None
+
+        current_triangles = self._triangle_keys()
+        previous_triangles = previous._triangle_keys()  # pylint: disable=protected-access
+
+        region = QgsRectangle()
+        for triangles, others in ((current_triangles, previous_triangles),
+                                  (previous_triangles, current_triangles)):
+            for key, on_edge in triangles.items():
+                if key in others:
+                    continue
+
+                if on_edge:
+                    # points outside the triangulation are extrapolated from the nearest edge triangles
+                    return None
+
+                xs = [source[0] for source, _ in key]
+                ys = [source[1] for source, _ in key]
+                triangle_bounds = QgsRectangle(min(xs), min(ys), max(xs), max(ys))
+                if region.isEmpty():
+                    region = triangle_bounds
+                else:
+                    region.combineExtentWith(triangle_bounds)
+
+        return region
+
+    def influence_regions(self) -> Optional[List[QgsRectangle]]:  # pylint: disable=missing-function-docstring
+        if self.forward is None:
+            return None
+
+        res = []
+        for key, on_edge in self._triangle_keys().items():
+            if all(source == destination for source, destination in key):
+                # the affine transform for a triangle without displacement is the identity
+                continue
+
+            if on_edge:
+                # points outside the triangulation are extrapolated from the nearest edge triangles
+                return None
+
+            xs = [source[0] for source, _ in key]
+            ys = [source[1] for source, _ in key]
+            res.append(QgsRectangle(min(xs), min(ys), max(xs), max(ys)))
+
+        return res
+
+    @staticmethod
+    def method_name() -> str:  # pylint: disable=missing-function-docstring
+        return TransformMethods.tr('Piecewise Affine (Rubber Sheeting)')
+
+
+class TransformMethods:
+    """
+    Registry of the available transform methods, combining the native QGIS GCP transformers
+    with the methods implemented by the plugin.
+
+    Plugin methods use integer values outside of the range used by QgsGcpTransformerInterface.TransformMethod.
+    """
+
+    LOCAL_THIN_PLATE_SPLINE = 1000
+    PIECEWISE_AFFINE = 1001
+
+    NATIVE_METHODS = [QgsGcpTransformerInterface.TransformMethod.Linear,
+                      QgsGcpTransformerInterface.TransformMethod.Helmert,
+                      QgsGcpTransformerInterface.TransformMethod.PolynomialOrder1,
+                      QgsGcpTransformerInterface.TransformMethod.PolynomialOrder2,
+                      QgsGcpTransformerInterface.TransformMethod.PolynomialOrder3,
+                      QgsGcpTransformerInterface.TransformMethod.ThinPlateSpline,
+                      QgsGcpTransformerInterface.TransformMethod.Projective
+                      ]
+
+    PLUGIN_METHODS = {
+        LOCAL_THIN_PLATE_SPLINE: LocalThinPlateSplineTransformer,
+        PIECEWISE_AFFINE: PiecewiseAffineTransformer
+    }
+
+    @staticmethod
+    def tr(message: str) -> str:
+        """
+        Get the translation for a string using Qt translation API
+        """
+        # noinspection PyTypeChecker,PyArgumentList,PyCallByClass
+        return QCoreApplication.translate('TransformMethods', message)
+
+    @staticmethod
+    def available_methods() -> List[Union[QgsGcpTransformerInterface.TransformMethod, int]]:
+        """
+        Returns a list of all available transform methods
+        """
+        return TransformMethods.NATIVE_METHODS + list(TransformMethods.PLUGIN_METHODS.keys())
+
+    @staticmethod
+    def from_int(value: int) -> Union[QgsGcpTransformerInterface.TransformMethod, int]:
+        """
+        Converts a stored integer value to a transform method
+        """
+        if value in TransformMethods.PLUGIN_METHODS:
+            return value
+
+        return QgsGcpTransformerInterface.TransformMethod(value)
+
+    @staticmethod
+    def method_to_string(method: Union[QgsGcpTransformerInterface.TransformMethod, int]) -> str:
+        """
+        Returns a translated string for a transform method
+        """
+        plugin_class = TransformMethods.PLUGIN_METHODS.get(int(method))
+        if plugin_class is not None:
+            return plugin_class.method_name()
+
+        return QgsGcpTransformerInterface.methodToString(method)
+
+    @staticmethod
+    def create(method: Union[QgsGcpTransformerInterface.TransformMethod, int]):
+        """
+        Creates a new, unfitted, GCP transformer for the specified method
+        """
+        plugin_class = TransformMethods.PLUGIN_METHODS.get(int(method))
+        if plugin_class is not None:
+            return plugin_class()
+
+        return QgsGcpTransformerInterface.create(method)
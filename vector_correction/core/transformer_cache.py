@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Fitted transformer cache
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+from collections import OrderedDict
+from typing import Hashable
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem
+)
+
+
+class FittedTransformerCache:
+    """
+    A least-recently-used cache of fitted GCP transformers.
+
+    Fitting a transformer can be very expensive (e.g. Thin Plate Splines on thousands of GCPs), so
+    transformers are cached against a key describing the GCP set, destination CRS and transform method.
+    Cached transformers are shared, so callers must not modify them.
+    """
+
+    DEFAULT_MAX_SIZE = 8
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @staticmethod
+    def crs_key(crs: QgsCoordinateReferenceSystem) -> str:
+        """
+        Returns a string uniquely identifying a CRS, for use in cache keys
+        """
+        return crs.authid() or crs.toWkt()
+
+    def get(self, key: Hashable):
+        """
+        Returns the cached transformer matching a key, or None if no matching transformer is cached
+        """
+        transformer = self._cache.get(key)
+        if transformer is not None:
+            self._cache.move_to_end(key)
+        return transformer
+
+    def insert(self, key: Hashable, transformer):
+        """
+        Inserts a fitted transformer into the cache, evicting the least recently used
+        transformer if the cache is full
+        """
+        self._cache[key] = transformer
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        """
+        Clears all cached transformers
+        """
+        self._cache.clear()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Vertex cache
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+from typing import (
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple
+)
+
+
+class VertexCache:
+    """
+    A memo of corrected vertex positions, keyed by the original vertex coordinates.
+
+    Adjacent polygons and connected lines share identical vertices, so caching the result for each
+    unique vertex avoids reprojecting and transforming the same position repeatedly. It also
+    guarantees that shared vertices remain coincident after correction.
+
+    If a tolerance is set, a vertex which is within the tolerance of a transformed vertex from another
+    feature is moved to exactly the same corrected position (see nearby()). Vertices are never matched
+    to vertices which belong to the same feature, and each cached vertex is matched by at most one vertex
+    of a feature, so distinct vertices of a feature are never collapsed together.
+
+    A vertex cache is only valid for a single transformer, extent and vertex CRS, so should be
+    scoped to a single correction run.
+    """
+
+    # result for vertices which are left unchanged (e.g. because they are outside the correction extent)
+    UNCHANGED = (True, None, None)
+    # result for vertices which could not be transformed
+    FAILED = (False, None, None)
+
+    DEFAULT_MAX_SIZE = 2000000
+
+    def __init__(self, tolerance: float = 0, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        Constructor for VertexCache.
+
+        :param tolerance: tolerance for matching vertices of different features, or 0 to match only
+            identical vertices
+        :param max_size: maximum number of vertices to cache. If exceeded the cache is cleared, which
+            bounds memory use for very large runs.
+        """
+        self.tolerance = tolerance
+        self.max_size = max_size
+        self._cache = {}
+        # transformed vertices for tolerance matching, as (x, y, feature, result) tuples in grid cells of the
+        # tolerance size
+        self._cells: Dict[Tuple[int, int], List[tuple]] = {}
+        self._feature = 0
+        self._feature_vertices = set()
+        # maps the cached vertices matched by the current feature to the vertex which matched them
+        self._feature_matches: Dict[Tuple[float, float], Tuple[float, float]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.snapped = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @staticmethod
+    def key(x: float, y: float) -> Hashable:
+        """
+        Returns the cache key for a vertex
+        """
+        return x, y
+
+    def begin_feature(self, vertices: Iterable[Tuple[float, float]] = ()):
+        """
+        Must be called before the vertices of each feature are transformed.
+
+        :param vertices: the (x, y) coordinates of the feature's vertices, which are never matched to other
+            vertices of the feature. Only consumed if a tolerance is set.
+        """
+        self._feature += 1
+        self._feature_vertices = set(vertices) if self.tolerance > 0 else set()
+        self._feature_matches = {}
+
+    def get(self, key: Hashable) -> Optional[Tuple[bool, Optional[float], Optional[float]]]:
+        """
+        Returns the cached (ok, x, y) result for a key, or None if the key is not cached
+        """
+        res = self._cache.get(key)
+        if res is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return res
+
+    def nearby(self, x: float, y: float) -> Optional[Tuple[bool, Optional[float], Optional[float]]]:
+        """
+        Returns the cached result of the closest transformed vertex from another feature which is within
+        the tolerance of a vertex, or None if there is no such vertex.
+
+        The cached result is only valid if the vertex would itself be transformed, i.e. it is inside
+        the correction extent, which must be checked by the caller.
+        """
+        if self.tolerance <= 0:
+            return None
+
+        column = math.floor(x / self.tolerance)
+        row = math.floor(y / self.tolerance)
+        closest = None
+        closest_distance = self.tolerance * self.tolerance
+        for cell_column in (column - 1, column, column + 1):
+            for cell_row in (row - 1, row, row + 1):
+                for entry_x, entry_y, feature, result in self._cells.get((cell_column, cell_row), ()):
+                    if feature == self._feature or (entry_x, entry_y) in self._feature_vertices:
+                        continue
+                    distance = (entry_x - x) ** 2 + (entry_y - y) ** 2
+                    if distance > closest_distance:
+                        continue
+                    if self._feature_matches.get((entry_x, entry_y), (x, y)) != (x, y):
+                        # already matched by another vertex of this feature
+                        continue
+                    closest = (entry_x, entry_y, result)
+                    closest_distance = distance
+
+        if closest is None:
+            return None
+
+        self._feature_matches[(closest[0], closest[1])] = (x, y)
+        self.snapped += 1
+        return closest[2]
+
+    def insert(self, key: Hashable, result: Tuple[bool, Optional[float], Optional[float]], shared: bool = True):
+        """
+        Inserts the (ok, x, y) result for a key.
+
+        :param key: vertex key, as returned by key()
+        :param result: (ok, x, y) result for the vertex
+        :param shared: if False the result is not matched to nearby vertices, e.g. because it was itself
+            taken from a nearby vertex
+        """
+        if len(self._cache) >= self.max_size:
+            self._cache.clear()
+            self._cells.clear()
+        self._cache[key] = result
+
+        if shared and self.tolerance > 0 and result[1] is not None:
+            x, y = key
+            cell = (math.floor(x / self.tolerance), math.floor(y / self.tolerance))
+            self._cells.setdefault(cell, []).append((x, y, self._feature, result))
+
+    def clear(self):
+        """
+        Clears all cached vertices
+        """
+        self._cache.clear()
+        self._cells.clear()
+        self._feature_vertices = set()
+        self._feature_matches = {}
+        self.hits = 0
+        self.misses = 0
+        self.snapped = 0
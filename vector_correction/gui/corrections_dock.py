@@ -13,19 +13,24 @@ __copyright__ = 'Copyright 2018, North Road'
 # This will get replaced with a git SHA1 when you do a git archive
 __revision__ = '$Format:%H$'
 
+from typing import (
+    List,
+    Optional
+)
+
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import (
     pyqtSignal,
-    QDir
+    QDir,
+    QItemSelection,
+    QItemSelectionModel
 )
 from qgis.PyQt.QtWidgets import (
     QWidget,
     QVBoxLayout,
     QAction,
-    QFileDialog
-)
-from qgis.analysis import (
-    QgsGcpTransformerInterface
+    QFileDialog,
+    QMessageBox
 )
 from qgis.core import (
     QgsSymbol,
@@ -34,7 +39,8 @@ from qgis.core import (
     QgsVectorLayer,
     QgsProject,
     QgsFileUtils,
-    QgsApplication
+    QgsApplication,
+    QgsReferencedRectangle
 )
 from qgis.gui import (
     QgsPanelWidget,
@@ -42,8 +48,15 @@ from qgis.gui import (
     QgsPanelWidgetStack
 )
 
-from vector_correction.core.gcp_manager import GcpManager
+from vector_correction.core.displacement_grid import DisplacementGrid
+from vector_correction.core.gcp_importer import GcpImportException
+from vector_correction.core.gcp_manager import (
+    GcpManager,
+    NotEnoughGcpsException,
+    TransformCreationException
+)
 from vector_correction.core.settings_registry import SettingsRegistry
+from vector_correction.core.transform_methods import TransformMethods
 from vector_correction.gui.gui_utils import GuiUtils
 
 WIDGET, _ = uic.loadUiType(GuiUtils.get_ui_file_path('point_list.ui'))
@@ -84,6 +97,12 @@ class PointListWidget(QgsPanelWidget, WIDGET):
         self.load_action.triggered.connect(self._load)
         self.toolbar.addAction(self.load_action)
 
+        self.import_action = QAction(self.tr('Import'), self)
+        self.import_action.setToolTip(self.tr('Imports GCPs from a line layer or point pair table'))
+        self.import_action.setIcon(QgsApplication.getThemeIcon('mActionAddOgrLayer.svg'))
+        self.import_action.triggered.connect(self._import)
+        self.toolbar.addAction(self.import_action)
+
         self.export_action = QAction(self.tr('Export'), self)
         self.export_action.setToolTip(self.tr('Exports correction vectors to a line layer'))
         self.export_action.setIcon(QgsApplication.getThemeIcon('mIconLineLayer.svg'))
@@ -92,15 +111,38 @@ class PointListWidget(QgsPanelWidget, WIDGET):
 
         self.toolbar.addSeparator()
 
+        self._create_grid_actions()
+
+        self.toolbar.addSeparator()
+
         self.settings_action = QAction(self.tr('Settings'), self)
         self.settings_action.setIcon(QgsApplication.getThemeIcon('/propertyicons/settings.svg'))
         self.settings_action.triggered.connect(self._show_settings)
         self.toolbar.addAction(self.settings_action)
 
         self.settings_panel = None
+        self.aoi: Optional[QgsReferencedRectangle] = None
 
         self.table_view.selectionModel().selectionChanged.connect(self._selection_changed)
 
+    def _create_grid_actions(self):
+        """
+        Creates the actions for exporting and applying displacement grids
+        """
+        self.export_grid_action = QAction(self.tr('Export Grid'), self)
+        self.export_grid_action.setToolTip(self.tr('Exports the correction within the AOI as a displacement grid'))
+        self.export_grid_action.setIcon(QgsApplication.getThemeIcon('mIconRaster.svg'))
+        self.export_grid_action.triggered.connect(self._export_grid)
+        self.toolbar.addAction(self.export_grid_action)
+        self.export_grid_action.setEnabled(False)
+
+        self.load_grid_action = QAction(self.tr('Apply Grid'), self)
+        self.load_grid_action.setToolTip(self.tr('Applies corrections from a displacement grid file instead of the GCPs'))
+        self.load_grid_action.setIcon(QgsApplication.getThemeIcon('mActionAddRasterLayer.svg'))
+        self.load_grid_action.setCheckable(True)
+        self.load_grid_action.triggered.connect(self._load_grid)
+        self.toolbar.addAction(self.load_grid_action)
+
     def _show_settings(self):
         """
         Shows the settings panel
@@ -124,6 +166,20 @@ class PointListWidget(QgsPanelWidget, WIDGET):
         """
         self.delete_rows_action.setEnabled(bool(self.table_view.selectionModel().selectedIndexes()))
 
+    def select_rows(self, rows: List[int], add: bool = False):
+        """
+        Selects rows in the table, optionally adding them to the existing selection
+        """
+        selection = QItemSelection()
+        last_column = self.gcp_manager.columnCount() - 1
+        for row in rows:
+            selection.select(self.gcp_manager.index(row, 0), self.gcp_manager.index(row, last_column))
+
+        flags = QItemSelectionModel.Select if add else QItemSelectionModel.ClearAndSelect
+        self.table_view.selectionModel().select(selection, flags | QItemSelectionModel.Rows)
+        if rows:
+            self.table_view.scrollTo(self.gcp_manager.index(rows[0], 0))
+
     def _delete_selected(self):
         """
         Deletes selected rows from the table
@@ -158,6 +214,46 @@ class PointListWidget(QgsPanelWidget, WIDGET):
             vl = QgsVectorLayer(source, self.tr('Corrections'))
             QgsProject.instance().addMapLayer(vl)
 
+    def set_aoi(self, aoi: QgsReferencedRectangle):
+        """
+        Sets the current area of interest, which displacement grids are exported for
+        """
+        self.aoi = aoi
+        self.export_grid_action.setEnabled(True)
+
+    def _export_grid(self):
+        """
+        Exports the correction within the AOI to a displacement grid file
+        """
+        dest, _ = QFileDialog.getSaveFileName(self, self.tr('Destination File'), QDir.homePath(),
+                                              self.tr('GeoTIFF files (*.tif)'))
+        if not dest:
+            return
+
+        dest = QgsFileUtils.ensureFileNameHasExtension(dest, ['tif'])
+        try:
+            ok = self.gcp_manager.collection.export_displacement_grid(dest, self.aoi, self.aoi.crs())
+        except (NotEnoughGcpsException, TransformCreationException) as e:
+            QMessageBox.warning(self, self.tr('Export Grid'), str(e))
+            return
+
+        if not ok:
+            QMessageBox.warning(self, self.tr('Export Grid'), self.tr('Could not write {}').format(dest))
+
+    def _load_grid(self, checked: bool):
+        """
+        Loads a displacement grid file to apply instead of the GCPs, or clears the loaded grid
+        """
+        if not checked:
+            self.gcp_manager.collection.clear_displacement_grid()
+            return
+
+        src, _ = QFileDialog.getOpenFileName(self, self.tr('Source File'), QDir.homePath(),
+                                             self.tr('GeoTIFF files (*.tif *.tiff)'))
+        if src and not self.gcp_manager.collection.load_displacement_grid(src):
+            QMessageBox.warning(self, self.tr('Apply Grid'), self.tr('{} is not a valid displacement grid').format(src))
+        self.load_grid_action.setChecked(self.gcp_manager.collection.loaded_grid is not None)
+
     def _save(self):
         """
         Saves GCPs to disk
@@ -181,6 +277,25 @@ class PointListWidget(QgsPanelWidget, WIDGET):
 
         self.gcp_manager.load_from_file(src)
 
+    def _import(self):
+        """
+        Imports GCPs from a vector layer
+        """
+        src, _ = QFileDialog.getOpenFileName(self, self.tr('Source File'), QDir.homePath(),
+                                             QgsProviderRegistry.instance().fileVectorFilters())
+        if not src:
+            return
+
+        layer = QgsVectorLayer(src, 'import')
+        if not layer.isValid():
+            QMessageBox.warning(self, self.tr('Import GCPs'), self.tr('{} is not a valid vector layer').format(src))
+            return
+
+        try:
+            self.gcp_manager.import_from_layer(layer)
+        except GcpImportException as e:
+            QMessageBox.warning(self, self.tr('Import GCPs'), str(e))
+
 
 SETTINGS_WIDGET, _ = uic.loadUiType(GuiUtils.get_ui_file_path('settings.ui'))
 
@@ -202,15 +317,18 @@ class SettingsWidget(QgsPanelWidget, SETTINGS_WIDGET):
 
         self.setPanelTitle(self.tr('Settings'))
 
-        for method in [QgsGcpTransformerInterface.TransformMethod.Linear,
-                       QgsGcpTransformerInterface.TransformMethod.Helmert,
-                       QgsGcpTransformerInterface.TransformMethod.PolynomialOrder1,
-                       QgsGcpTransformerInterface.TransformMethod.PolynomialOrder2,
-                       QgsGcpTransformerInterface.TransformMethod.PolynomialOrder3,
-                       QgsGcpTransformerInterface.TransformMethod.ThinPlateSpline,
-                       QgsGcpTransformerInterface.TransformMethod.Projective
-                       ]:
-            self.combo_method.addItem(QgsGcpTransformerInterface.methodToString(method), int(method))
+        for method in TransformMethods.available_methods():
+            self.combo_method.addItem(TransformMethods.method_to_string(method), int(method))
+
+        self.combo_grid_interpolation.addItem(self.tr('Bilinear'), DisplacementGrid.BILINEAR)
+        self.combo_grid_interpolation.addItem(self.tr('Bicubic'), DisplacementGrid.BICUBIC)
+        self.grid_resolution_spin_box.setClearValue(10)
+        self.grid_tolerance_spin_box.setClearValue(0)
+        self.batch_size_spin_box.setClearValue(1000)
+        self.shared_vertex_tolerance_spin_box.setClearValue(0)
+        self.densify_tolerance_spin_box.setClearValue(0.1)
+        self.outlier_threshold_spin_box.setClearValue(3)
+        self.tile_size_spin_box.setClearValue(0)
 
         self.arrow_style_button.setSymbolType(QgsSymbol.Line)
         self.extent_style_button.setSymbolType(QgsSymbol.Fill)
@@ -219,6 +337,21 @@ class SettingsWidget(QgsPanelWidget, SETTINGS_WIDGET):
         self.arrow_style_button.changed.connect(self._symbol_changed)
         self.extent_style_button.changed.connect(self._extent_symbol_changed)
         self.combo_method.currentIndexChanged[int].connect(self._method_changed)
+        self.use_grid_check_box.toggled.connect(self._grid_settings_changed)
+        self.grid_resolution_spin_box.valueChanged.connect(self._grid_settings_changed)
+        self.grid_tolerance_spin_box.valueChanged.connect(self._grid_settings_changed)
+        self.combo_grid_interpolation.currentIndexChanged[int].connect(self._grid_settings_changed)
+        self.write_to_provider_check_box.toggled.connect(self._write_settings_changed)
+        self.batch_size_spin_box.valueChanged.connect(self._write_settings_changed)
+        self.commit_batches_check_box.toggled.connect(self._write_settings_changed)
+        self.dry_run_check_box.toggled.connect(self._write_settings_changed)
+        self.shared_vertex_tolerance_spin_box.valueChanged.connect(self._shared_vertex_tolerance_changed)
+        self.densify_check_box.toggled.connect(self._densify_settings_changed)
+        self.densify_tolerance_spin_box.valueChanged.connect(self._densify_settings_changed)
+        self.profiling_check_box.toggled.connect(self._profiling_changed)
+        self.robust_fitting_check_box.toggled.connect(self._robust_fitting_changed)
+        self.outlier_threshold_spin_box.valueChanged.connect(self._robust_fitting_changed)
+        self.tile_size_spin_box.valueChanged.connect(self._tile_size_changed)
 
         self.preview_color_button.setAllowOpacity(True)
         self.preview_color_button.setColor(SettingsRegistry.preview_color())
@@ -228,12 +361,33 @@ class SettingsWidget(QgsPanelWidget, SETTINGS_WIDGET):
         """
         Restores saved settings
         """
+        # settings may have been changed outside of the plugin since they were last read
+        SettingsRegistry.invalidate_cache()
+
         current_method = SettingsRegistry.transform_method()
         self.combo_method.setCurrentIndex(self.combo_method.findData(int(current_method)))
 
         self.arrow_style_button.setSymbol(SettingsRegistry.arrow_symbol())
         self.extent_style_button.setSymbol(SettingsRegistry.extent_symbol())
 
+        self.use_grid_check_box.setChecked(SettingsRegistry.use_displacement_grid())
+        self.grid_resolution_spin_box.setValue(SettingsRegistry.displacement_grid_resolution())
+        self.grid_tolerance_spin_box.setValue(SettingsRegistry.displacement_grid_tolerance())
+        self.combo_grid_interpolation.setCurrentIndex(
+            self.combo_grid_interpolation.findData(SettingsRegistry.displacement_grid_interpolation()))
+
+        self.write_to_provider_check_box.setChecked(SettingsRegistry.write_to_provider())
+        self.batch_size_spin_box.setValue(SettingsRegistry.provider_batch_size())
+        self.commit_batches_check_box.setChecked(SettingsRegistry.commit_provider_batches())
+        self.dry_run_check_box.setChecked(SettingsRegistry.dry_run())
+        self.shared_vertex_tolerance_spin_box.setValue(SettingsRegistry.shared_vertex_tolerance())
+        self.densify_check_box.setChecked(SettingsRegistry.densify())
+        self.densify_tolerance_spin_box.setValue(SettingsRegistry.densify_tolerance())
+        self.profiling_check_box.setChecked(SettingsRegistry.profiling_enabled())
+        self.robust_fitting_check_box.setChecked(SettingsRegistry.robust_fitting())
+        self.outlier_threshold_spin_box.setValue(SettingsRegistry.outlier_threshold())
+        self.tile_size_spin_box.setValue(SettingsRegistry.correction_tile_size())
+
     def _symbol_changed(self):
         """
         Called when the line symbol type is changed
@@ -253,12 +407,61 @@ class SettingsWidget(QgsPanelWidget, SETTINGS_WIDGET):
         Called when the method combobox value is changed
         """
         SettingsRegistry.set_transform_method(
-            QgsGcpTransformerInterface.TransformMethod(
-                int(self.combo_method.currentData())
-            )
+            TransformMethods.from_int(int(self.combo_method.currentData()))
         )
         self.transform_method_changed.emit()
 
+    def _grid_settings_changed(self):
+        """
+        Called when the displacement grid settings are changed
+        """
+        SettingsRegistry.set_use_displacement_grid(self.use_grid_check_box.isChecked())
+        SettingsRegistry.set_displacement_grid_resolution(self.grid_resolution_spin_box.value())
+        SettingsRegistry.set_displacement_grid_tolerance(self.grid_tolerance_spin_box.value())
+        SettingsRegistry.set_displacement_grid_interpolation(self.combo_grid_interpolation.currentData())
+
+    def _write_settings_changed(self):
+        """
+        Called when the settings controlling how corrections are written are changed
+        """
+        SettingsRegistry.set_write_to_provider(self.write_to_provider_check_box.isChecked())
+        SettingsRegistry.set_provider_batch_size(self.batch_size_spin_box.value())
+        SettingsRegistry.set_commit_provider_batches(self.commit_batches_check_box.isChecked())
+        SettingsRegistry.set_dry_run(self.dry_run_check_box.isChecked())
+
+    def _shared_vertex_tolerance_changed(self):
+        """
+        Called when the shared vertex tolerance is changed
+        """
+        SettingsRegistry.set_shared_vertex_tolerance(self.shared_vertex_tolerance_spin_box.value())
+
+    def _densify_settings_changed(self):
+        """
+        Called when the densification settings are changed
+        """
+        SettingsRegistry.set_densify(self.densify_check_box.isChecked())
+        SettingsRegistry.set_densify_tolerance(self.densify_tolerance_spin_box.value())
+
+    def _profiling_changed(self, enabled: bool):
+        """
+        Called when the profiling setting is changed
+        """
+        SettingsRegistry.set_profiling_enabled(enabled)
+
+    def _robust_fitting_changed(self):
+        """
+        Called when the robust fitting settings are changed
+        """
+        SettingsRegistry.set_robust_fitting(self.robust_fitting_check_box.isChecked())
+        SettingsRegistry.set_outlier_threshold(self.outlier_threshold_spin_box.value())
+        self.transform_method_changed.emit()
+
+    def _tile_size_changed(self, size: float):
+        """
+        Called when the correction tile size is changed
+        """
+        SettingsRegistry.set_correction_tile_size(size)
+
     def _preview_color_changed(self):
         """
         Called when the feature preview color is changed
@@ -296,3 +499,15 @@ class CorrectionsDockWidget(QgsDockWidget):
         self.table_widget.setDockMode(True)
         self.stack.setMainPanel(self.table_widget)
         self.table_widget.extent_symbol_changed.connect(self.extent_symbol_changed)
+
+    def select_gcp_rows(self, rows: List[int], add: bool = False):
+        """
+        Selects GCP rows in the table, optionally adding them to the existing selection
+        """
+        self.table_widget.select_rows(rows, add)
+
+    def set_aoi(self, aoi: QgsReferencedRectangle):
+        """
+        Sets the current area of interest
+        """
+        self.table_widget.set_aoi(aoi)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Select GCPs tool
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+from typing import List
+
+from qgis.PyQt.QtCore import (
+    Qt,
+    pyqtSignal
+)
+from qgis.PyQt.QtWidgets import QApplication
+from qgis.core import (
+    QgsGeometry,
+    QgsPointXY,
+    QgsRectangle,
+    QgsWkbTypes
+)
+from qgis.gui import (
+    QgsAbstractMapToolHandler,
+    QgsMapCanvas,
+    QgsMapMouseEvent,
+    QgsMapTool,
+    QgsRubberBand
+)
+
+from vector_correction.core.gcp_manager import GcpManager
+from vector_correction.core.settings_registry import SettingsRegistry
+
+
+class SelectGcpsTool(QgsMapTool):
+    """
+    A map tool for selecting GCPs, either by clicking on the nearest GCP or by dragging a rectangle
+    """
+
+    # emitted with the selected rows, and True if the rows should be added to the current selection
+    gcps_selected = pyqtSignal(list, bool)
+
+    def __init__(self, map_canvas: QgsMapCanvas, gcp_manager: GcpManager):
+        super().__init__(map_canvas)
+        self.gcp_manager = gcp_manager
+        self.start_point = None
+        self.rubber_band = None
+        self.setCursor(Qt.ArrowCursor)
+
+    def _clear_rubber_band(self):
+        """
+        Removes the selection rectangle rubber band
+        """
+        if self.rubber_band is not None:
+            self.canvas().scene().removeItem(self.rubber_band)
+            self.rubber_band = None
+
+    def deactivate(self):  # pylint: disable=missing-function-docstring
+        self._clear_rubber_band()
+        self.start_point = None
+        super().deactivate()
+
+    def canvasPressEvent(self, e: QgsMapMouseEvent):  # pylint: disable=missing-function-docstring
+        if e.button() == Qt.LeftButton:
+            self.start_point = e.pos()
+
+    def canvasMoveEvent(self, e: QgsMapMouseEvent):  # pylint: disable=missing-function-docstring
+        if self.start_point is None:
+            return
+
+        if self.rubber_band is None:
+            if (e.pos() - self.start_point).manhattanLength() < QApplication.startDragDistance():
+                return
+            self.rubber_band = QgsRubberBand(self.canvas(), QgsWkbTypes.PolygonGeometry)
+            self.rubber_band.setSymbol(SettingsRegistry.extent_symbol())
+
+        rect = QgsRectangle(self.toMapCoordinates(self.start_point), e.mapPoint())
+        rect.normalize()
+        self.rubber_band.setToGeometry(QgsGeometry.fromRect(rect), None)
+
+    def canvasReleaseEvent(self, e: QgsMapMouseEvent):  # pylint: disable=missing-function-docstring
+        if e.button() != Qt.LeftButton or self.start_point is None:
+            return
+
+        crs = self.canvas().mapSettings().destinationCrs()
+        add = bool(e.modifiers() & Qt.ShiftModifier)
+        if self.rubber_band is not None:
+            rect = QgsRectangle(self.toMapCoordinates(self.start_point), e.mapPoint())
+            rect.normalize()
+            rows = self.gcp_manager.gcp_rows_in_rect(rect, crs)
+        else:
+            rows = self.pick(e.mapPoint())
+
+        self._clear_rubber_band()
+        self.start_point = None
+        self.gcps_selected.emit(rows, add)
+
+    def pick(self, point: QgsPointXY) -> List[int]:
+        """
+        Returns the row of the GCP closest to a point, if it is within the search radius
+        """
+        crs = self.canvas().mapSettings().destinationCrs()
+        radius = QgsMapTool.searchRadiusMU(self.canvas())
+        search_rect = QgsRectangle(point.x() - radius, point.y() - radius, point.x() + radius, point.y() + radius)
+
+        row = self.gcp_manager.nearest_gcp_row(point, crs)
+        if row < 0 or row not in self.gcp_manager.gcp_rows_in_rect(search_rect, crs):
+            return []
+        return [row]
+
+
+class SelectGcpsToolHandler(QgsAbstractMapToolHandler):
+    """
+    Handler for the select GCPs tool
+    """
+
+    def isCompatibleWithLayer(self, layer, context):  # pylint: disable=unused-argument,missing-function-docstring
+        return True
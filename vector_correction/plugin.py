@@ -14,7 +14,11 @@ __copyright__ = 'Copyright 2021, North Road'
 __revision__ = '$Format:%H$'
 
 import os
-from typing import Optional
+from typing import (
+    Dict,
+    List,
+    Optional
+)
 
 from qgis.PyQt.QtCore import (
     Qt,
@@ -23,28 +27,39 @@ from qgis.PyQt.QtCore import (
 )
 from qgis.PyQt.QtWidgets import (
     QToolBar,
-    QAction
+    QAction,
+    QProgressBar,
+    QPushButton
 )
 from qgis.core import (
+    Qgis,
     QgsApplication,
+    QgsFeedback,
     QgsVectorLayer,
     QgsCoordinateReferenceSystem,
     QgsProject,
     QgsFeature,
     QgsPointXY,
-    QgsFeatureRequest,
-    QgsCoordinateTransform,
     QgsReferencedRectangle
 )
 from qgis.gui import (
-    QgisInterface
+    QgisInterface,
+    QgsMessageBarItem
 )
 
+from vector_correction.core.correction_checkpoint import CorrectionCheckpoint
+from vector_correction.core.correction_history import CorrectionHistory
+from vector_correction.core.gcp_collection import TransformStatistics
 from vector_correction.core.gcp_manager import (
     GcpManager,
     NotEnoughGcpsException,
     TransformCreationException
 )
+from vector_correction.core.layer_corrector import (
+    CorrectionException,
+    LayerCorrector
+)
+from vector_correction.core.settings_registry import SettingsRegistry
 from vector_correction.gui.corrections_dock import CorrectionsDockWidget
 from vector_correction.gui.draw_extent_tool import (
     DrawExtentTool,
@@ -54,6 +69,10 @@ from vector_correction.gui.draw_line_tool import (
     DrawLineTool,
     DrawLineToolHandler
 )
+from vector_correction.gui.select_gcps_tool import (
+    SelectGcpsTool,
+    SelectGcpsToolHandler
+)
 from vector_correction.gui.gui_utils import GuiUtils
 
 VERSION = '0.0.2'
@@ -93,6 +112,9 @@ class VectorCorrectionPlugin:
         self.aoi_tool_handler = None
         self.map_tool = None
         self.map_tool_handler = None
+        self.select_gcps_action = None
+        self.select_gcps_tool = None
+        self.select_gcps_tool_handler = None
         self.temp_layer = None
         self.draw_aoi_action = None
         self.show_aoi_action = None
@@ -103,6 +125,8 @@ class VectorCorrectionPlugin:
 
         self.aoi: Optional[QgsReferencedRectangle] = None
         self.gcp_manager = GcpManager(self.iface.mapCanvas())
+        # histories of the corrections made to each layer, by layer ID
+        self.correction_histories: Dict[str, CorrectionHistory] = {}
 
     @staticmethod
     def tr(message):
@@ -124,10 +148,13 @@ class VectorCorrectionPlugin:
 
     def initGui(self):
         """Creates application GUI widgets"""
+        SettingsRegistry.invalidate_cache()
         self.initProcessing()
 
         self.dock = CorrectionsDockWidget(self.gcp_manager)
 
+        QgsProject.instance().layersWillBeRemoved.connect(self._layers_will_be_removed)
+
         self.iface.addDockWidget(Qt.RightDockWidgetArea, self.dock)
         self.dock.setUserVisible(False)
 
@@ -135,6 +162,29 @@ class VectorCorrectionPlugin:
         self.toolbar.setObjectName('vectorCorrectionToolbar')
         self.iface.addToolBar(self.toolbar)
 
+        self._create_aoi_tools()
+        self._create_correction_tools()
+        self._create_select_tool()
+
+        self.show_gcps_action = QAction(self.tr('Show GCPS'), parent=self.toolbar)
+        self.show_gcps_action.setIcon(GuiUtils.get_icon('gcp_table.svg'))
+        self.toolbar.addAction(self.show_gcps_action)
+        self.actions.append(self.show_gcps_action)
+        self.dock.setToggleVisibilityAction(self.show_gcps_action)
+
+        self.apply_correction_action = QAction(self.tr('Apply Correction'), parent=self.toolbar)
+        self.apply_correction_action.setIcon(GuiUtils.get_icon('apply_corrections.svg'))
+        self.toolbar.addAction(self.apply_correction_action)
+        self.apply_correction_action.triggered.connect(self.apply_correction)
+        self.actions.append(self.apply_correction_action)
+        self.apply_correction_action.setEnabled(False)
+
+        self.dock.extent_symbol_changed.connect(self.aoi_tool.update_fill_symbol)
+
+    def _create_aoi_tools(self):
+        """
+        Creates the actions and map tool for drawing and showing the AOI
+        """
         self.draw_aoi_action = QAction(self.tr('Draw AOI'), parent=self.toolbar)
         self.draw_aoi_action.setIcon(GuiUtils.get_icon('draw_extent.svg'))
         self.toolbar.addAction(self.draw_aoi_action)
@@ -155,24 +205,15 @@ class VectorCorrectionPlugin:
         self.iface.registerMapToolHandler(self.aoi_tool_handler)
         self.aoi_tool.extent_set.connect(self.set_aoi)
 
+    def _create_correction_tools(self):
+        """
+        Creates the action and map tool for digitizing corrections
+        """
         self.draw_correction_action = QAction(self.tr('Draw Correction'), parent=self.toolbar)
         self.draw_correction_action.setIcon(GuiUtils.get_icon('draw_correction.svg'))
         self.toolbar.addAction(self.draw_correction_action)
         self.actions.append(self.draw_correction_action)
 
-        self.show_gcps_action = QAction(self.tr('Show GCPS'), parent=self.toolbar)
-        self.show_gcps_action.setIcon(GuiUtils.get_icon('gcp_table.svg'))
-        self.toolbar.addAction(self.show_gcps_action)
-        self.actions.append(self.show_gcps_action)
-        self.dock.setToggleVisibilityAction(self.show_gcps_action)
-
-        self.apply_correction_action = QAction(self.tr('Apply Correction'), parent=self.toolbar)
-        self.apply_correction_action.setIcon(GuiUtils.get_icon('apply_corrections.svg'))
-        self.toolbar.addAction(self.apply_correction_action)
-        self.apply_correction_action.triggered.connect(self.apply_correction)
-        self.actions.append(self.apply_correction_action)
-        self.apply_correction_action.setEnabled(False)
-
         self.map_tool = DrawLineTool(map_canvas=self.iface.mapCanvas(),
                                      cad_dock_widget=self.iface.cadDockWidget(),
                                      message_bar=self.iface.messageBar())
@@ -189,14 +230,30 @@ class VectorCorrectionPlugin:
 
         self.map_tool.digitizingCompleted.connect(self._correction_added)
 
-        self.dock.extent_symbol_changed.connect(self.aoi_tool.update_fill_symbol)
+    def _create_select_tool(self):
+        """
+        Creates the action and map tool for selecting GCPs from the map
+        """
+        self.select_gcps_action = QAction(self.tr('Select GCPs'), parent=self.toolbar)
+        self.select_gcps_action.setIcon(QgsApplication.getThemeIcon('mActionSelectRectangle.svg'))
+        self.toolbar.addAction(self.select_gcps_action)
+        self.actions.append(self.select_gcps_action)
+
+        self.select_gcps_tool = SelectGcpsTool(map_canvas=self.iface.mapCanvas(), gcp_manager=self.gcp_manager)
+        self.select_gcps_tool_handler = SelectGcpsToolHandler(self.select_gcps_tool, self.select_gcps_action)
+        self.iface.registerMapToolHandler(self.select_gcps_tool_handler)
+        self.select_gcps_tool.gcps_selected.connect(self._gcps_selected)
 
     def unload(self):
         """Removes the plugin menu item and icon from QGIS GUI."""
         self.gcp_manager.clear()
 
+        QgsProject.instance().layersWillBeRemoved.disconnect(self._layers_will_be_removed)
+        self.correction_histories = {}
+
         self.iface.unregisterMapToolHandler(self.aoi_tool_handler)
         self.iface.unregisterMapToolHandler(self.map_tool_handler)
+        self.iface.unregisterMapToolHandler(self.select_gcps_tool_handler)
 
         for a in self.actions:
             a.deleteLater()
@@ -208,6 +265,9 @@ class VectorCorrectionPlugin:
         if self.map_tool is not None:
             self.map_tool.deleteLater()
             self.map_tool = None
+        if self.select_gcps_tool is not None:
+            self.select_gcps_tool.deleteLater()
+            self.select_gcps_tool = None
         if self.temp_layer is not None:
             self.temp_layer.deleteLater()
             self.temp_layer = None
@@ -224,65 +284,163 @@ class VectorCorrectionPlugin:
                                  destination=QgsPointXY(digitize_line.constGet().endPoint()),
                                  crs=self.iface.mapCanvas().mapSettings().destinationCrs())
 
-    def apply_correction(self):
+    def _gcps_selected(self, rows: List[int], add: bool):
         """
-        Applies the defined corrections to visible features in all editable layers
+        Triggered when GCPs are selected on the map
         """
-        for _, layer in QgsProject.instance().mapLayers().items():
-            if isinstance(layer, QgsVectorLayer) and layer.isEditable():
-                if not self.apply_correction_to_layer(layer):
-                    break
+        self.dock.setUserVisible(True)
+        self.dock.select_gcp_rows(rows, add)
 
-    def apply_correction_to_layer(self, target_layer: QgsVectorLayer) -> bool:
+    def apply_correction(self):
+        """
+        Applies the defined corrections to visible features in all target layers.
+
+        When corrections are written directly to data providers the layers selected in the layer tree are
+        corrected (since layers in edit mode cannot be written to directly), otherwise all editable layers
+        are corrected.
+
+        A single corrector is shared by all layers, so the transform is fitted only once for all layers.
+        """
+        if not self.aoi:
+            return
+
+        if SettingsRegistry.write_to_provider():
+            layers = [layer for layer in self.iface.layerTreeView().selectedLayers()
+                      if isinstance(layer, QgsVectorLayer)]
+        else:
+            layers = [layer for layer in QgsProject.instance().mapLayers().values()
+                      if isinstance(layer, QgsVectorLayer) and layer.isEditable()]
+
+        corrector = self._create_corrector()
+        for layer in layers:
+            if not self.apply_correction_to_layer(layer, corrector):
+                break
+
+    def apply_correction_to_layer(self, target_layer: QgsVectorLayer,
+                                  corrector: Optional[LayerCorrector] = None) -> bool:
         """
         Applies the defined corrections to visible features
+
+        :param target_layer: layer to correct
+        :param corrector: optional corrector to use, shared with other layers in the same correction run. If
+            not set a new corrector will be created using the current settings.
         """
         if not self.aoi:
             return False
 
-        layer_crs = target_layer.crs()
-
-        # we need to transform the AOI extent to the layer crs in order to filter features
-        aoi_to_layer_transform = QgsCoordinateTransform(self.aoi.crs(),
-                                                        layer_crs,
-                                                        QgsProject.instance().transformContext())
-        layer_filter_rect = aoi_to_layer_transform.transformBoundingBox(self.aoi)
+        if corrector is None:
+            corrector = self._create_corrector()
 
-        request = QgsFeatureRequest()
-        request.setFilterRect(layer_filter_rect)
-        request.setNoAttributes()
+        corrector.feedback = None
+        if corrector.write_to_provider:
+            self._prepare_provider_correction(target_layer, corrector)
+        else:
+            self._prepare_edit_buffer_correction(target_layer, corrector)
 
-        features = target_layer.getFeatures(request)
-        feature_map = {
-            f.id(): f.geometry()
-            for f in features
-        }
+        progress_message = None
+        if corrector.tile_size > 0 or corrector.write_to_provider:
+            # show progress per tile (or batch) for long running corrections
+            progress_message = self._show_correction_progress(target_layer, corrector)
 
         try:
-            transformed_features = self.gcp_manager.transform_features(
-                features=feature_map,
-                feature_crs=layer_crs,
-                extent=self.aoi,
-                extent_crs=self.aoi.crs())
-        except NotEnoughGcpsException as e:
-            self.iface.messageBar().pushCritical('', str(e))
-            return False
-        except TransformCreationException as e:
+            statistics = corrector.correct_layer(target_layer)
+        except (NotEnoughGcpsException, TransformCreationException, CorrectionException) as e:
             self.iface.messageBar().pushCritical('', str(e))
             return False
+        finally:
+            if progress_message is not None:
+                self.iface.messageBar().popWidget(progress_message)
+                self.apply_correction_action.setEnabled(True)
 
-        if any(g.isNull() for g in transformed_features.values()):
-            self.iface.messageBar().pushCritical('', self.tr('One or more features failed to transform'))
-            return False
+        target_layer.triggerRepaint()
+        corrector.profiler.log(target_layer.name())
+        # report each layer separately
+        corrector.profiler.clear()
 
-        target_layer.beginEditCommand(self.tr('Correct features'))
+        self._report_correction(target_layer, corrector, statistics)
+        return True
 
-        for _id, geometry in transformed_features.items():
-            target_layer.changeGeometry(_id, geometry, True)
+    def _create_corrector(self) -> LayerCorrector:
+        """
+        Creates a corrector for the current area of interest, using the current settings
+        """
+        return LayerCorrector.from_settings(self.gcp_manager.collection, self.aoi, self.aoi.crs())
 
-        target_layer.endEditCommand()
-        target_layer.triggerRepaint()
-        return True
+    @staticmethod
+    def _prepare_provider_correction(target_layer: QgsVectorLayer, corrector: LayerCorrector):
+        """
+        Prepares a corrector for writing corrections of a layer directly to its data provider
+        """
+        corrector.history = None
+        # allow interrupted corrections of large layers to be resumed
+        corrector.checkpoint = CorrectionCheckpoint(CorrectionCheckpoint.path_for_layer(target_layer))
+
+    def _prepare_edit_buffer_correction(self, target_layer: QgsVectorLayer, corrector: LayerCorrector):
+        """
+        Prepares a corrector for storing corrections of a layer in its edit buffer
+        """
+        corrector.checkpoint = None
+        # allow corrections to be cheaply updated after the GCPs are changed
+        if target_layer.id() not in self.correction_histories:
+            self.correction_histories[target_layer.id()] = CorrectionHistory(target_layer)
+        corrector.history = self.correction_histories[target_layer.id()]
+
+    def _report_correction(self, target_layer: QgsVectorLayer, corrector: LayerCorrector,
+                           statistics: TransformStatistics):
+        """
+        Reports the results of a completed (or dry run) correction in the message bar
+        """
+        if corrector.dry_run:
+            message = self.tr('Dry run: {} of {} features ({} vertices) would be corrected')
+        else:
+            message = self.tr('Corrected {} of {} features ({} vertices)')
+        message = message.format(statistics.changed_feature_count,
+                                 statistics.feature_count,
+                                 statistics.changed_vertex_count)
+        if corrector.checkpoint is not None and corrector.checkpoint.resumed:
+            message += ' ' + self.tr('(resumed an interrupted correction, skipping {} features)').format(
+                corrector.checkpoint.resumed_feature_count)
+        if statistics.failed_feature_count:
+            message += ' ' + self.tr('({} features could not be changed)').format(statistics.failed_feature_count)
+            self.iface.messageBar().pushWarning(target_layer.name(), message)
+        else:
+            self.iface.messageBar().pushSuccess(target_layer.name(), message)
+
+    def _show_correction_progress(self, target_layer: QgsVectorLayer, corrector: LayerCorrector) -> QgsMessageBarItem:
+        """
+        Pushes a message bar item showing the progress of a correction, with a button to cancel it.
+
+        The corrector's feedback is replaced, and the apply correction action is disabled until the caller
+        pops the returned item.
+        """
+        progress_message = self.iface.messageBar().createMessage(
+            self.tr('Correcting {}').format(target_layer.name()))
+        progress_bar = QProgressBar()
+        progress_bar.setMaximum(100)
+        progress_message.layout().addWidget(progress_bar)
+        corrector.feedback = QgsFeedback()
+        cancel_button = QPushButton(self.tr('Cancel'))
+        cancel_button.clicked.connect(corrector.feedback.cancel)
+        progress_message.layout().addWidget(cancel_button)
+        self.iface.messageBar().pushWidget(progress_message, Qgis.Info)
+
+        def update_progress(progress: float):
+            progress_bar.setValue(int(progress))
+            # the correction runs in the main thread, so let the progress bar repaint and the cancel
+            # button respond after each tile (or batch)
+            QCoreApplication.processEvents()
+
+        corrector.feedback.progressChanged.connect(update_progress)
+        # don't allow a second correction to be started while events are processed
+        self.apply_correction_action.setEnabled(False)
+        return progress_message
+
+    def _layers_will_be_removed(self, layer_ids: List[str]):
+        """
+        Triggered when layers are about to be removed from the project
+        """
+        for layer_id in layer_ids:
+            self.correction_histories.pop(layer_id, None)
 
     def set_aoi(self, aoi: QgsReferencedRectangle):
         """
@@ -292,6 +450,7 @@ class VectorCorrectionPlugin:
         self.show_aoi_action.setEnabled(True)
         self.apply_correction_action.setEnabled(True)
         self.aoi = aoi
+        self.dock.set_aoi(aoi)
 
         self.show_aoi_action.setChecked(True)
 
@@ -0,0 +1,11 @@
+"""
+Benchmarks for the vector correction plugin.
+
+Benchmarks are not run as part of the test suite. Run them as modules, e.g.
+
+    python -m vector_correction.test.benchmarks.benchmark_geometry_writer
+    python -m vector_correction.test.benchmarks.benchmark_suite --output results.json
+
+The benchmark suite writes machine readable JSON results, and can compare a run against
+a previous run with --baseline to detect regressions.
+"""
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""Geometry writer benchmark.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import argparse
+import time
+
+from qgis.core import (
+    QgsFeature,
+    QgsGeometry,
+    QgsVectorLayer
+)
+
+from vector_correction.core.geometry_writer import GeometryWriter
+from ..utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+def create_layer(feature_count: int) -> QgsVectorLayer:
+    """
+    Creates a memory layer with the specified number of line features
+    """
+    layer = QgsVectorLayer('LineString?crs=EPSG:3857', 'benchmark', 'memory')
+    features = []
+    for i in range(feature_count):
+        f = QgsFeature()
+        f.setGeometry(QgsGeometry.fromWkt(f'LineString({i} 0, {i} 10, {i + 5} 10)'))
+        features.append(f)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def corrected_geometries(layer: QgsVectorLayer):
+    """
+    Returns shifted geometries for all features in a layer
+    """
+    res = {}
+    for f in layer.getFeatures():
+        geometry = f.geometry()
+        geometry.translate(1, 1)
+        res[f.id()] = geometry
+    return res
+
+
+def benchmark(writer, feature_count: int) -> float:
+    """
+    Times a geometry writer, returning the elapsed time in seconds
+    """
+    layer = create_layer(feature_count)
+    geometries = corrected_geometries(layer)
+    layer.startEditing()
+
+    start = time.perf_counter()
+    writer(layer, geometries, 'Correct features')
+    elapsed = time.perf_counter() - start
+
+    assert layer.undoStack().count() == 1
+    layer.rollBack()
+    return elapsed
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description='Benchmark geometry write-back')
+    parser.add_argument('--features', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f'{"features":>10} {"per feature (s)":>16} {"bulk (s)":>10} {"speedup":>8}')
+    for feature_count in args.features:
+        per_feature = benchmark(GeometryWriter.write_per_feature, feature_count)
+        bulk = benchmark(GeometryWriter.write_bulk, feature_count)
+        print(f'{feature_count:>10} {per_feature:>16.3f} {bulk:>10.3f} {per_feature / bulk:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
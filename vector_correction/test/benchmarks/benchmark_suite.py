@@ -0,0 +1,318 @@
+# coding=utf-8
+"""Correction pipeline benchmark suite.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from qgis.analysis import QgsGcpTransformerInterface
+from qgis.core import (
+    Qgis,
+    QgsCoordinateReferenceSystem,
+    QgsFeature,
+    QgsGeometry,
+    QgsLineString,
+    QgsPointXY,
+    QgsRectangle,
+    QgsVectorLayer
+)
+
+from vector_correction.core.gcp_collection import (
+    Gcp,
+    GcpCollection,
+    NotEnoughGcpsException,
+    TransformCreationException
+)
+from vector_correction.core.layer_corrector import LayerCorrector
+from vector_correction.core.settings_registry import SettingsRegistry
+from vector_correction.core.transform_methods import TransformMethods
+from ..utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+CRS = QgsCoordinateReferenceSystem('EPSG:3857')
+EXTENT = QgsRectangle(0, 0, 100000, 100000)
+VERTICES_PER_FEATURE = 20
+
+# methods which solve a dense system over all GCPs are skipped for GCP sets larger than these limits
+METHOD_GCP_LIMITS = {
+    int(QgsGcpTransformerInterface.TransformMethod.ThinPlateSpline): 2000,
+    int(QgsGcpTransformerInterface.TransformMethod.PolynomialOrder3): 50000,
+}
+
+DEFAULT_GCP_COUNTS = [10, 100, 1000, 10000, 100000]
+DEFAULT_VERTEX_COUNTS = [1000, 10000, 100000, 1000000]
+
+
+def create_collection(gcp_count: int, seed: int = 0) -> GcpCollection:
+    """
+    Creates a collection of random GCPs covering the benchmark extent, with smoothly varying
+    displacements plus some noise
+    """
+    rng = random.Random(seed)
+    collection = GcpCollection()
+    for _ in range(gcp_count):
+        x = rng.uniform(EXTENT.xMinimum(), EXTENT.xMaximum())
+        y = rng.uniform(EXTENT.yMinimum(), EXTENT.yMaximum())
+        dx = 5 + x / 10000 + rng.gauss(0, 0.5)
+        dy = -3 + y / 20000 + rng.gauss(0, 0.5)
+        collection.gcps.append(Gcp(QgsPointXY(x, y), QgsPointXY(x + dx, y + dy), CRS))
+    collection.gcps_changed()
+    return collection
+
+
+def create_layer(vertex_count: int, seed: int = 0) -> QgsVectorLayer:
+    """
+    Creates a memory layer of random lines, with the specified total number of vertices
+    """
+    rng = random.Random(seed)
+    layer = QgsVectorLayer('LineString?crs=EPSG:3857', 'benchmark', 'memory')
+    features = []
+    for _ in range(max(1, vertex_count // VERTICES_PER_FEATURE)):
+        x = rng.uniform(EXTENT.xMinimum(), EXTENT.xMaximum())
+        y = rng.uniform(EXTENT.yMinimum(), EXTENT.yMaximum())
+        xs = []
+        ys = []
+        for _ in range(VERTICES_PER_FEATURE):
+            x += rng.uniform(-50, 50)
+            y += rng.uniform(-50, 50)
+            xs.append(x)
+            ys.append(y)
+
+        f = QgsFeature()
+        f.setGeometry(QgsGeometry(QgsLineString(xs, ys)))
+        features.append(f)
+        if len(features) >= 10000:
+            layer.dataProvider().addFeatures(features)
+            features = []
+
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def time_call(func, repeats: int) -> dict:
+    """
+    Times a function, returning a dictionary of timing results in seconds
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+        'repeats': repeats
+    }
+
+
+class BenchmarkSuite:
+    """
+    Runs the correction pipeline benchmarks
+    """
+
+    def __init__(self, gcp_counts, vertex_counts, methods, repeats: int, transform_gcp_count: int):
+        self.gcp_counts = gcp_counts
+        self.vertex_counts = vertex_counts
+        self.methods = methods
+        self.repeats = repeats
+        self.transform_gcp_count = transform_gcp_count
+        self.results = []
+        self.temp_dir = tempfile.mkdtemp()
+
+    def record(self, name: str, parameters: dict, func):
+        """
+        Times a benchmark and records the result
+        """
+        try:
+            result = time_call(func, self.repeats)
+        except (NotEnoughGcpsException, TransformCreationException) as e:
+            result = {'error': str(e)}
+
+        result['name'] = name
+        result['parameters'] = parameters
+        self.results.append(result)
+        outcome = f'{result["median"]:>10.4f}s' if 'median' in result else result['error']
+        print(f'{name:<24} {json.dumps(parameters):<60} {outcome}')
+
+    def run_gcp_benchmarks(self):
+        """
+        Benchmarks operations which scale with the number of GCPs
+        """
+        for gcp_count in self.gcp_counts:
+            collection = create_collection(gcp_count)
+
+            path = os.path.join(self.temp_dir, f'gcps_{gcp_count}.txt')
+            collection.save_to_file(path)
+
+            def load(path=path):
+                GcpCollection().load_from_file(path)
+
+            self.record('load_from_file', {'gcps': gcp_count}, load)
+
+            def residuals(collection=collection):
+                collection.transformer_cache.clear()
+                collection.update_residuals()
+
+            self.record('update_residuals', {'gcps': gcp_count}, residuals)
+
+            for method in self.methods:
+                if gcp_count > METHOD_GCP_LIMITS.get(int(method), gcp_count):
+                    continue
+                SettingsRegistry.set_transform_method(method)
+
+                def fit(collection=collection):
+                    collection.transformer_cache.clear()
+                    collection.to_gcp_transformer(CRS)
+
+                self.record('to_gcp_transformer', {'gcps': gcp_count,
+                                                   'method': TransformMethods.method_to_string(method)}, fit)
+
+            def export(collection=collection, path=os.path.join(self.temp_dir, f'export_{gcp_count}.gpkg')):
+                collection.export_to_layer(path)
+
+            self.record('export_to_layer', {'gcps': gcp_count}, export)
+
+    def run_layer_benchmarks(self):
+        """
+        Benchmarks operations which scale with the number of vertices being corrected
+        """
+        collection = create_collection(self.transform_gcp_count)
+        for vertex_count in self.vertex_counts:
+            layer = create_layer(vertex_count)
+            geometries = {f.id(): f.geometry() for f in layer.getFeatures()}
+
+            for method in self.methods:
+                if self.transform_gcp_count > METHOD_GCP_LIMITS.get(int(method), self.transform_gcp_count):
+                    continue
+                SettingsRegistry.set_transform_method(method)
+                parameters = {'vertices': vertex_count,
+                              'gcps': self.transform_gcp_count,
+                              'method': TransformMethods.method_to_string(method)}
+
+                # fit outside of the timed calls
+                try:
+                    collection.to_gcp_transformer(CRS)
+                except (NotEnoughGcpsException, TransformCreationException):
+                    pass
+
+                def transform(geometries=geometries):
+                    collection.transform_features({_id: QgsGeometry(g) for _id, g in geometries.items()},
+                                                  CRS, EXTENT, CRS)
+
+                self.record('transform_features', parameters, transform)
+
+                def apply(layer=layer):
+                    layer.startEditing()
+                    LayerCorrector(collection, EXTENT, CRS).correct_layer(layer)
+                    layer.rollBack()
+
+                self.record('apply_correction', parameters, apply)
+
+    def run(self) -> dict:
+        """
+        Runs all benchmarks, returning the results
+        """
+        original_method = SettingsRegistry.transform_method()
+        try:
+            self.run_gcp_benchmarks()
+            self.run_layer_benchmarks()
+        finally:
+            SettingsRegistry.set_transform_method(original_method)
+
+        return {
+            'created': datetime.now().isoformat(),
+            'qgis_version': Qgis.QGIS_VERSION,
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'results': self.results
+        }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> int:
+    """
+    Compares results against a baseline, printing any regressions. Returns the number of regressions.
+    """
+    baseline_timings = {
+        (r['name'], json.dumps(r['parameters'], sort_keys=True)): r['median']
+        for r in baseline['results'] if 'median' in r
+    }
+
+    regressions = 0
+    for result in results['results']:
+        key = (result['name'], json.dumps(result['parameters'], sort_keys=True))
+        if 'median' not in result or key not in baseline_timings:
+            continue
+
+        ratio = result['median'] / baseline_timings[key] if baseline_timings[key] else 1
+        if ratio > 1 + threshold:
+            regressions += 1
+            print(f'REGRESSION {result["name"]} {key[1]}: {baseline_timings[key]:.4f}s -> '
+                  f'{result["median"]:.4f}s ({ratio:.2f}x)')
+
+    return regressions
+
+
+def main():
+    """
+    Runs the benchmark suite
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the vector correction pipeline')
+    parser.add_argument('--gcps', type=int, nargs='+', default=DEFAULT_GCP_COUNTS,
+                        help='GCP set sizes to benchmark')
+    parser.add_argument('--vertices', type=int, nargs='+', default=DEFAULT_VERTEX_COUNTS,
+                        help='layer sizes (in vertices) to benchmark')
+    parser.add_argument('--methods', type=int, nargs='+',
+                        default=[int(m) for m in TransformMethods.available_methods()],
+                        help='transform methods to benchmark, as integer method values')
+    parser.add_argument('--transform-gcps', type=int, default=1000,
+                        help='number of GCPs to use when benchmarking layer corrections')
+    parser.add_argument('--repeats', type=int, default=3, help='number of times to repeat each benchmark')
+    parser.add_argument('--output', help='path to write JSON results to')
+    parser.add_argument('--baseline', help='path to JSON results from a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown compared to the baseline to report as a regression')
+    args = parser.parse_args()
+
+    suite = BenchmarkSuite(gcp_counts=args.gcps,
+                           vertex_counts=args.vertices,
+                           methods=[TransformMethods.from_int(m) for m in args.methods],
+                           repeats=args.repeats,
+                           transform_gcp_count=args.transform_gcps)
+    results = suite.run()
+
+    if args.output:
+        with open(args.output, 'wt', encoding='utf8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'rt', encoding='utf8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
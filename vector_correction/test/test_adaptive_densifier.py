@@ -0,0 +1,129 @@
+# coding=utf-8
+"""Adaptive Densifier Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import unittest
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsGeometry,
+    QgsProject,
+    QgsRectangle
+)
+
+from vector_correction.core.gcp_collection import (
+    GcpCollection,
+    TransformStatistics
+)
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class ParabolicTransformer:
+    """
+    Simple non-linear transformer for tests
+    """
+
+    def transform(self, x, y, inverse=False):  # pylint: disable=unused-argument,missing-function-docstring
+        return True, x, y + x * x / 1000
+
+
+class ShiftTransformer:
+    """
+    Simple linear transformer for tests
+    """
+
+    def transform(self, x, y, inverse=False):  # pylint: disable=unused-argument,missing-function-docstring
+        return True, x + 10, y
+
+
+class AdaptiveDensifierTest(unittest.TestCase):
+    """Test adaptive densification works."""
+
+    @staticmethod
+    def transform(transformer, wkt: str, tolerance: float, statistics: TransformStatistics) -> QgsGeometry:
+        """
+        Transforms a geometry with densification
+        """
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        return GcpCollection.transform_vertices_in_extent(transformer,
+                                                          QgsGeometry.fromWkt(wkt),
+                                                          QgsRectangle(-1000, -1000, 1000, 1000),
+                                                          QgsCoordinateTransform(crs, crs, QgsProject.instance()),
+                                                          statistics,
+                                                          densify_tolerance=tolerance)
+
+    def test_linear(self):
+        """
+        Linear transforms should never densify
+        """
+        statistics = TransformStatistics()
+        res = self.transform(ShiftTransformer(), 'LineString(0 0, 100 0, 100 100)', 0.01, statistics)
+        self.assertEqual(res.asWkt(0), 'LineString (10 0, 110 0, 110 100)')
+        self.assertEqual(statistics.inserted_vertex_count, 0)
+
+    def test_non_linear(self):
+        """
+        Test densifying for a non-linear transform
+        """
+        statistics = TransformStatistics()
+        res = self.transform(ParabolicTransformer(), 'LineStringZ(0 0 0, 100 0 10)', 0.5, statistics)
+        self.assertGreater(statistics.inserted_vertex_count, 0)
+        self.assertEqual(res.constGet().numPoints(), 2 + statistics.inserted_vertex_count)
+
+        # all vertices must lie on the transformed curve, and z values are interpolated
+        for point in res.vertices():
+            self.assertAlmostEqual(point.y(), point.x() * point.x() / 1000, 6)
+            self.assertAlmostEqual(point.z(), point.x() / 10, 6)
+
+        # densified segments must be within tolerance of the curve
+        line = res.constGet()
+        for i in range(line.numPoints() - 1):
+            mid_x = (line.xAt(i) + line.xAt(i + 1)) / 2
+            mid_y = (line.yAt(i) + line.yAt(i + 1)) / 2
+            self.assertLessEqual(abs(mid_y - mid_x * mid_x / 1000), 0.5)
+
+        # a tighter tolerance should insert more vertices
+        statistics2 = TransformStatistics()
+        self.transform(ParabolicTransformer(), 'LineStringZ(0 0 0, 100 0 10)', 0.05, statistics2)
+        self.assertGreater(statistics2.inserted_vertex_count, statistics.inserted_vertex_count)
+
+    def test_polygon(self):
+        """
+        Test densifying polygon rings
+        """
+        statistics = TransformStatistics()
+        res = self.transform(ParabolicTransformer(),
+                             'MultiPolygon(((0 0, 100 0, 100 10, 0 0)),((200 0, 300 0, 300 10, 200 0),'
+                             '(210 1, 290 1, 290 5, 210 1)))', 1, statistics)
+        self.assertTrue(res.isGeosValid())
+        self.assertGreater(statistics.inserted_vertex_count, 0)
+        for point in res.vertices():
+            self.assertGreaterEqual(point.y(), point.x() * point.x() / 1000 - 1e-6)
+        for part in res.constParts():
+            self.assertTrue(part.exteriorRing().isClosed())
+
+        # curved geometries are not densified
+        statistics = TransformStatistics()
+        self.transform(ParabolicTransformer(), 'CircularString(0 0, 50 10, 100 0)', 0.01, statistics)
+        self.assertEqual(statistics.inserted_vertex_count, 0)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(AdaptiveDensifierTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
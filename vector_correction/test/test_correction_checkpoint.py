@@ -0,0 +1,163 @@
+# coding=utf-8
+"""Correction Checkpoint Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import tempfile
+import unittest
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsGeometry,
+    QgsPointXY,
+    QgsVectorLayer
+)
+
+from vector_correction.core.correction_checkpoint import CorrectionCheckpoint
+from vector_correction.core.gcp_collection import Gcp
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class CorrectionCheckpointTest(unittest.TestCase):
+    """Test correction checkpoints work."""
+
+    def test_encode_ids(self):
+        """
+        Test encoding feature IDs as ranges
+        """
+        self.assertEqual(CorrectionCheckpoint.encode_ids([]), '')
+        self.assertEqual(CorrectionCheckpoint.encode_ids([5, 1, 2, 3, 8, 9, 11]), '1:3,5,8:9,11')
+        self.assertEqual(CorrectionCheckpoint.decode_ids(''), set())
+        self.assertEqual(CorrectionCheckpoint.decode_ids('1:3,5,8:9,11'), {1, 2, 3, 5, 8, 9, 11})
+
+    def test_resume(self):
+        """
+        Test resuming from a checkpoint
+        """
+        path = os.path.join(tempfile.mkdtemp(), 'checkpoints', 'test.txt')
+        gcps = [Gcp(QgsPointXY(1, 2), QgsPointXY(3, 4), QgsCoordinateReferenceSystem('EPSG:3857'))]
+
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertFalse(checkpoint.exists())
+        self.assertFalse(checkpoint.begin('key', gcps))
+        self.assertTrue(checkpoint.exists())
+        checkpoint.record([1, 2, 3])
+        checkpoint.record([7], tile=2)
+        checkpoint.record([], tile=3)
+
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertTrue(checkpoint.begin('key', gcps))
+        self.assertTrue(checkpoint.resumed)
+        self.assertEqual(checkpoint.completed_ids, {1, 2, 3, 7})
+        self.assertEqual(checkpoint.completed_tiles, {2, 3})
+        self.assertEqual(checkpoint.resumed_feature_count, 4)
+        self.assertEqual([gcp.to_string() for gcp in checkpoint.gcps], [gcps[0].to_string()])
+
+        # an incomplete line from an interrupted write is discarded
+        with open(path, 'at', encoding='utf8') as f:
+            f.write('ids 10:2')
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertTrue(checkpoint.begin('key', gcps))
+        self.assertEqual(checkpoint.completed_ids, {1, 2, 3, 7})
+        checkpoint.record([4])
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertTrue(checkpoint.begin('key', gcps))
+        self.assertEqual(checkpoint.completed_ids, {1, 2, 3, 4, 7})
+
+        # a checkpoint made with different GCPs is discarded, even if the key matches
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertFalse(checkpoint.begin('key', [Gcp(QgsPointXY(1, 2), QgsPointXY(3, 5),
+                                                      QgsCoordinateReferenceSystem('EPSG:3857'))]))
+        self.assertFalse(checkpoint.completed_ids)
+
+        # a checkpoint for a different run is discarded
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertFalse(checkpoint.begin('other key', gcps))
+        self.assertFalse(checkpoint.completed_ids)
+        self.assertFalse(checkpoint.completed_tiles)
+        self.assertEqual(checkpoint.resumed_feature_count, 0)
+
+        checkpoint.remove()
+        self.assertFalse(checkpoint.exists())
+
+    def test_geometry_hash(self):
+        """
+        Test hashing geometries
+        """
+        point_hash = CorrectionCheckpoint.geometry_hash(QgsGeometry.fromWkt('Point(1 2)'))
+        self.assertEqual(len(point_hash), 24)
+        self.assertEqual(CorrectionCheckpoint.geometry_hash(QgsGeometry.fromWkt('MultiPoint(1 2)')), point_hash)
+        self.assertEqual(CorrectionCheckpoint.geometry_hash(QgsGeometry.fromWkt('PointZ(1 2 3)')), point_hash)
+        self.assertNotEqual(CorrectionCheckpoint.geometry_hash(QgsGeometry.fromWkt('Point(1 2.01)')), point_hash)
+        # coordinates rounded by a provider when saving are still matched
+        self.assertEqual(CorrectionCheckpoint.geometry_hash(QgsGeometry.fromWkt('Point(1.0000001 1.9999999)')),
+                         point_hash)
+        self.assertNotEqual(CorrectionCheckpoint.geometry_hash(QgsGeometry.fromWkt('Point(1.0000001 1.9999999)'),
+                                                               precision=1e-9), point_hash)
+
+    def test_precision_for_layer(self):
+        """
+        Test the default coordinate precision for layers
+        """
+        layer = QgsVectorLayer('Point?crs=EPSG:3857', 'test', 'memory')
+        self.assertEqual(CorrectionCheckpoint.precision_for_layer(layer), CorrectionCheckpoint.DEFAULT_PRECISION)
+        layer.geometryOptions().setGeometryPrecision(0.01)
+        self.assertEqual(CorrectionCheckpoint.precision_for_layer(layer), 0.01)
+        layer = QgsVectorLayer('Point?crs=EPSG:4326', 'test', 'memory')
+        self.assertEqual(CorrectionCheckpoint.precision_for_layer(layer), CorrectionCheckpoint.GEOGRAPHIC_PRECISION)
+
+    def test_pending(self):
+        """
+        Test resolving pending batches from an interrupted run
+        """
+        path = os.path.join(tempfile.mkdtemp(), 'test.txt')
+
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertFalse(checkpoint.begin('key', [], precision=0.01))
+        checkpoint.record_pending({1: QgsGeometry.fromWkt('Point(10 10)')})
+        checkpoint.record([1])
+        # interrupted after writing the batch, but before recording it
+        checkpoint.record_pending({2: QgsGeometry.fromWkt('Point(20 20)'),
+                                   3: QgsGeometry.fromWkt('Point(30 30)'),
+                                   4: QgsGeometry.fromWkt('Point(40 40)')})
+
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertTrue(checkpoint.begin('key', []))
+        # the precision of the interrupted run is used
+        self.assertEqual(checkpoint.precision, 0.01)
+        self.assertEqual(checkpoint.completed_ids, {1})
+        self.assertEqual(set(checkpoint.pending.keys()), {2, 3, 4})
+        self.assertEqual(checkpoint.resumed_feature_count, 1)
+
+        # feature 2 was saved (with rounding), feature 3 was not and feature 4 has since been deleted
+        self.assertEqual(checkpoint.resolve_pending({2: QgsGeometry.fromWkt('Point(20.001 19.999)'),
+                                                     3: QgsGeometry.fromWkt('Point(25 25)')}), 1)
+        self.assertFalse(checkpoint.pending)
+        self.assertEqual(checkpoint.completed_ids, {1, 2})
+        self.assertEqual(checkpoint.resumed_feature_count, 2)
+
+        # saved features are recorded as completed, while unsaved features are checked again on the next resume
+        checkpoint = CorrectionCheckpoint(path)
+        self.assertTrue(checkpoint.begin('key', []))
+        self.assertEqual(checkpoint.completed_ids, {1, 2})
+        self.assertEqual(set(checkpoint.pending.keys()), {3, 4})
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(CorrectionCheckpointTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
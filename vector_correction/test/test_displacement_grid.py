@@ -0,0 +1,146 @@
+# coding=utf-8
+"""Displacement Grid Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+import os
+import tempfile
+import unittest
+
+from osgeo import gdal
+from qgis.analysis import QgsGcpTransformerInterface
+from qgis.core import (
+    QgsPointXY,
+    QgsCoordinateReferenceSystem,
+    QgsRectangle
+)
+
+from vector_correction.core.displacement_grid import DisplacementGrid
+from vector_correction.core.gcp_collection import GcpCollection
+from vector_correction.core.settings_registry import SettingsRegistry
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class AffineTransformer:
+    """
+    Simple affine transformer for tests
+    """
+
+    def transform(self, x, y, inverse=False):  # pylint: disable=unused-argument,missing-function-docstring
+        return True, 1.1 * x + 0.2 * y + 5, -0.1 * x + 0.9 * y - 3
+
+
+class WarpTransformer:
+    """
+    Simple non-linear transformer for tests
+    """
+
+    def transform(self, x, y, inverse=False):  # pylint: disable=unused-argument,missing-function-docstring
+        return True, x + 5 * math.sin(x / 100), y + 3 * math.cos(y / 150)
+
+
+class DisplacementGridTest(unittest.TestCase):
+    """Test displacement grids work."""
+
+    def test_affine(self):
+        """
+        Test that affine transforms are reproduced exactly by a grid
+        """
+        transformer = AffineTransformer()
+        for interpolation in (DisplacementGrid.BILINEAR, DisplacementGrid.BICUBIC):
+            grid = DisplacementGrid.sample(transformer, QgsRectangle(0, 0, 100, 50), 10, 5, interpolation)
+            self.assertEqual(grid.extent(), QgsRectangle(0, 0, 100, 50))
+            for x, y in ((0, 0), (100, 50), (33.3, 12.7), (99.9, 0.1)):
+                _, expected_x, expected_y = transformer.transform(x, y)
+                ok, grid_x, grid_y = grid.transform(x, y)
+                self.assertTrue(ok)
+                self.assertAlmostEqual(grid_x, expected_x, 6)
+                self.assertAlmostEqual(grid_y, expected_y, 6)
+
+            # inverse transforms are not supported
+            self.assertFalse(grid.transform(1, 1, True)[0])
+
+    def test_tolerance(self):
+        """
+        Test refining a grid until it is within a tolerance
+        """
+        transformer = WarpTransformer()
+        coarse = DisplacementGrid.from_transformer(transformer, QgsRectangle(0, 0, 1000, 1000), 2, 2)
+        self.assertIsNone(coarse.max_error)
+        self.assertEqual(coarse.columns, 2)
+
+        refined = DisplacementGrid.from_transformer(transformer, QgsRectangle(0, 0, 1000, 1000), 2, 2,
+                                                    tolerance=0.5, maximum_refinements=6)
+        self.assertGreater(refined.columns, 2)
+        self.assertLessEqual(refined.max_error, 0.5)
+        self.assertLessEqual(refined.estimate_error(transformer), 0.5)
+
+    def test_geotiff(self):
+        """
+        Test writing and reading grids
+        """
+        grid = DisplacementGrid.sample(WarpTransformer(), QgsRectangle(10, 20, 110, 70), 10, 5)
+        grid.crs = QgsCoordinateReferenceSystem('EPSG:3111')
+
+        path = os.path.join(tempfile.mkdtemp(), 'grid.tif')
+        self.assertTrue(grid.write_geotiff(path))
+
+        grid2 = DisplacementGrid.from_geotiff(path)
+        self.assertEqual(grid2.columns, 10)
+        self.assertEqual(grid2.rows, 5)
+        self.assertEqual(grid2.crs.authid(), 'EPSG:3111')
+        self.assertAlmostEqual(grid2.x_minimum, 10, 6)
+        self.assertAlmostEqual(grid2.y_minimum, 20, 6)
+        self.assertAlmostEqual(grid2.cell_width, 10, 6)
+        self.assertAlmostEqual(grid2.cell_height, 10, 6)
+        self.assertEqual(list(grid2.x_displacements), list(grid.x_displacements))
+        self.assertEqual(list(grid2.y_displacements), list(grid.y_displacements))
+
+        # other rasters with two bands (e.g. an image) must not be read as displacements
+        path = os.path.join(tempfile.mkdtemp(), 'image.tif')
+        dataset = gdal.GetDriverByName('GTiff').Create(path, 11, 6, 2, gdal.GDT_Float64)
+        dataset.SetGeoTransform([5, 10, 0, 75, 0, -10])
+        dataset = None
+        self.assertIsNone(DisplacementGrid.from_geotiff(path))
+
+    def test_collection_grid(self):
+        """
+        Test creating grids from a GCP collection
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 0), crs=crs)
+
+        grid = collection.to_displacement_grid(crs, QgsRectangle(0, 0, 200, 100), crs, resolution=10)
+        self.assertEqual(grid.columns, 20)
+        self.assertEqual(grid.rows, 10)
+        ok, x, y = grid.transform(55, 45)
+        self.assertTrue(ok)
+        self.assertAlmostEqual(x, 65, 6)
+        self.assertAlmostEqual(y, 45, 6)
+
+        # grids are cached
+        self.assertIs(collection.to_displacement_grid(crs, QgsRectangle(0, 0, 200, 100), crs, resolution=10), grid)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DisplacementGridTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,351 @@
+# coding=utf-8
+"""GCP Collection Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2018 by Nyall Dawson'
+__date__ = '20/04/2018'
+__copyright__ = 'Copyright 2018, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import tempfile
+import unittest
+
+from qgis.analysis import QgsGcpTransformerInterface
+from qgis.core import (
+    QgsPointXY,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsGeometry,
+    QgsProject,
+    QgsRectangle,
+    QgsVectorLayer
+)
+
+from vector_correction.core.gcp_collection import (
+    GcpCollection,
+    Gcp,
+    NotEnoughGcpsException,
+    TransformStatistics
+)
+from vector_correction.core.gcp_manager import GcpManager
+from vector_correction.core.settings_registry import SettingsRegistry
+from vector_correction.core.vertex_cache import VertexCache
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class GcpCollectionTest(unittest.TestCase):
+    """Test GCP collection works without a map canvas."""
+
+    def test_gcps(self):
+        """
+        Test adding and removing GCPs
+        """
+        collection = GcpCollection()
+        self.assertEqual(len(collection), 0)
+
+        collection.add_gcp(QgsPointXY(10, 11), QgsPointXY(20, 22), crs=QgsCoordinateReferenceSystem('EPSG:4326'))
+        collection.add_gcp(QgsPointXY(100, 101), QgsPointXY(200, 202), crs=QgsCoordinateReferenceSystem('EPSG:4326'))
+        collection.add_gcp(QgsPointXY(30, 31), QgsPointXY(40, 42), crs=QgsCoordinateReferenceSystem('EPSG:4326'))
+        self.assertEqual(len(collection), 3)
+
+        collection.remove_rows([2, 0])
+        self.assertEqual(collection.gcps,
+                         [Gcp(QgsPointXY(100, 101), QgsPointXY(200, 202), QgsCoordinateReferenceSystem('EPSG:4326'))])
+
+        collection.clear()
+        self.assertEqual(len(collection), 0)
+
+    def test_transform_features(self):
+        """
+        Test transforming features without a canvas
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+
+        collection = GcpCollection()
+        with self.assertRaises(NotEnoughGcpsException):
+            collection.to_gcp_transformer(QgsCoordinateReferenceSystem('EPSG:3857'))
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 100), QgsPointXY(110, 100), crs=crs)
+        collection.update_residuals()
+        for gcp in collection.gcps:
+            self.assertAlmostEqual(gcp.residual, 0, 3)
+
+        res = collection.transform_features({1: QgsGeometry.fromWkt('LineString(50 50, 500 50)')},
+                                            feature_crs=crs,
+                                            extent=QgsRectangle(0, 0, 200, 200),
+                                            extent_crs=crs)
+        # only the vertex inside the extent is moved
+        self.assertEqual(res[1].asWkt(0), 'LineString (60 50, 500 50)')
+
+        # features without any vertices inside the extent are skipped
+        statistics = TransformStatistics()
+        res = collection.transform_features({1: QgsGeometry.fromWkt('LineString(50 50, 500 50)'),
+                                             2: QgsGeometry.fromWkt('LineString(300 50, 500 50)'),
+                                             3: QgsGeometry.fromWkt('Polygon((10 10, 20 10, 20 20, 10 10))')},
+                                            feature_crs=crs,
+                                            extent=QgsRectangle(0, 0, 200, 200),
+                                            extent_crs=crs,
+                                            statistics=statistics)
+        self.assertEqual(list(res.keys()), [1, 3])
+        self.assertEqual(res[3].asWkt(0), 'Polygon ((20 10, 30 10, 30 20, 20 10))')
+        self.assertEqual(statistics.feature_count, 3)
+        self.assertEqual(statistics.changed_feature_count, 2)
+        self.assertEqual(statistics.changed_vertex_count, 5)
+
+    def test_transform_curves_z_m(self):
+        """
+        Test transforming curved geometries and geometries with z or m values
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 0), crs=crs)
+
+        statistics = TransformStatistics()
+        res = collection.transform_features(
+            {1: QgsGeometry.fromWkt('CircularStringZM(0 0 1 2, 10 10 3 4, 20 0 5 6, 30 -10 7 8, 500 0 9 10)'),
+             2: QgsGeometry.fromWkt('CompoundCurveZ((0 0 1, 10 0 2),CircularStringZ(10 0 2, 15 5 3, 20 0 4))'),
+             3: QgsGeometry.fromWkt('CurvePolygonM(CircularStringM(0 0 1, 10 10 2, 20 0 3, 10 -10 4, 0 0 1))'),
+             4: QgsGeometry.fromWkt('GeometryCollection(PointZ(5 5 1), LineStringM(1 1 2, 300 300 3))')},
+            feature_crs=crs,
+            extent=QgsRectangle(-50, -50, 200, 200),
+            extent_crs=crs,
+            statistics=statistics)
+
+        self.assertEqual(res[1].asWkt(0),
+                         'CircularStringZM (10 0 1 2, 20 10 3 4, 30 0 5 6, 40 -10 7 8, 500 0 9 10)')
+        self.assertEqual(res[2].asWkt(0),
+                         'CompoundCurveZ ((10 0 1, 20 0 2),CircularStringZ (20 0 2, 25 5 3, 30 0 4))')
+        self.assertEqual(res[3].asWkt(0),
+                         'CurvePolygonM (CircularStringM (10 0 1, 20 10 2, 30 0 3, 20 -10 4, 10 0 1))')
+        self.assertEqual(res[4].asWkt(0),
+                         'GeometryCollection (PointZ (15 5 1),LineStringM (11 1 2, 300 300 3))')
+        self.assertEqual(statistics.changed_feature_count, 4)
+        self.assertEqual(statistics.changed_vertex_count, 4 + 5 + 5 + 2)
+
+    def test_transform_features_other_crs(self):
+        """
+        Test transforming features in a different CRS to the GCPs
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 0), crs=crs)
+        self.assertEqual(collection.working_crs(QgsCoordinateReferenceSystem('EPSG:4326')), crs)
+
+        feature_crs = QgsCoordinateReferenceSystem('EPSG:4326')
+        to_feature_crs = QgsCoordinateTransform(crs, feature_crs, QgsProject.instance())
+        geometry = QgsGeometry.fromWkt('CompoundCurve((50 50, 60 50),CircularString(60 50, 65 55, 70 50),(70 50, 500 50))')
+        geometry.transform(to_feature_crs)
+        original = QgsGeometry(geometry)
+
+        statistics = TransformStatistics()
+        res = collection.transform_features({1: geometry},
+                                            feature_crs=feature_crs,
+                                            extent=QgsRectangle(0, 0, 200, 200),
+                                            extent_crs=crs,
+                                            statistics=statistics)
+        self.assertEqual(statistics.changed_vertex_count, 6)
+        # vertices outside the extent keep their exact original coordinates
+        self.assertEqual(res[1].constGet().endPoint(), original.constGet().endPoint())
+
+        res[1].transform(to_feature_crs, QgsCoordinateTransform.ReverseTransform)
+        self.assertEqual(res[1].asWkt(3),
+                         'CompoundCurve ((60 50, 70 50),CircularString (70 50, 75 55, 80 50),(80 50, 500 50))')
+
+    def test_displacement_grid_file(self):
+        """
+        Test exporting a displacement grid and applying it from file
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+        SettingsRegistry.set_displacement_grid_resolution(10)
+        SettingsRegistry.set_displacement_grid_tolerance(0)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 0), crs=crs)
+
+        path = os.path.join(tempfile.mkdtemp(), 'grid.tif')
+        self.assertTrue(collection.export_displacement_grid(path, QgsRectangle(0, 0, 200, 200), crs))
+
+        # a grid can be applied without any GCPs
+        other = GcpCollection()
+        self.assertFalse(other.load_displacement_grid(os.path.join(tempfile.mkdtemp(), 'missing.tif')))
+        self.assertIsNone(other.loaded_grid)
+        self.assertTrue(other.load_displacement_grid(path))
+        self.assertEqual(other.working_crs(QgsCoordinateReferenceSystem('EPSG:4326')), crs)
+
+        res = other.transform_features({1: QgsGeometry.fromWkt('LineString(50 50, 500 50)')},
+                                       feature_crs=crs,
+                                       extent=QgsRectangle(0, 0, 200, 200),
+                                       extent_crs=crs)
+        self.assertEqual(res[1].asWkt(0), 'LineString (60 50, 500 50)')
+
+        other.clear_displacement_grid()
+        with self.assertRaises(NotEnoughGcpsException):
+            other.transform_features({1: QgsGeometry.fromWkt('LineString(50 50, 500 50)')},
+                                     feature_crs=crs,
+                                     extent=QgsRectangle(0, 0, 200, 200),
+                                     extent_crs=crs)
+
+    def test_shared_vertices(self):
+        """
+        Test that shared vertices are only transformed once
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 0), crs=crs)
+
+        vertex_cache = VertexCache()
+        res = collection.transform_features({1: QgsGeometry.fromWkt('Polygon((0 0, 10 0, 10 10, 0 10, 0 0))'),
+                                             2: QgsGeometry.fromWkt('Polygon((10 0, 20 0, 20 10, 10 10, 10 0))')},
+                                            feature_crs=crs,
+                                            extent=QgsRectangle(0, 0, 200, 200),
+                                            extent_crs=crs,
+                                            vertex_cache=vertex_cache)
+        self.assertEqual(res[1].asWkt(0), 'Polygon ((10 0, 20 0, 20 10, 10 10, 10 0))')
+        self.assertEqual(res[2].asWkt(0), 'Polygon ((20 0, 30 0, 30 10, 20 10, 20 0))')
+        # 6 unique vertices
+        self.assertEqual(len(vertex_cache), 6)
+        self.assertEqual(vertex_cache.misses, 6)
+        self.assertEqual(vertex_cache.hits, 4)
+
+        # near coincident vertices should be snapped together
+        vertex_cache = VertexCache(tolerance=0.001)
+        res = collection.transform_features({1: QgsGeometry.fromWkt('LineString(0 0, 50 50)'),
+                                             2: QgsGeometry.fromWkt('LineString(50.0004 50, 100 0)')},
+                                            feature_crs=crs,
+                                            extent=QgsRectangle(0, 0, 200, 200),
+                                            extent_crs=crs,
+                                            vertex_cache=vertex_cache)
+        self.assertEqual(res[1].asWkt(4), 'LineString (10 0, 60 50)')
+        self.assertEqual(res[2].asWkt(4), 'LineString (60 50, 110 0)')
+
+        # vertices of the same feature are never snapped together, even when one is shared with another feature
+        vertex_cache = VertexCache(tolerance=0.001)
+        res = collection.transform_features({1: QgsGeometry.fromWkt('LineString(0 0, 50 50)'),
+                                             2: QgsGeometry.fromWkt('LineString(50 50, 50.0004 50, 50.0008 50)')},
+                                            feature_crs=crs,
+                                            extent=QgsRectangle(0, 0, 200, 200),
+                                            extent_crs=crs,
+                                            vertex_cache=vertex_cache)
+        self.assertEqual(res[2].asWkt(4), 'LineString (60 50, 60.0004 50, 60.0008 50)')
+
+        # vertices outside the extent are never moved to the position of a nearby vertex inside the extent
+        vertex_cache = VertexCache(tolerance=0.001)
+        res = collection.transform_features({1: QgsGeometry.fromWkt('LineString(0 0, 50 50)'),
+                                             2: QgsGeometry.fromWkt('LineString(50.0004 50, 100 50)')},
+                                            feature_crs=crs,
+                                            extent=QgsRectangle(0, 0, 50, 50),
+                                            extent_crs=crs,
+                                            vertex_cache=vertex_cache)
+        self.assertEqual(res[1].asWkt(4), 'LineString (10 0, 60 50)')
+        self.assertNotIn(2, res)
+
+    def test_transformer_cache(self):
+        """
+        Test that fitted transformers are reused while the GCPs and method are unchanged
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 0), crs=crs)
+        fingerprint = collection.fingerprint()
+
+        transformer = collection.to_gcp_transformer(crs)
+        self.assertIs(collection.to_gcp_transformer(crs), transformer)
+        self.assertIsNot(collection.to_gcp_transformer(QgsCoordinateReferenceSystem('EPSG:3111')), transformer)
+
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.PolynomialOrder1)
+        collection.add_gcp(QgsPointXY(100, 100), QgsPointXY(110, 100), crs=crs)
+        self.assertNotEqual(collection.fingerprint(), fingerprint)
+        polynomial_transformer = collection.to_gcp_transformer(crs)
+        self.assertIsNot(polynomial_transformer, transformer)
+
+        # switching back to a previously fitted method must reuse the cached transformer
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+        helmert_transformer = collection.to_gcp_transformer(crs)
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.PolynomialOrder1)
+        self.assertIs(collection.to_gcp_transformer(crs), polynomial_transformer)
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+        self.assertIs(collection.to_gcp_transformer(crs), helmert_transformer)
+
+    def test_save_load(self):
+        """
+        Test saving and loading GCPs from a file
+        """
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(10, 11), QgsPointXY(20, 22), crs=QgsCoordinateReferenceSystem('EPSG:4326'))
+        collection.add_gcp(QgsPointXY(100, 101), QgsPointXY(200, 202), crs=QgsCoordinateReferenceSystem('EPSG:4326'))
+
+        path = os.path.join(tempfile.mkdtemp(), 'gcps.txt')
+        collection.save_to_file(path)
+
+        collection2 = GcpCollection()
+        collection2.load_from_file(path)
+        self.assertEqual([g.to_string() for g in collection2.gcps],
+                         [g.to_string() for g in collection.gcps])
+
+    def test_export_to_layer(self):
+        """
+        Test exporting GCPs to a layer
+        """
+        collection = GcpCollection()
+        for i in range(5):
+            collection.add_gcp(QgsPointXY(i, i), QgsPointXY(i + 10, i + 20),
+                               crs=QgsCoordinateReferenceSystem('EPSG:3857'))
+
+        path = os.path.join(tempfile.mkdtemp(), 'gcps.gpkg')
+        new_filename, new_layer, error = collection.export_to_layer(path, batch_size=2)
+        self.assertFalse(error)
+        self.assertEqual(new_layer, 'gcps')
+
+        layer = QgsVectorLayer(f'{new_filename}|layername={new_layer}', 'test')
+        self.assertTrue(layer.isValid())
+        self.assertEqual(layer.crs().authid(), 'EPSG:3857')
+        self.assertEqual(layer.featureCount(), 5)
+        self.assertEqual(sorted(f['row'] for f in layer.getFeatures()), [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(f.geometry().asWkt(0) for f in layer.getFeatures())[0],
+                         'LineString (0 0, 10 20)')
+
+    def test_manager_without_canvas(self):
+        """
+        Test a GCP manager can be used without a map canvas
+        """
+        manager = GcpManager()
+        manager.add_gcp(QgsPointXY(10, 11), QgsPointXY(20, 22), crs=QgsCoordinateReferenceSystem('EPSG:4326'))
+        self.assertEqual(manager.rowCount(), 1)
+        self.assertEqual(len(manager.collection), 1)
+        self.assertFalse(manager.rubber_bands)
+
+        manager.remove_rows([0])
+        self.assertEqual(manager.rowCount(), 0)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(GcpCollectionTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
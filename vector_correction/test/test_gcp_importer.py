@@ -0,0 +1,111 @@
+# coding=utf-8
+"""GCP Importer Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import tempfile
+import unittest
+
+from qgis.core import (
+    NULL,
+    QgsCoordinateReferenceSystem,
+    QgsFeature,
+    QgsGeometry,
+    QgsPointXY,
+    QgsVectorLayer
+)
+
+from vector_correction.core.gcp_collection import GcpCollection
+from vector_correction.core.gcp_importer import (
+    GcpImporter,
+    GcpImportException
+)
+from vector_correction.core.gcp_manager import GcpManager
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class GcpImporterTest(unittest.TestCase):
+    """Test GCP importer works."""
+
+    def test_line_layer(self):
+        """
+        Test importing GCPs from a line layer
+        """
+        layer = QgsVectorLayer('MultiLineString?crs=EPSG:3857', 'test', 'memory')
+        features = []
+        for wkt in ('MultiLineString((1 2, 5 5, 3 4), (10 20, 30 40))', 'MultiLineString((7 8, 9 10))'):
+            f = QgsFeature()
+            f.setGeometry(QgsGeometry.fromWkt(wkt))
+            features.append(f)
+        features.append(QgsFeature())
+        layer.dataProvider().addFeatures(features)
+
+        gcps = GcpImporter.from_layer(layer)
+        self.assertEqual([g.to_string() for g in gcps],
+                         ['1.0,2.0,3.0,4.0,EPSG:3857',
+                          '10.0,20.0,30.0,40.0,EPSG:3857',
+                          '7.0,8.0,9.0,10.0,EPSG:3857'])
+
+        with self.assertRaises(GcpImportException):
+            GcpImporter.from_line_layer(QgsVectorLayer('Point?crs=EPSG:3857', 'test', 'memory'))
+
+    def test_point_pair_table(self):
+        """
+        Test importing GCPs from a point pair table
+        """
+        layer = QgsVectorLayer('None?field=source_x:double&field=source_y:double&field=dest_x:double'
+                               '&field=dest_y:double', 'test', 'memory')
+        features = []
+        for attributes in ([1, 2, 3, 4], [5, 6, NULL, 8], [9, 10, 11, 12]):
+            f = QgsFeature(layer.fields())
+            f.setAttributes(attributes)
+            features.append(f)
+        layer.dataProvider().addFeatures(features)
+
+        with self.assertRaises(GcpImportException):
+            GcpImporter.from_layer(layer)
+
+        gcps = GcpImporter.from_layer(layer, QgsCoordinateReferenceSystem('EPSG:4326'))
+        self.assertEqual([g.to_string() for g in gcps],
+                         ['1.0,2.0,3.0,4.0,EPSG:4326',
+                          '9.0,10.0,11.0,12.0,EPSG:4326'])
+
+    def test_round_trip(self):
+        """
+        Test importing GCPs from an exported layer
+        """
+        collection = GcpCollection()
+        for i in range(5):
+            collection.add_gcp(QgsPointXY(i, i), QgsPointXY(i + 10, i + 20),
+                               crs=QgsCoordinateReferenceSystem('EPSG:3857'))
+
+        path = os.path.join(tempfile.mkdtemp(), 'gcps.gpkg')
+        new_filename, new_layer, _ = collection.export_to_layer(path)
+
+        manager = GcpManager()
+        self.assertEqual(manager.import_from_layer(QgsVectorLayer(f'{new_filename}|layername={new_layer}', 'test')),
+                         5)
+        self.assertEqual(manager.rowCount(), 5)
+        self.assertEqual([g.to_string() for g in manager.gcps],
+                         [g.to_string() for g in collection.gcps])
+        self.assertEqual(manager.collection.fingerprint(), collection.fingerprint())
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(GcpImporterTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
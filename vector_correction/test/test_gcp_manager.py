@@ -16,11 +16,17 @@ __revision__ = '$Format:%H$'
 
 import unittest
 
-from qgis.analysis import QgsGcpTransformerInterface
+from qgis.analysis import (
+    QgsGcpGeometryTransformer,
+    QgsGcpTransformerInterface
+)
 from qgis.core import (
+    QgsGeometry,
     QgsPointXY,
     QgsCoordinateReferenceSystem,
-    QgsSettings
+    QgsCoordinateTransform,
+    QgsProject,
+    QgsRectangle
 )
 from qgis.gui import QgsMapCanvas
 
@@ -30,6 +36,7 @@ from vector_correction.core.gcp_manager import (
     NotEnoughGcpsException,
     TransformCreationException
 )
+from vector_correction.core.settings_registry import SettingsRegistry
 from .utilities import get_qgis_app
 
 QGIS_APP = get_qgis_app()
@@ -104,9 +111,7 @@ class GCPManagerTest(unittest.TestCase):
         Test creating transforms
         """
 
-        settings = QgsSettings()
-        settings.setValue('vector_corrections/method', int(QgsGcpTransformerInterface.TransformMethod.PolynomialOrder1),
-                          QgsSettings.Plugins)
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.PolynomialOrder1)
 
         canvas = QgsMapCanvas()
         manager = GcpManager(canvas)
@@ -128,6 +133,96 @@ class GCPManagerTest(unittest.TestCase):
         with self.assertRaises(TransformCreationException):
             manager.to_gcp_transformer(QgsCoordinateReferenceSystem('EPSG:4326'))
 
+    def test_transform_vertices_in_extent(self):
+        """
+        Test transforming vertices with a QgsGcpGeometryTransformer
+        """
+        transformer = QgsGcpGeometryTransformer(QgsGcpTransformerInterface.TransformMethod.Helmert,
+                                                [QgsPointXY(0, 0), QgsPointXY(100, 0)],
+                                                [QgsPointXY(10, 0), QgsPointXY(110, 0)])
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        res = GcpManager.transform_vertices_in_extent(transformer,
+                                                      QgsGeometry.fromWkt('LineString(50 50, 500 50)'),
+                                                      QgsRectangle(0, 0, 200, 200),
+                                                      QgsCoordinateTransform(crs, crs, QgsProject.instance()))
+        self.assertEqual(res.asWkt(0), 'LineString (60 50, 500 50)')
+
+    def test_spatial_index(self):
+        """
+        Test spatial queries
+        """
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        manager = GcpManager()
+        self.assertEqual(manager.nearest_gcp_row(QgsPointXY(0, 0), crs), -1)
+        self.assertEqual(manager.gcp_rows_in_rect(QgsRectangle(0, 0, 100, 100), crs), [])
+
+        for i in range(10):
+            manager.add_gcp(QgsPointXY(i * 100, 0), QgsPointXY(i * 100, 50), crs)
+
+        self.assertEqual(manager.nearest_gcp_row(QgsPointXY(310, 5), crs), 3)
+        # destination points are also searched
+        self.assertEqual(manager.nearest_gcp_row(QgsPointXY(690, 45), crs), 7)
+        self.assertEqual(manager.nearest_gcp_row(QgsPointXY(690, 45), crs, max_distance=5), -1)
+        self.assertEqual(manager.nearest_gcp_rows(QgsPointXY(420, 0), crs, 3), [4, 5, 3])
+        self.assertEqual(manager.gcp_rows_in_rect(QgsRectangle(150, 40, 450, 60), crs), [2, 3, 4])
+
+        # query in another crs
+        ct = QgsCoordinateTransform(crs, QgsCoordinateReferenceSystem('EPSG:4326'), QgsProject.instance())
+        self.assertEqual(manager.nearest_gcp_row(ct.transform(QgsPointXY(310, 5)),
+                                                 QgsCoordinateReferenceSystem('EPSG:4326')), 3)
+
+        # the index is updated as rows are removed and added
+        manager.remove_rows([0, 3])
+        self.assertEqual(manager.nearest_gcp_row(QgsPointXY(310, 5), crs), 2)
+        self.assertEqual(manager.gcp_rows_in_rect(QgsRectangle(150, 40, 450, 60), crs), [1, 2])
+        manager.add_gcp(QgsPointXY(300, 0), QgsPointXY(300, 10), crs)
+        self.assertEqual(manager.nearest_gcp_row(QgsPointXY(300, 5), crs), 8)
+
+        manager.clear()
+        self.assertEqual(manager.nearest_gcp_row(QgsPointXY(310, 5), crs), -1)
+
+    def test_batch(self):
+        """
+        Test batching updates
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        canvas = QgsMapCanvas()
+        manager = GcpManager(canvas)
+
+        inserted = []
+        manager.rowsInserted.connect(lambda *args: inserted.append(args))
+        reset = []
+        manager.modelReset.connect(lambda: reset.append(True))
+
+        with manager.batch():
+            with manager.batch():
+                for i in range(10):
+                    manager.add_gcp(QgsPointXY(i * 100, 0), QgsPointXY(i * 100 + 10, 5), crs)
+            self.assertTrue(manager.in_batch())
+            self.assertEqual(manager.rowCount(), 10)
+            # deferred
+            self.assertFalse(manager.rubber_bands)
+            self.assertIsNone(manager.gcps[0].residual)
+            manager.remove_rows([0, 1])
+            # the spatial index is always kept up to date
+            self.assertEqual(manager.nearest_gcp_row(QgsPointXY(210, 5), crs), 0)
+
+        self.assertFalse(manager.in_batch())
+        self.assertFalse(inserted)
+        self.assertEqual(len(reset), 1)
+        self.assertEqual(manager.rowCount(), 8)
+        self.assertEqual(len(manager.rubber_bands), 8)
+        self.assertEqual(manager.data(manager.index(0, GcpManager.COLUMN_RESIDUAL)), '0.00')
+
+        with manager.batch():
+            manager.clear()
+            manager.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 5), crs)
+        self.assertEqual(manager.rowCount(), 1)
+        self.assertEqual(len(manager.rubber_bands), 1)
+        self.assertEqual(len(reset), 2)
+
 
 if __name__ == "__main__":
     suite = unittest.makeSuite(GCPManagerTest)
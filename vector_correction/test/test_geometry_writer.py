@@ -0,0 +1,124 @@
+# coding=utf-8
+"""Geometry Writer Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import unittest
+
+from qgis.core import (
+    QgsFeature,
+    QgsGeometry,
+    QgsVectorLayer
+)
+
+from vector_correction.core.geometry_writer import GeometryWriter
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class GeometryWriterTest(unittest.TestCase):
+    """Test geometry writers work."""
+
+    @staticmethod
+    def create_layer() -> QgsVectorLayer:
+        """
+        Creates a test layer with a few point features
+        """
+        layer = QgsVectorLayer('Point?crs=EPSG:3857', 'test', 'memory')
+        features = []
+        for i in range(5):
+            f = QgsFeature()
+            f.setGeometry(QgsGeometry.fromWkt(f'Point({i} {i})'))
+            features.append(f)
+        layer.dataProvider().addFeatures(features)
+        return layer
+
+    def test_write_per_feature(self):
+        """
+        Test writing geometries one by one
+        """
+        layer = self.create_layer()
+        layer.startEditing()
+        ids = [f.id() for f in layer.getFeatures()]
+
+        self.assertTrue(GeometryWriter.write_per_feature(layer, {
+            ids[0]: QgsGeometry.fromWkt('Point(10 10)'),
+            ids[1]: QgsGeometry.fromWkt('Point(11 11)')
+        }, 'correct'))
+
+        self.assertEqual(layer.getFeature(ids[0]).geometry().asWkt(), 'Point (10 10)')
+        self.assertEqual(layer.getFeature(ids[1]).geometry().asWkt(), 'Point (11 11)')
+        self.assertEqual(layer.undoStack().count(), 1)
+
+    def test_write_bulk(self):
+        """
+        Test writing geometries in bulk
+        """
+        layer = self.create_layer()
+        layer.startEditing()
+        ids = [f.id() for f in layer.getFeatures()]
+
+        geometry_changed = []
+        layer.geometryChanged.connect(lambda fid, geometry: geometry_changed.append(fid))
+        data_changed = []
+        layer.dataChanged.connect(lambda: data_changed.append(True))
+
+        self.assertTrue(GeometryWriter.write_bulk(layer, {
+            ids[0]: QgsGeometry.fromWkt('Point(10 10)'),
+            ids[1]: QgsGeometry.fromWkt('Point(11 11)'),
+            ids[2]: QgsGeometry.fromWkt('Point(12 12)')
+        }, 'correct'))
+
+        self.assertEqual(layer.getFeature(ids[0]).geometry().asWkt(), 'Point (10 10)')
+        self.assertEqual(layer.getFeature(ids[1]).geometry().asWkt(), 'Point (11 11)')
+        self.assertEqual(layer.getFeature(ids[2]).geometry().asWkt(), 'Point (12 12)')
+        self.assertEqual(layer.getFeature(ids[3]).geometry().asWkt(), 'Point (3 3)')
+
+        # no per feature signals, just one refresh
+        self.assertFalse(geometry_changed)
+        self.assertEqual(len(data_changed), 1)
+
+        # all changes should be undone in one step
+        self.assertEqual(layer.undoStack().count(), 1)
+        layer.undoStack().undo()
+        self.assertEqual(layer.getFeature(ids[0]).geometry().asWkt(), 'Point (0 0)')
+        self.assertEqual(layer.getFeature(ids[2]).geometry().asWkt(), 'Point (2 2)')
+
+        # nothing to write
+        self.assertTrue(GeometryWriter.write_bulk(layer, {}, 'correct'))
+        self.assertEqual(layer.undoStack().index(), 0)
+
+    def test_write_bulk_failed(self):
+        """
+        Test that features which could not be changed are reported
+        """
+        layer = self.create_layer()
+        layer.startEditing()
+        ids = [f.id() for f in layer.getFeatures()]
+
+        # negative IDs are uncommitted new features, and there are none
+        failed_ids = set()
+        self.assertFalse(GeometryWriter.write_bulk(layer, {
+            ids[0]: QgsGeometry.fromWkt('Point(10 10)'),
+            -100: QgsGeometry.fromWkt('Point(11 11)')
+        }, 'correct', failed_ids))
+        self.assertEqual(failed_ids, {-100})
+        self.assertEqual(layer.getFeature(ids[0]).geometry().asWkt(), 'Point (10 10)')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(GeometryWriterTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,569 @@
+# coding=utf-8
+"""Layer Corrector Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import tempfile
+import unittest
+
+from qgis.analysis import QgsGcpTransformerInterface
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsFeedback,
+    QgsGeometry,
+    QgsPointXY,
+    QgsRectangle,
+    QgsVectorFileWriter,
+    QgsVectorLayer
+)
+
+from vector_correction.core.correction_checkpoint import CorrectionCheckpoint
+from vector_correction.core.correction_history import CorrectionHistory
+from vector_correction.core.gcp_collection import GcpCollection
+from vector_correction.core.layer_corrector import (
+    CorrectionException,
+    LayerCorrector
+)
+from vector_correction.core.profiler import Profiler
+from vector_correction.core.settings_registry import SettingsRegistry
+from vector_correction.core.transform_methods import TransformMethods
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class LayerCorrectorTest(unittest.TestCase):
+    """Test layer corrector works."""
+
+    @staticmethod
+    def create_layer() -> QgsVectorLayer:
+        """
+        Creates a test layer with point features, of which the first three are inside the test extent
+        """
+        layer = QgsVectorLayer('Point?crs=EPSG:3857', 'test', 'memory')
+        features = []
+        for x in (10, 20, 30, 500, 600):
+            f = QgsFeature()
+            f.setGeometry(QgsGeometry.fromWkt(f'Point({x} {x})'))
+            features.append(f)
+        layer.dataProvider().addFeatures(features)
+        return layer
+
+    @staticmethod
+    def create_corrector() -> LayerCorrector:
+        """
+        Creates a corrector which shifts features within the test extent 10 units to the right
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 0), crs=crs)
+        return LayerCorrector(collection, QgsRectangle(0, 0, 200, 200), crs)
+
+    @staticmethod
+    def geometries(layer: QgsVectorLayer):
+        """
+        Returns the WKT of all features from a layer
+        """
+        return sorted(f.geometry().asWkt(0) for f in layer.getFeatures())
+
+    def test_edit_buffer(self):
+        """
+        Test correcting via the edit buffer
+        """
+        layer = self.create_layer()
+        corrector = self.create_corrector()
+
+        with self.assertRaises(CorrectionException):
+            corrector.correct_layer(layer)
+
+        layer.startEditing()
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.feature_count, 3)
+        self.assertEqual(statistics.changed_feature_count, 3)
+        self.assertEqual(statistics.changed_vertex_count, 3)
+        self.assertEqual(self.geometries(layer),
+                         ['Point (20 10)', 'Point (30 20)', 'Point (40 30)', 'Point (500 500)', 'Point (600 600)'])
+        self.assertEqual(layer.undoStack().count(), 1)
+
+        # dry runs must not change the layer
+        layer.rollBack()
+        layer.startEditing()
+        corrector.dry_run = True
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 3)
+        self.assertFalse(layer.isModified())
+
+    def test_edit_buffer_failed_writes(self):
+        """
+        Test that features which could not be changed are not counted as corrected
+        """
+
+        class RejectingLayer(QgsVectorLayer):
+            """
+            Layer which refuses to change the geometry of one feature
+            """
+
+            rejected_id = None
+
+            def changeGeometry(self, fid, geometry, skipDefaultValue=False):  # pylint: disable=invalid-name
+                """
+                Changes a feature's geometry, unless it is the rejected feature
+                """
+                if fid == self.rejected_id:
+                    return False
+                return super().changeGeometry(fid, geometry, skipDefaultValue)
+
+        layer = RejectingLayer('Point?crs=EPSG:3857', 'test', 'memory')
+        features = []
+        for x in (10, 20, 30):
+            f = QgsFeature()
+            f.setGeometry(QgsGeometry.fromWkt(f'Point({x} {x})'))
+            features.append(f)
+        layer.dataProvider().addFeatures(features)
+        layer.rejected_id = next(f.id() for f in layer.getFeatures() if f.geometry().asPoint().x() == 20)
+        layer.startEditing()
+
+        SettingsRegistry.set_transform_method(TransformMethods.PIECEWISE_AFFINE)
+        SettingsRegistry.set_use_displacement_grid(False)
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        for x in range(0, 201, 100):
+            for y in range(0, 201, 100):
+                collection.add_gcp(QgsPointXY(x, y), QgsPointXY(x + 10, y), crs=crs)
+        corrector = LayerCorrector(collection, QgsRectangle(0, 0, 200, 200), crs)
+        corrector.history = CorrectionHistory(layer)
+
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 2)
+        self.assertEqual(statistics.failed_feature_count, 1)
+        self.assertEqual(self.geometries(layer), ['Point (20 10)', 'Point (20 20)', 'Point (40 30)'])
+        # the unchanged feature must not be recorded as corrected
+        self.assertNotIn(layer.rejected_id, corrector.history.original_geometries)
+        self.assertEqual(len(corrector.history.original_geometries), 2)
+
+        # a failed update leaves the layer matching neither correction, so the history is discarded
+        for gcp in collection.gcps:
+            gcp.destination = QgsPointXY(gcp.origin.x() + 15, gcp.origin.y())
+        collection.gcps_changed()
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.failed_feature_count, 1)
+        self.assertFalse(corrector.history.is_valid())
+
+        # tiled corrections also skip failed features
+        layer.rollBack()
+        layer.startEditing()
+        corrector.history = None
+        corrector.tile_size = 50
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 2)
+        self.assertEqual(statistics.failed_feature_count, 1)
+
+    def test_provider(self):
+        """
+        Test correcting directly via the data provider
+        """
+        layer = self.create_layer()
+        corrector = self.create_corrector()
+        corrector.write_to_provider = True
+        corrector.batch_size = 2
+
+        layer.startEditing()
+        with self.assertRaises(CorrectionException):
+            corrector.correct_layer(layer)
+        layer.rollBack()
+
+        corrector.dry_run = True
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 3)
+        self.assertEqual(self.geometries(layer),
+                         ['Point (10 10)', 'Point (20 20)', 'Point (30 30)', 'Point (500 500)', 'Point (600 600)'])
+
+        corrector.dry_run = False
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.feature_count, 3)
+        self.assertEqual(statistics.changed_feature_count, 3)
+        self.assertEqual(self.geometries(layer),
+                         ['Point (20 10)', 'Point (30 20)', 'Point (40 30)', 'Point (500 500)', 'Point (600 600)'])
+        self.assertFalse(layer.isModified())
+
+    def test_provider_transaction(self):
+        """
+        Test correcting directly via a data provider which supports transactions
+        """
+        path = os.path.join(tempfile.mkdtemp(), 'test.gpkg')
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = 'GPKG'
+        QgsVectorFileWriter.writeAsVectorFormatV3(self.create_layer(), path,
+                                                  QgsCoordinateTransformContext(), options)
+        layer = QgsVectorLayer(path, 'test')
+        self.assertTrue(layer.isValid())
+
+        corrector = self.create_corrector()
+        corrector.write_to_provider = True
+        corrector.batch_size = 2
+
+        # dry runs are rolled back
+        corrector.dry_run = True
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 3)
+        self.assertEqual(self.geometries(layer),
+                         ['Point (10 10)', 'Point (20 20)', 'Point (30 30)', 'Point (500 500)', 'Point (600 600)'])
+
+        corrector.dry_run = False
+        corrector.correct_layer(layer)
+        self.assertEqual(self.geometries(QgsVectorLayer(path, 'test2')),
+                         ['Point (20 10)', 'Point (30 20)', 'Point (40 30)', 'Point (500 500)', 'Point (600 600)'])
+
+    def test_profiler(self):
+        """
+        Test profiling corrections
+        """
+        layer = self.create_layer()
+        corrector = self.create_corrector()
+        corrector.profiler = Profiler()
+        corrector.write_to_provider = True
+        corrector.batch_size = 2
+        corrector.correct_layer(layer)
+
+        for stage in ('total', 'fetch', 'fetch/ids', 'fit', 'transform', 'transform/gcp_transform', 'write', 'commit'):
+            self.assertIn(stage, corrector.profiler.timings)
+        # the layer is in the GCP CRS, so no vertices are reprojected
+        self.assertNotIn('transform/reprojection', corrector.profiler.timings)
+        self.assertNotIn('vertex_reprojections', corrector.profiler.counters)
+        self.assertEqual(corrector.profiler.counters['features'], 3)
+        self.assertEqual(corrector.profiler.counters['batches'], 2)
+        self.assertEqual(corrector.profiler.counters['vertex_transforms'], 3)
+        self.assertEqual(corrector.profiler.counters['fits'], 1)
+        self.assertEqual(corrector.profiler.counters['shared_transformer_hits'], 2)
+
+        # the fitted transform is reused
+        corrector.profiler.clear()
+        corrector.correct_layer(layer)
+        self.assertNotIn('fit', corrector.profiler.timings)
+        self.assertNotIn('fits', corrector.profiler.counters)
+        self.assertEqual(corrector.profiler.counters['shared_transformer_hits'], 3)
+        self.assertIn('fetch', corrector.profiler.report())
+
+    def test_shared_transformer(self):
+        """
+        Test that a transformer is fitted only once for all layers
+        """
+        corrector = self.create_corrector()
+        corrector.profiler = Profiler()
+        for _ in range(10):
+            layer = self.create_layer()
+            layer.startEditing()
+            corrector.correct_layer(layer)
+            self.assertEqual(self.geometries(layer),
+                             ['Point (20 10)', 'Point (30 20)', 'Point (40 30)', 'Point (500 500)',
+                              'Point (600 600)'])
+        self.assertEqual(corrector.profiler.counters['fits'], 1)
+
+        # layers in a different CRS share the transformer fitted in the GCP CRS
+        layer = QgsVectorLayer('Point?crs=EPSG:4326', 'test', 'memory')
+        f = QgsFeature()
+        f.setGeometry(QgsGeometry.fromWkt('Point(0.0001 0.0001)'))
+        layer.dataProvider().addFeatures([f])
+        layer.startEditing()
+        corrector.correct_layer(layer)
+        self.assertEqual(corrector.profiler.counters['fits'], 1)
+        self.assertTrue(corrector.layer_extent(layer).contains(QgsPointXY(0.0001, 0.0001)))
+        self.assertEqual(corrector.profiler.counters['geometry_reprojections'], 2)
+
+        # changing the GCPs requires a new fit
+        corrector.collection.add_gcp(QgsPointXY(0, 100), QgsPointXY(10, 100), crs=corrector.extent_crs)
+        layer = self.create_layer()
+        layer.startEditing()
+        corrector.correct_layer(layer)
+        self.assertEqual(corrector.profiler.counters['fits'], 2)
+
+    def test_tiles(self):
+        """
+        Test splitting the extent into tiles
+        """
+        corrector = self.create_corrector()
+        self.assertEqual([t.toString(0) for t in corrector.tiles()], ['0,0 : 200,200'])
+
+        corrector.tile_size = 80
+        self.assertEqual([t.toString(0) for t in corrector.tiles()],
+                         ['0,0 : 80,80', '80,0 : 160,80', '160,0 : 200,80',
+                          '0,80 : 80,160', '80,80 : 160,160', '160,80 : 200,160',
+                          '0,160 : 80,200', '80,160 : 160,200', '160,160 : 200,200'])
+
+    def test_tiled_correction(self):
+        """
+        Test correcting tile by tile
+        """
+        expected = ['Point (20 10)', 'Point (30 20)', 'Point (40 30)', 'Point (500 500)', 'Point (600 600)']
+
+        layer = self.create_layer()
+        corrector = self.create_corrector()
+        corrector.tile_size = 50
+        corrector.profiler = Profiler()
+        corrector.feedback = QgsFeedback()
+        layer.startEditing()
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.feature_count, 3)
+        self.assertEqual(statistics.changed_feature_count, 3)
+        self.assertEqual(self.geometries(layer), expected)
+        self.assertEqual(corrector.profiler.counters['tiles'], 16)
+        self.assertEqual(corrector.feedback.progress(), 100)
+        # all tiles are grouped into a single undo command
+        self.assertEqual(layer.undoStack().count(), 1)
+        layer.rollBack()
+
+        corrector.write_to_provider = True
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 3)
+        self.assertEqual(self.geometries(layer), expected)
+
+        # canceled corrections raise an exception
+        corrector.feedback = QgsFeedback()
+        corrector.feedback.cancel()
+        with self.assertRaises(CorrectionException):
+            corrector.correct_layer(layer)
+
+    def test_tiled_correction_exact_filter(self):
+        """
+        Test tiled correction of features which are not returned by the tile containing their bounding box center
+        """
+        source = QgsVectorLayer('LineString?crs=EPSG:3857', 'test', 'memory')
+        f = QgsFeature()
+        # the bounding box center (-95, -5) lies in the first tile, but the line only touches the top left tile
+        f.setGeometry(QgsGeometry.fromWkt('LineString(-200 -200, 10 190)'))
+        source.dataProvider().addFeature(f)
+
+        # OGR filters lines exactly, so only the tiles which the line touches return it
+        path = os.path.join(tempfile.mkdtemp(), 'test.gpkg')
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = 'GPKG'
+        QgsVectorFileWriter.writeAsVectorFormatV3(source, path, QgsCoordinateTransformContext(), options)
+        layer = QgsVectorLayer(path, 'test')
+        self.assertTrue(layer.isValid())
+
+        corrector = self.create_corrector()
+        corrector.tile_size = 50
+        layer.startEditing()
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 1)
+        self.assertEqual(self.geometries(layer), ['LineString (-200 -200, 20 190)'])
+        layer.rollBack()
+
+        corrector.write_to_provider = True
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 1)
+        self.assertEqual(self.geometries(layer), ['LineString (-200 -200, 20 190)'])
+
+    def test_checkpoint(self):
+        """
+        Test resuming an interrupted correction from a checkpoint
+        """
+        expected = ['Point (20 10)', 'Point (30 20)', 'Point (40 30)', 'Point (500 500)', 'Point (600 600)']
+        path = os.path.join(tempfile.mkdtemp(), 'checkpoint.txt')
+
+        for tile_size in (0, 50):
+            layer = self.create_layer()
+            corrector = self.create_corrector()
+            corrector.write_to_provider = True
+            corrector.batch_size = 2
+            corrector.tile_size = tile_size
+            corrector.checkpoint = CorrectionCheckpoint(path)
+
+            # cancel after the first batch (or tile) has been written
+            corrector.feedback = QgsFeedback()
+            corrector.feedback.progressChanged.connect(lambda progress, feedback=corrector.feedback:
+                                                       feedback.cancel() if progress > 0 else None)
+            with self.assertRaises(CorrectionException):
+                corrector.correct_layer(layer)
+            self.assertTrue(corrector.checkpoint.exists())
+            self.assertTrue(corrector.checkpoint.completed_ids)
+
+            # features which were already corrected must not be corrected again
+            corrector.feedback = None
+            statistics = corrector.correct_layer(layer)
+            self.assertTrue(corrector.checkpoint.resumed)
+            self.assertEqual(statistics.changed_feature_count, 3 - corrector.checkpoint.resumed_feature_count)
+            self.assertEqual(self.geometries(layer), expected)
+            self.assertFalse(corrector.checkpoint.exists())
+
+            # checkpoints are not used for dry runs
+            corrector.dry_run = True
+            corrector.correct_layer(layer)
+            self.assertFalse(corrector.checkpoint.exists())
+
+    def test_checkpoint_interrupted_write(self):
+        """
+        Test resuming a correction which was interrupted after writing a batch, but before recording it
+        """
+        expected = ['Point (20 10)', 'Point (30 20)', 'Point (40 30)', 'Point (500 500)', 'Point (600 600)']
+        path = os.path.join(tempfile.mkdtemp(), 'checkpoint.txt')
+
+        class InterruptedCheckpoint(CorrectionCheckpoint):
+            """
+            Simulates a crash immediately after the first batch has been written
+            """
+
+            def record(self, ids, tile=None):  # pylint: disable=missing-function-docstring
+                raise CorrectionException('interrupted')
+
+        for tile_size in (0, 50):
+            layer = self.create_layer()
+            corrector = self.create_corrector()
+            corrector.write_to_provider = True
+            corrector.batch_size = 2
+            corrector.tile_size = tile_size
+            corrector.checkpoint = InterruptedCheckpoint(path)
+            with self.assertRaises(CorrectionException):
+                corrector.correct_layer(layer)
+            # the first batch was saved
+            self.assertNotEqual(self.geometries(layer), self.geometries(self.create_layer()))
+
+            # features which were saved by the interrupted write must not be corrected again
+            corrector.checkpoint = CorrectionCheckpoint(path)
+            statistics = corrector.correct_layer(layer)
+            self.assertTrue(corrector.checkpoint.resumed)
+            self.assertTrue(corrector.checkpoint.resumed_feature_count)
+            self.assertEqual(statistics.changed_feature_count, 3 - corrector.checkpoint.resumed_feature_count)
+            self.assertEqual(self.geometries(layer), expected)
+            self.assertFalse(corrector.checkpoint.exists())
+
+    def test_influence_regions(self):
+        """
+        Test that only features which could be changed by a local transform are fetched
+        """
+        SettingsRegistry.set_transform_method(TransformMethods.PIECEWISE_AFFINE)
+        SettingsRegistry.set_use_displacement_grid(False)
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+
+        collection = GcpCollection()
+        for x in range(0, 401, 100):
+            for y in range(0, 401, 100):
+                destination = QgsPointXY(210, 200) if (x, y) == (200, 200) else QgsPointXY(x, y)
+                collection.add_gcp(QgsPointXY(x, y), destination, crs=crs)
+
+        for write_to_provider in (False, True):
+            layer = QgsVectorLayer('Point?crs=EPSG:3857', 'test', 'memory')
+            features = []
+            for x in range(0, 401, 25):
+                for y in range(0, 401, 25):
+                    f = QgsFeature()
+                    f.setGeometry(QgsGeometry.fromWkt(f'Point({x} {y})'))
+                    features.append(f)
+            layer.dataProvider().addFeatures(features)
+            if not write_to_provider:
+                layer.startEditing()
+
+            corrector = LayerCorrector(collection, QgsRectangle(0, 0, 400, 400), crs)
+            corrector.write_to_provider = write_to_provider
+            corrector.profiler = Profiler()
+            statistics = corrector.correct_layer(layer)
+
+            # only features near the displaced GCP are fetched
+            self.assertEqual(statistics.feature_count, 81)
+            self.assertGreater(statistics.changed_feature_count, 0)
+            self.assertIn('fetch/ids', corrector.profiler.timings)
+            self.assertGreater(corrector.profiler.counters['influence_regions'], 0)
+
+            geometries = self.geometries(layer)
+            self.assertIn('Point (210 200)', geometries)
+            self.assertNotIn('Point (200 200)', geometries)
+            self.assertIn('Point (0 0)', geometries)
+            self.assertIn('Point (400 400)', geometries)
+
+    def test_history(self):
+        """
+        Test updating a correction after the GCPs are changed
+        """
+        SettingsRegistry.set_transform_method(TransformMethods.PIECEWISE_AFFINE)
+        SettingsRegistry.set_use_displacement_grid(False)
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+
+        def create_grid_layer():
+            layer = QgsVectorLayer('Point?crs=EPSG:3857', 'test', 'memory')
+            features = []
+            for x in range(0, 401, 25):
+                for y in range(0, 401, 25):
+                    f = QgsFeature()
+                    f.setGeometry(QgsGeometry.fromWkt(f'Point({x} {y})'))
+                    features.append(f)
+            layer.dataProvider().addFeatures(features)
+            layer.startEditing()
+            return layer
+
+        def corrected(collection: GcpCollection):
+            layer = create_grid_layer()
+            LayerCorrector(collection, QgsRectangle(0, 0, 400, 400), crs).correct_layer(layer)
+            return self.geometries(layer)
+
+        collection = GcpCollection()
+        for x in range(0, 401, 100):
+            for y in range(0, 401, 100):
+                collection.add_gcp(QgsPointXY(x, y), QgsPointXY(x + 5, y), crs=crs)
+
+        layer = create_grid_layer()
+        history = CorrectionHistory(layer)
+        corrector = LayerCorrector(collection, QgsRectangle(0, 0, 400, 400), crs)
+        corrector.history = history
+        corrector.profiler = Profiler()
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 289)
+        self.assertTrue(history.is_valid())
+        self.assertEqual(len(history.original_geometries), 289)
+
+        # reapplying the same GCPs does nothing
+        corrector.profiler.clear()
+        statistics = corrector.correct_layer(layer)
+        self.assertEqual(statistics.changed_feature_count, 0)
+        self.assertEqual(corrector.profiler.counters['incremental_updates'], 1)
+        self.assertEqual(layer.undoStack().count(), 1)
+
+        # tweak an interior GCP, only features near it are recomputed
+        collection.gcps[12].destination = QgsPointXY(215, 210)
+        collection.gcps_changed()
+        corrector.profiler.clear()
+        corrector.correct_layer(layer)
+        self.assertLess(corrector.profiler.counters['features'], 100)
+        self.assertEqual(self.geometries(layer), corrected(collection))
+        self.assertEqual(layer.undoStack().count(), 2)
+
+        # and changing it back restores the original correction
+        collection.gcps[12].destination = QgsPointXY(205, 200)
+        collection.gcps_changed()
+        corrector.correct_layer(layer)
+        self.assertEqual(self.geometries(layer), corrected(collection))
+
+        # other edits clear the history
+        layer.undoStack().undo()
+        self.assertFalse(history.is_valid())
+
+        # as do corrections with global methods
+        layer.rollBack()
+        layer.startEditing()
+        corrector.correct_layer(layer)
+        self.assertTrue(history.is_valid())
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+        corrector.correct_layer(layer)
+        self.assertFalse(history.is_valid())
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(LayerCorrectorTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,83 @@
+# coding=utf-8
+"""Profiler Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import json
+import os
+import tempfile
+import unittest
+
+from vector_correction.core.profiler import (
+    NULL_PROFILER,
+    Profiler
+)
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class ProfilerTest(unittest.TestCase):
+    """Test profiler works."""
+
+    def test_profiler(self):
+        """
+        Test collecting timings and counters
+        """
+        profiler = Profiler()
+        self.assertTrue(profiler.enabled)
+        with profiler.stage('transform'):
+            with profiler.stage('transform/gcp'):
+                pass
+        with profiler.stage('transform'):
+            pass
+        profiler.add_time('write', 2)
+        profiler.count('features', 5)
+        profiler.count('features')
+
+        self.assertEqual(set(profiler.timings.keys()), {'transform', 'transform/gcp', 'write'})
+        self.assertEqual(profiler.timings['write'], 2)
+        self.assertEqual(profiler.counters, {'features': 6})
+        report = profiler.report().split('\n')
+        self.assertTrue(report[0].startswith('transform: '))
+        self.assertTrue(report[1].startswith('  gcp: '))
+        self.assertEqual(report[2:], ['write: 2000.0 ms', 'features: 6'])
+
+        path = os.path.join(tempfile.mkdtemp(), 'profile.json')
+        profiler.write_json(path)
+        with open(path, 'rt', encoding='utf8') as f:
+            self.assertEqual(json.load(f)['counters'], {'features': 6})
+
+        profiler.clear()
+        self.assertFalse(profiler.timings)
+        self.assertFalse(profiler.counters)
+
+    def test_null_profiler(self):
+        """
+        Test that the null profiler collects nothing
+        """
+        self.assertFalse(NULL_PROFILER.enabled)
+        with NULL_PROFILER.stage('transform'):
+            pass
+        NULL_PROFILER.add_time('write', 2)
+        NULL_PROFILER.count('features')
+        self.assertFalse(NULL_PROFILER.timings)
+        self.assertFalse(NULL_PROFILER.counters)
+        self.assertEqual(NULL_PROFILER.report(), '')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ProfilerTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,159 @@
+# coding=utf-8
+"""Robust Fitter Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+import random
+import unittest
+
+from qgis.analysis import QgsGcpTransformerInterface
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsPointXY
+)
+
+from vector_correction.core.gcp_collection import GcpCollection
+from vector_correction.core.gcp_manager import GcpManager
+from vector_correction.core.robust_fitter import RobustFitter
+from vector_correction.core.settings_registry import SettingsRegistry
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class RobustFitterTest(unittest.TestCase):
+    """Test robust fitter works."""
+
+    @staticmethod
+    def create_points(count: int, outliers):
+        """
+        Creates GCPs for a shift of (10, 20) with a little noise, and blunders at the specified indices
+        """
+        rng = random.Random(0)
+        origins = []
+        destinations = []
+        for i in range(count):
+            x = rng.uniform(0, 1000)
+            y = rng.uniform(0, 1000)
+            origins.append(QgsPointXY(x, y))
+            offset = 100 if i in outliers else 0
+            destinations.append(QgsPointXY(x + 10 + offset + rng.gauss(0, 0.1), y + 20 + rng.gauss(0, 0.1)))
+        return origins, destinations
+
+    def test_classify(self):
+        """
+        Test classifying residuals
+        """
+        self.assertEqual(RobustFitter.classify([1, 1.1, 0.9, 1, 50, None, math.inf]),
+                         [True, True, True, True, False, False, False])
+        self.assertEqual(RobustFitter.classify([0, 0, 0]), [True, True, True])
+        self.assertEqual(RobustFitter.classify([None]), [False])
+
+    def test_fit(self):
+        """
+        Test fitting with outliers
+        """
+        origins, destinations = self.create_points(100, {5, 50, 77})
+
+        transformer, inliers = RobustFitter.fit(QgsGcpTransformerInterface.TransformMethod.Helmert,
+                                                origins, destinations)
+        self.assertEqual([i for i, inlier in enumerate(inliers) if not inlier], [5, 50, 77])
+        ok, x, y = transformer.transform(100, 100)
+        self.assertTrue(ok)
+        self.assertAlmostEqual(x, 110, delta=0.1)
+        self.assertAlmostEqual(y, 120, delta=0.1)
+
+        # not enough points
+        transformer, inliers = RobustFitter.fit(QgsGcpTransformerInterface.TransformMethod.Helmert,
+                                                origins[:1], destinations[:1])
+        self.assertIsNone(transformer)
+        self.assertEqual(inliers, [False])
+
+        # if too few inliers remain to refit, the inliers which the returned transformer was fitted to are returned
+        transformer, inliers = RobustFitter.fit(QgsGcpTransformerInterface.TransformMethod.Helmert,
+                                                [QgsPointXY(0, 0), QgsPointXY(100, 0), QgsPointXY(0, 100)],
+                                                [QgsPointXY(10, 0), QgsPointXY(110, 5), QgsPointXY(5, 100)],
+                                                threshold=1e-6)
+        self.assertIsNotNone(transformer)
+        self.assertEqual(inliers, [True, True, True])
+
+    def test_collection(self):
+        """
+        Test robust fitting in a GCP collection
+        """
+        original_method = SettingsRegistry.transform_method()
+        original_robust = SettingsRegistry.robust_fitting()
+        try:
+            SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+            SettingsRegistry.set_robust_fitting(False)
+
+            crs = QgsCoordinateReferenceSystem('EPSG:3857')
+            collection = GcpCollection()
+            manager = GcpManager(collection=collection)
+            origins, destinations = self.create_points(20, {3})
+            for origin, destination in zip(origins, destinations):
+                manager.add_gcp(origin, destination, crs)
+
+            self.assertFalse(any(gcp.outlier for gcp in collection.gcps))
+            self.assertIsNone(manager.data(manager.index(3, GcpManager.COLUMN_STATUS)))
+            _, x, _ = collection.to_gcp_transformer(crs).transform(100, 100)
+            self.assertGreater(x, 112)
+
+            SettingsRegistry.set_robust_fitting(True)
+            manager.update_residuals()
+            self.assertEqual([i for i, gcp in enumerate(collection.gcps) if gcp.outlier], [3])
+            self.assertEqual(manager.data(manager.index(3, GcpManager.COLUMN_STATUS)), 'Outlier')
+            self.assertEqual(manager.data(manager.index(4, GcpManager.COLUMN_STATUS)), 'Inlier')
+            _, x, _ = collection.to_gcp_transformer(crs).transform(100, 100)
+            self.assertAlmostEqual(x, 110, delta=0.1)
+        finally:
+            SettingsRegistry.set_transform_method(original_method)
+            SettingsRegistry.set_robust_fitting(original_robust)
+
+    def test_collection_fitted_inliers(self):
+        """
+        Test that GCPs are flagged as outliers using the inliers of the fit, not the final residuals
+        """
+        original_method = SettingsRegistry.transform_method()
+        original_robust = SettingsRegistry.robust_fitting()
+        original_threshold = SettingsRegistry.outlier_threshold()
+        try:
+            SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Helmert)
+            SettingsRegistry.set_robust_fitting(True)
+            # with a tiny threshold every GCP is an outlier of the first fit, leaving too few to refit
+            SettingsRegistry.set_outlier_threshold(1e-6)
+
+            crs = QgsCoordinateReferenceSystem('EPSG:3857')
+            collection = GcpCollection()
+            collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+            collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 5), crs=crs)
+            collection.add_gcp(QgsPointXY(0, 100), QgsPointXY(5, 100), crs=crs)
+            collection.update_residuals()
+
+            # reclassifying the final residuals would flag every GCP...
+            self.assertEqual(RobustFitter.classify([gcp.residual for gcp in collection.gcps], 1e-6),
+                             [False, False, False])
+            # ...but the transformer was fitted to all of them
+            self.assertEqual([gcp.outlier for gcp in collection.gcps], [False, False, False])
+        finally:
+            SettingsRegistry.set_transform_method(original_method)
+            SettingsRegistry.set_robust_fitting(original_robust)
+            SettingsRegistry.set_outlier_threshold(original_threshold)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RobustFitterTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
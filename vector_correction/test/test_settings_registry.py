@@ -0,0 +1,65 @@
+# coding=utf-8
+"""Settings Registry Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2020 by Nyall Dawson'
+__date__ = '29/10/2020'
+__copyright__ = 'Copyright 2020, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import unittest
+
+from qgis.PyQt.QtGui import QColor
+from qgis.analysis import QgsGcpTransformerInterface
+from qgis.core import QgsSettings
+
+from vector_correction.core.settings_registry import SettingsRegistry
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class SettingsRegistryTest(unittest.TestCase):
+    """Test settings registry works."""
+
+    def test_transform_method(self):
+        """
+        Test transform method setting is cached
+        """
+        SettingsRegistry.set_transform_method(QgsGcpTransformerInterface.TransformMethod.Projective)
+        self.assertEqual(SettingsRegistry.transform_method(), QgsGcpTransformerInterface.TransformMethod.Projective)
+
+        # external changes are only picked up after invalidating the cache
+        QgsSettings().setValue('vector_corrections/method',
+                               int(QgsGcpTransformerInterface.TransformMethod.Linear),
+                               QgsSettings.Plugins)
+        self.assertEqual(SettingsRegistry.transform_method(), QgsGcpTransformerInterface.TransformMethod.Projective)
+        SettingsRegistry.invalidate_cache()
+        self.assertEqual(SettingsRegistry.transform_method(), QgsGcpTransformerInterface.TransformMethod.Linear)
+
+    def test_preview_color(self):
+        """
+        Test preview color setting is cached
+        """
+        SettingsRegistry.set_preview_color(QColor(255, 0, 0))
+        self.assertEqual(SettingsRegistry.preview_color().name(), '#ff0000')
+
+        # modifying the returned color must not modify the cached color
+        SettingsRegistry.preview_color().setRed(0)
+        self.assertEqual(SettingsRegistry.preview_color().name(), '#ff0000')
+
+        SettingsRegistry.invalidate_cache()
+        self.assertEqual(SettingsRegistry.preview_color().name(), '#ff0000')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(SettingsRegistryTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
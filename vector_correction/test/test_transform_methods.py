@@ -0,0 +1,338 @@
+# coding=utf-8
+"""Transform Methods Test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = '(C) 2021 by Nyall Dawson'
+__date__ = '22/02/2021'
+__copyright__ = 'Copyright 2021, North Road'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import math
+import random
+import unittest
+
+from qgis.analysis import QgsGcpTransformerInterface
+from qgis.core import (
+    QgsPointXY,
+    QgsCoordinateReferenceSystem,
+    QgsRectangle
+)
+
+from vector_correction.core.gcp_collection import (
+    GcpCollection,
+    TransformCreationException
+)
+from vector_correction.core.local_thin_plate_spline import LocalThinPlateSpline
+from vector_correction.core.piecewise_affine import PiecewiseAffine
+from vector_correction.core.settings_registry import SettingsRegistry
+from vector_correction.core.transform_methods import (
+    TransformMethods,
+    LocalThinPlateSplineTransformer,
+    PiecewiseAffineTransformer
+)
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class TransformMethodsTest(unittest.TestCase):
+    """Test transform methods work."""
+
+    def test_methods(self):
+        """
+        Test method registry
+        """
+        methods = TransformMethods.available_methods()
+        self.assertIn(QgsGcpTransformerInterface.TransformMethod.Helmert, methods)
+        self.assertIn(TransformMethods.LOCAL_THIN_PLATE_SPLINE, methods)
+
+        for method in methods:
+            self.assertEqual(TransformMethods.from_int(int(method)), method)
+            self.assertTrue(TransformMethods.method_to_string(method))
+            self.assertIsNotNone(TransformMethods.create(method))
+
+    def test_local_thin_plate_spline(self):
+        """
+        Test local thin plate spline interpolation
+        """
+        random.seed(1)
+
+        def warp(x, y):
+            return x + 5 * math.sin(x / 100), y + 3 * math.cos(y / 150)
+
+        source = [(random.uniform(0, 1000), random.uniform(0, 1000)) for _ in range(2000)]
+        destination = [warp(x, y) for x, y in source]
+        spline = LocalThinPlateSpline(source, destination)
+
+        # control points must be interpolated exactly
+        for (x, y), (expected_x, expected_y) in zip(source, destination):
+            transformed_x, transformed_y = spline.transform(x, y)
+            self.assertAlmostEqual(transformed_x, expected_x, 6)
+            self.assertAlmostEqual(transformed_y, expected_y, 6)
+
+        # and points between should closely follow the warp
+        for _ in range(100):
+            x, y = random.uniform(100, 900), random.uniform(100, 900)
+            transformed_x, transformed_y = spline.transform(x, y)
+            expected_x, expected_y = warp(x, y)
+            self.assertAlmostEqual(transformed_x, expected_x, 0)
+            self.assertAlmostEqual(transformed_y, expected_y, 0)
+
+        # colinear points cannot be fitted by a thin plate spline, but must still interpolate
+        spline = LocalThinPlateSpline([(i, 0) for i in range(20)], [(i + 1, 1) for i in range(20)])
+        self.assertEqual(spline.transform(3, 0), (4, 1))
+        self.assertEqual(spline.transform(100, 100), (101, 101))
+
+    def test_local_thin_plate_spline_transformer(self):
+        """
+        Test local thin plate spline via a GCP collection
+        """
+        SettingsRegistry.set_transform_method(TransformMethods.LOCAL_THIN_PLATE_SPLINE)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(10, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 0), QgsPointXY(110, 5), crs=crs)
+        collection.add_gcp(QgsPointXY(100, 100), QgsPointXY(110, 100), crs=crs)
+        collection.add_gcp(QgsPointXY(0, 100), QgsPointXY(5, 95), crs=crs)
+
+        transformer = collection.to_gcp_transformer(crs)
+        self.assertEqual(transformer.method(), TransformMethods.LOCAL_THIN_PLATE_SPLINE)
+        ok, x, y = transformer.transform(100, 0)
+        self.assertTrue(ok)
+        self.assertAlmostEqual(x, 110, 6)
+        self.assertAlmostEqual(y, 5, 6)
+
+        ok, x, y = transformer.transform(110, 5, True)
+        self.assertTrue(ok)
+        self.assertAlmostEqual(x, 100, 6)
+        self.assertAlmostEqual(y, 0, 6)
+
+        collection.update_residuals()
+        for gcp in collection.gcps:
+            self.assertAlmostEqual(gcp.residual, 0, 6)
+
+    def test_piecewise_affine(self):
+        """
+        Test piecewise affine interpolation
+        """
+        source = [(0, 0), (10, 0), (10, 10), (0, 10)]
+        destination = [(1, 0), (11, 0), (12, 12), (1, 10)]
+        spline = PiecewiseAffine(source, destination, [(0, 1, 2), (0, 2, 3)])
+        self.assertTrue(spline)
+
+        for (x, y), expected in zip(source, destination):
+            self.assertEqual(spline.transform(x, y), expected)
+
+        # each point is transformed by the affine transform of its triangle
+        x, y = spline.transform(5, 1)
+        self.assertAlmostEqual(x, 6.1, 6)
+        self.assertAlmostEqual(y, 1.2, 6)
+        x, y = spline.transform(2, 8)
+        self.assertAlmostEqual(x, 3.2, 6)
+        self.assertAlmostEqual(y, 8.4, 6)
+
+        # edges which don't touch the moved point are unaffected by it
+        x, y = spline.transform(0, 5)
+        self.assertAlmostEqual(x, 1, 6)
+        self.assertAlmostEqual(y, 5, 6)
+
+        # points outside the triangulation are extrapolated from the nearest triangle
+        x, y = spline.transform(-10, 5)
+        self.assertAlmostEqual(x, -10, 6)
+        self.assertAlmostEqual(y, 3, 6)
+
+        # degenerate triangulations
+        self.assertFalse(PiecewiseAffine([(0, 0), (1, 1), (2, 2)], [(0, 0), (1, 1), (2, 2)], [(0, 1, 2)]))
+
+    def test_piecewise_affine_extrapolation(self):
+        """
+        Test that points outside the triangulation are only extrapolated from triangles on its boundary
+        """
+        # a small interior triangle close to the bottom edge of a large triangle
+        source = [(-100, 0), (100, 0), (0, 100), (4, 0.5), (6, 0.5), (5, 1.5)]
+        destination = [(-100, 0), (100, 0), (0, 100), (5, 0.5), (7, 0.5), (6, 1.5)]
+        triangles = [(3, 4, 5), (0, 1, 4), (0, 4, 3), (1, 2, 5), (1, 5, 4), (2, 0, 3), (2, 3, 5)]
+        spline = PiecewiseAffine(source, destination, triangles)
+
+        # the nearest triangle centroid to this point is the interior triangle's, but the point
+        # must be extrapolated from the triangle on the nearest boundary edge
+        self.assertEqual(spline.triangle_for_point(5, -0.1).vertices, (0, 1, 4))
+        x, y = spline.transform(5, -0.1)
+        self.assertAlmostEqual(x, 4.8, 6)
+        self.assertAlmostEqual(y, -0.1, 6)
+
+        self.assertEqual(spline.triangle_for_point(100, 50).vertices, (1, 2, 5))
+        self.assertEqual(spline.triangle_for_point(0, -50).vertices, (0, 1, 4))
+
+    def test_triangulate(self):
+        """
+        Test Delaunay triangulation of GCPs
+        """
+        triangles = PiecewiseAffineTransformer.triangulate([(0, 0), (10, 0), (10, 10), (0, 10), (5, 5), (0, 0)])
+        self.assertEqual(len(triangles), 4)
+        for triangle in triangles:
+            self.assertIn(4, triangle)
+            self.assertNotIn(5, triangle)
+
+        self.assertFalse(PiecewiseAffineTransformer.triangulate([(0, 0), (1, 1), (2, 2)]))
+
+    def test_piecewise_affine_transformer(self):
+        """
+        Test piecewise affine via a GCP collection
+        """
+        SettingsRegistry.set_transform_method(TransformMethods.PIECEWISE_AFFINE)
+
+        crs = QgsCoordinateReferenceSystem('EPSG:3857')
+        collection = GcpCollection()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(1, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(10, 0), QgsPointXY(11, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(10, 10), QgsPointXY(12, 12), crs=crs)
+        collection.add_gcp(QgsPointXY(0, 10), QgsPointXY(1, 10), crs=crs)
+
+        transformer = collection.to_gcp_transformer(crs)
+        ok, x, y = transformer.transform(10, 10)
+        self.assertTrue(ok)
+        self.assertAlmostEqual(x, 12, 6)
+        self.assertAlmostEqual(y, 12, 6)
+
+        ok, x, y = transformer.transform(12, 12, True)
+        self.assertTrue(ok)
+        self.assertAlmostEqual(x, 10, 6)
+        self.assertAlmostEqual(y, 10, 6)
+
+        collection.clear()
+        collection.add_gcp(QgsPointXY(0, 0), QgsPointXY(1, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(10, 10), QgsPointXY(11, 0), crs=crs)
+        collection.add_gcp(QgsPointXY(20, 20), QgsPointXY(12, 12), crs=crs)
+        with self.assertRaises(TransformCreationException):
+            collection.to_gcp_transformer(crs)
+
+    @staticmethod
+    def fit(transformer_class, source, destination):
+        """
+        Fits a plugin transformer to lists of (x, y) points
+        """
+        transformer = transformer_class()
+        transformer.updateParametersFromGcps([QgsPointXY(*p) for p in source],
+                                             [QgsPointXY(*p) for p in destination])
+        return transformer
+
+    def test_local_thin_plate_spline_changed_region(self):
+        """
+        Test calculating the region affected by changes to a local thin plate spline
+        """
+        source = [(x * 100, y * 100) for x in range(10) for y in range(10)]
+        destination = [(x + 5, y) for x, y in source]
+        previous = self.fit(LocalThinPlateSplineTransformer, source, destination)
+        self.assertTrue(previous.is_local())
+        self.assertTrue(previous.changed_region(self.fit(LocalThinPlateSplineTransformer, source,
+                                                         destination)).isEmpty())
+
+        # tweak an interior GCP
+        tweaked = list(destination)
+        tweaked[source.index((400, 400))] = (410, 410)
+        transformer = self.fit(LocalThinPlateSplineTransformer, source, tweaked)
+        region = transformer.changed_region(previous)
+        self.assertEqual(region.toString(0), '180,180 : 720,720')
+
+        # results outside the region must be unchanged
+        random.seed(1)
+        for _ in range(500):
+            x, y = random.uniform(-100, 1000), random.uniform(-100, 1000)
+            if region.contains(QgsPointXY(x, y)):
+                continue
+            self.assertEqual(transformer.transform(x, y), previous.transform(x, y))
+
+        # adding a GCP changes the grid, so everything may change
+        self.assertIsNone(self.fit(LocalThinPlateSplineTransformer, source + [(450, 450)],
+                                   destination + [(455, 450)]).changed_region(previous))
+        # as do changes to GCPs along the edge of the grid
+        tweaked = list(destination)
+        tweaked[0] = (10, 10)
+        self.assertIsNone(self.fit(LocalThinPlateSplineTransformer, source, tweaked).changed_region(previous))
+        self.assertIsNone(transformer.changed_region(self.fit(PiecewiseAffineTransformer, source, destination)))
+
+    def test_piecewise_affine_changed_region(self):
+        """
+        Test calculating the region affected by changes to a piecewise affine transform
+        """
+        random.seed(2)
+        source = [(x * 100 + random.uniform(-10, 10), y * 100 + random.uniform(-10, 10))
+                  for x in range(6) for y in range(6)]
+        destination = [(x + 5, y) for x, y in source]
+        previous = self.fit(PiecewiseAffineTransformer, source, destination)
+        self.assertTrue(previous.is_local())
+        self.assertTrue(previous.changed_region(self.fit(PiecewiseAffineTransformer, source,
+                                                         destination)).isEmpty())
+
+        # tweak an interior GCP
+        index = 2 * 6 + 2
+        tweaked = list(destination)
+        tweaked[index] = (source[index][0] + 10, source[index][1] + 10)
+        transformer = self.fit(PiecewiseAffineTransformer, source, tweaked)
+        region = transformer.changed_region(previous)
+        self.assertTrue(region.contains(QgsPointXY(*source[index])))
+        self.assertTrue(QgsRectangle(50, 50, 350, 350).contains(region))
+
+        # add an interior GCP
+        transformer = self.fit(PiecewiseAffineTransformer, source + [(250, 250)], destination + [(255, 250)])
+        region = transformer.changed_region(previous)
+        self.assertTrue(region.contains(QgsPointXY(250, 250)))
+        self.assertTrue(QgsRectangle(50, 50, 450, 450).contains(region))
+
+        for changed_region in (transformer.changed_region(previous), previous.changed_region(transformer)):
+            for _ in range(500):
+                x, y = random.uniform(0, 500), random.uniform(0, 500)
+                if changed_region.contains(QgsPointXY(x, y)):
+                    continue
+                for a, b in zip(transformer.transform(x, y), previous.transform(x, y)):
+                    self.assertAlmostEqual(a, b, 6)
+
+        # changes to GCPs along the edge of the triangulation affect extrapolated points anywhere
+        tweaked = list(destination)
+        tweaked[0] = (0, 10)
+        self.assertIsNone(self.fit(PiecewiseAffineTransformer, source, tweaked).changed_region(previous))
+
+    def test_influence_regions(self):
+        """
+        Test calculating the regions outside of which transformers leave points unchanged
+        """
+        random.seed(3)
+        source = [(x * 100, y * 100) for x in range(10) for y in range(10)]
+        destination = list(source)
+        destination[source.index((400, 400))] = (410, 400)
+
+        for transformer_class in (LocalThinPlateSplineTransformer, PiecewiseAffineTransformer):
+            transformer = self.fit(transformer_class, source, destination)
+            regions = transformer.influence_regions()
+            self.assertTrue(regions)
+            self.assertTrue(any(region.contains(QgsPointXY(400, 400)) for region in regions))
+            for _ in range(500):
+                x, y = random.uniform(-100, 1000), random.uniform(-100, 1000)
+                if any(region.contains(QgsPointXY(x, y)) for region in regions):
+                    continue
+                ok, transformed_x, transformed_y = transformer.transform(x, y)
+                self.assertTrue(ok)
+                self.assertAlmostEqual(transformed_x, x, 6)
+                self.assertAlmostEqual(transformed_y, y, 6)
+
+            # displaced points along the edge can change points anywhere
+            edge_destination = list(destination)
+            edge_destination[0] = (10, 0)
+            self.assertIsNone(self.fit(transformer_class, source, edge_destination).influence_regions())
+
+            self.assertEqual(self.fit(transformer_class, source, source).influence_regions(), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(TransformMethodsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)